@@ -0,0 +1,281 @@
+import os
+import json
+import threading
+
+from Validatore import COLONNE, COLONNE_HEADER, PREV_HASH_GENESI
+from Merkle import radice_merkle_blocco
+from Scrittore import ScrittoreDB, apri_connessione
+from Codifica import riga_da_testo, TIMESTAMP_MINIMO, TIMESTAMP_MASSIMO
+from ArchivioLog import ArchivioLog
+
+
+# Archivi dei blocchi usati da Blockchain. Ogni archivio offre la stessa interfaccia:
+#   - esegui(funzione, *argomenti, peso): accoda funzione(transazione, *argomenti) allo scrittore, che esegue le
+#     scritture a gruppi, e restituisce un Future con il risultato, disponibile dopo il commit;
+#   - leggi(id), leggi_da_hash(digest) e leggi_ultimo(): la riga binaria del blocco (ordine di COLONNE) oppure None;
+#   - leggi_blocchi(da, a, dimensione_lotto) e leggi_header(da, a, dimensione_lotto): le righe (o le righe di header,
+#     ordine di COLONNE_HEADER) con id tra "da" e "a" a lotti;
+#   - cerca(tipo, da, a, dopo, limite): una pagina di righe filtrate per tipo e timestamp (vedi ArchivioSQLite.cerca);
+#   - limite_potatura(): l'id dell'ultimo blocco senza contenuto (0 se nessun blocco è stato potato, vedi Blockchain.pota);
+#   - dimensione(): i byte occupati su disco; chiudi(): conferma le scritture in attesa e ferma lo scrittore.
+# La transazione passata alle operazioni dello scrittore offre altezza(), hash_blocco(id) (digest binario o None),
+# inserisci(riga) (False se un blocco con lo stesso hash è già presente) e inserisci_righe(righe).
+# Solo ArchivioSQLite permette la potatura (apri_archivio con potatura=True): byte_contenuto(da) e, nella transazione,
+# lunghezze_contenuto(da, a), pota(da, a) e compatta(massimo).
+ARCHIVIO_SQLITE = "sqlite"
+ARCHIVIO_LOG = "log"
+ARCHIVI = (ARCHIVIO_SQLITE, ARCHIVIO_LOG)
+
+# Percorso di default di ogni archivio, nella directory corrente.
+PERCORSI_PREDEFINITI = {ARCHIVIO_SQLITE: "blockchain.db", ARCHIVIO_LOG: "blockchain.log"}
+
+# Versione dello schema del database SQLite (PRAGMA user_version): dalla versione 1 hash, timestamp e nonce sono salvati
+# in formato binario (vedi Codifica).
+VERSIONE_SCHEMA = 1
+
+# Segnaposto dei valori di una riga negli INSERT.
+SEGNAPOSTO = ", ".join( "?" for _ in COLONNE.split(",") )
+
+
+def apri_archivio(tipo = ARCHIVIO_SQLITE, percorso = None, metriche = None, potatura = False):
+    """Apre (o crea) l'archivio dei blocchi di tipo ARCHIVIO_SQLITE (un file di database) o ARCHIVIO_LOG (una directory
+       di segmenti, vedi ArchivioLog) in "percorso" (default: PERCORSI_PREDEFINITI) e ne avvia lo scrittore.
+       potatura: True se il contenuto dei blocchi più vecchi verrà tolto (solo ARCHIVIO_SQLITE): i segmenti del log
+                 non si riscrivono, quindi non si possono potare."""
+    if tipo not in ARCHIVI:
+        raise ValueError("archivio sconosciuto: " + str(tipo))
+    percorso = percorso or PERCORSI_PREDEFINITI[tipo]
+    if tipo == ARCHIVIO_LOG:
+        if potatura:
+            raise ValueError("la potatura richiede l'archivio " + ARCHIVIO_SQLITE)
+        return ArchivioLog(percorso, metriche = metriche)
+    return ArchivioSQLite(percorso, metriche = metriche, potatura = potatura)
+
+
+def riga_testuale_completa(riga):
+    """Completa una riga di un database creato dalla prima versione di Blockchain: il primo blocco ha prev_hash 0
+       invece di PREV_HASH_GENESI e la radice di Merkle (colonna aggiunta dopo) è NULL, quindi viene calcolata dal
+       contenuto. Le proof-of-work di quei blocchi non seguono le regole attuali (vedi verifica_catena)."""
+    riga = list(riga)
+    if str(riga[1]) == "0":
+        riga[1] = PREV_HASH_GENESI
+    if riga[7] == None:
+        riga[7] = radice_merkle_blocco(riga[2], json.loads(riga[4]))
+    return riga
+
+
+class TransazioneSQLite:
+    # Transazione dell'ArchivioSQLite: le operazioni usano il cursore dello scrittore nella transazione del gruppo.
+
+    def __init__(self, c):
+        self.c = c
+
+    def altezza(self):
+        return self.c.execute("SELECT MAX(id) FROM blockchain").fetchone()[0] or 0
+
+    def hash_blocco(self, id):
+        riga = self.c.execute("SELECT hash FROM blockchain WHERE id=?", (id,)).fetchone()
+        return riga[0] if riga != None else None
+
+    def inserisci(self, riga):
+        self.c.execute("INSERT OR IGNORE INTO blockchain (" + COLONNE + ") VALUES (" + SEGNAPOSTO + ")", riga)
+        return self.c.rowcount == 1
+
+    def inserisci_righe(self, righe):
+        self.c.executemany("INSERT INTO blockchain (" + COLONNE + ") VALUES (" + SEGNAPOSTO + ")", righe)
+
+    def lunghezze_contenuto(self, da, a):
+        # Restituisce (id, byte del contenuto) dei blocchi con id tra "da" e "a".
+        return self.c.execute("SELECT id, length(data) FROM blockchain WHERE id BETWEEN ? AND ? ORDER BY id", (da, a)).fetchall()
+
+    def pota(self, da, a):
+        """Toglie il contenuto ("data") dei blocchi con id tra "da" e "a", che restano nella tabella con il solo header.
+           Le righe sono cancellate e reinserite senza contenuto: un UPDATE lascerebbe le pagine mezze vuote, mentre
+           la cancellazione le unisce e libera quelle in eccesso (vedi compatta)."""
+        righe = self.c.execute("SELECT " + COLONNE + " FROM blockchain WHERE id BETWEEN ? AND ? AND data IS NOT NULL", (da, a)).fetchall()
+        self.c.execute("DELETE FROM blockchain WHERE id BETWEEN ? AND ? AND data IS NOT NULL", (da, a))
+        self.inserisci_righe([ r[:4] + (None,) + r[5:] for r in righe ])
+        return len(righe)
+
+    def compatta(self, massimo = 1000):
+        """Restituisce al file system al massimo "massimo" pagine libere del database (auto_vacuum incrementale, vedi
+           ArchivioSQLite.init_database) e ne restituisce il numero. Da Python ogni "PRAGMA incremental_vacuum"
+           libera una sola pagina."""
+        pagine = min(massimo, self.c.execute("PRAGMA freelist_count").fetchone()[0])
+        for _ in range(pagine):
+            self.c.execute("PRAGMA incremental_vacuum(1)")
+        return pagine
+
+
+class ArchivioSQLite:
+    """Archivio dei blocchi in un database SQLite (tabella blockchain con chiave primaria sull'id e indice univoco
+       sugli hash). Tutte le scritture passano dallo scrittore, che le conferma a gruppi; ogni thread legge con una
+       propria connessione (vedi db), così le letture non attendono le scritture."""
+
+    def __init__(self, percorso = 'blockchain.db', metriche = None, potatura = False):
+        self.percorso = os.path.abspath(percorso)
+        self.locale = threading.local()
+        self.scrittore = ScrittoreDB(percorso, metriche = metriche)
+        self.init_database(potatura)
+        self.scrittore.start()
+
+    @property
+    def db(self):
+        # La connessione al database del thread corrente (in sola lettura per convenzione: le scritture usano lo scrittore).
+        db = getattr(self.locale, "db", None)
+        if db == None:
+            db = apri_connessione(self.percorso)
+            self.locale.db = db
+        return db
+
+    def chiudi(self):
+        # Conferma le scritture in attesa e ferma lo scrittore.
+        self.scrittore.chiudi()
+
+    def esegui(self, funzione, *argomenti, peso = 1):
+        # Accoda funzione(transazione, *argomenti) allo scrittore (vedi Scrittore.esegui).
+        return self.scrittore.esegui(self.esegui_con_cursore, funzione, argomenti, peso = peso)
+
+    def esegui_con_cursore(self, c, funzione, argomenti):
+        return funzione(TransazioneSQLite(c), *argomenti)
+
+    def init_database(self, potatura = False):
+        # Eseguito prima dell'avvio dello scrittore, con la sua connessione.
+        c = self.scrittore.db.cursor()
+        c.execute("SELECT count(name) FROM sqlite_master WHERE type='table' AND name='blockchain'")
+        if ( c.fetchone()[0] != 1 ):
+            self.crea_tabella(c, "blockchain")
+            c.execute("PRAGMA user_version=%d" % VERSIONE_SCHEMA)
+
+        # Le pagine liberate dalla potatura tornano al file system con PRAGMA incremental_vacuum, che richiede
+        # l'auto_vacuum incrementale: il VACUUM che lo attiva riscrive il database, quindi si esegue solo per la potatura
+        if potatura and c.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            c.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            c.execute("VACUUM")
+
+        # Database creati prima dell'introduzione della radice di Merkle
+        colonne = [ riga[1] for riga in c.execute("PRAGMA table_info(blockchain)") ]
+        if "merkle_root" not in colonne:
+            c.execute("ALTER TABLE blockchain ADD COLUMN merkle_root TEXT")
+
+        if c.execute("PRAGMA user_version").fetchone()[0] < VERSIONE_SCHEMA:
+            self.converti_database(c)
+
+        # Indice univoco sugli hash: i blocchi già presenti si riconoscono senza scorrere la tabella
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS blockchain_hash ON blockchain(hash)")
+
+        # Indici delle ricerche per timestamp e per tipo e timestamp (vedi cerca); l'id è compreso in ogni indice
+        c.execute("CREATE INDEX IF NOT EXISTS blockchain_timestamp ON blockchain(timestamp)")
+        c.execute("CREATE INDEX IF NOT EXISTS blockchain_type ON blockchain(type, timestamp)")
+
+    def crea_tabella(self, c, nome):
+        # Hash e radice di Merkle sono BLOB di 64 byte, timestamp e nonce interi (il timestamp può restare testuale, vedi Codifica).
+        c.execute("""CREATE TABLE """ + nome + """(
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   prev_hash BLOB,
+                   type TEXT,
+                   timestamp INTEGER,
+                   data TEXT,
+                   nonce INTEGER,
+                   hash BLOB,
+                   merkle_root BLOB)""")
+
+    def converti_database(self, c):
+        """Converte un database con le colonne testuali (hash esadecimali, timestamp ISO 8601) nel formato binario.
+           Se una riga non si può convertire il database non viene modificato e viene sollevato ValueError."""
+        c.execute("BEGIN")
+        self.crea_tabella(c, "blockchain_binaria")
+        lettura = self.scrittore.db.cursor()
+        lettura.execute("SELECT " + COLONNE + " FROM blockchain ORDER BY id")
+        while True:
+            righe = lettura.fetchmany(1000)
+            if not righe:
+                break
+            binarie = []
+            for riga in righe:
+                try:
+                    binarie.append( riga_da_testo(riga_testuale_completa(riga)) )
+                except (ValueError, TypeError) as e:
+                    c.execute("ROLLBACK")
+                    raise ValueError("%s: il blocco %s non si può convertire nel formato binario: %s" % (self.percorso, riga[0], e))
+            c.executemany("INSERT INTO blockchain_binaria (" + COLONNE + ") VALUES (" + SEGNAPOSTO + ")", binarie)
+        c.execute("DROP TABLE blockchain")
+        c.execute("ALTER TABLE blockchain_binaria RENAME TO blockchain")
+        c.execute("PRAGMA user_version=%d" % VERSIONE_SCHEMA)
+        c.execute("COMMIT")
+
+    def leggi(self, id):
+        return self.db.execute("SELECT " + COLONNE + " FROM blockchain WHERE id=?", (id,)).fetchone()
+
+    def leggi_da_hash(self, digest):
+        return self.db.execute("SELECT " + COLONNE + " FROM blockchain WHERE hash=?", (digest,)).fetchone()
+
+    def leggi_ultimo(self):
+        return self.db.execute("SELECT " + COLONNE + " FROM blockchain ORDER BY id DESC LIMIT 1").fetchone()
+
+    def limite_potatura(self):
+        # I blocchi potati sono sempre i primi della catena: l'ultimo si trova con una ricerca binaria sull'id.
+        basso, alto = 0, self.db.execute("SELECT MAX(id) FROM blockchain").fetchone()[0] or 0
+        while basso < alto:
+            medio = (basso + alto + 1) // 2
+            riga = self.db.execute("SELECT data IS NULL FROM blockchain WHERE id=?", (medio,)).fetchone()
+            if riga != None and riga[0]:
+                basso = medio
+            else:
+                alto = medio - 1
+        return basso
+
+    def byte_contenuto(self, da = 1):
+        # I byte del contenuto dei blocchi con id maggiore o uguale a "da" (legge tutta la tabella da "da").
+        return self.db.execute("SELECT SUM(length(data)) FROM blockchain WHERE id >= ?", (da,)).fetchone()[0] or 0
+
+    def leggi_blocchi(self, da, a = None, dimensione_lotto = 500):
+        """Restituisce, a lotti di al massimo "dimensione_lotto" righe, i blocchi con id tra "da" e "a" (estremi inclusi,
+           None per arrivare all'ultimo blocco). Le righe sono lette con un cursore, quindi la memoria usata non dipende
+           dalla lunghezza della catena."""
+        return self._leggi_lotti(COLONNE, da, a, dimensione_lotto)
+
+    def leggi_header(self, da, a = None, dimensione_lotto = 2000):
+        # Come leggi_blocchi, ma restituisce solo gli header (colonne COLONNE_HEADER).
+        return self._leggi_lotti(COLONNE_HEADER, da, a, dimensione_lotto)
+
+    def _leggi_lotti(self, colonne, da, a, dimensione_lotto):
+        c = self.db.cursor()
+        c.execute("SELECT " + colonne + " FROM blockchain WHERE id >= ? AND (? IS NULL OR id <= ?) ORDER BY id", (da, a, a))
+        while True:
+            righe = c.fetchmany(dimensione_lotto)
+            if not righe:
+                return
+            yield righe
+
+    def cerca(self, tipo = None, da = None, a = None, dopo = None, limite = 500):
+        """Restituisce al massimo "limite" righe dei blocchi di tipo "tipo" con timestamp (intero, vedi Codifica) tra
+           "da" e "a" (estremi inclusi; None per non filtrare), in ordine di (timestamp, id). "dopo" è il (timestamp, id)
+           dell'ultima riga della pagina precedente: la pagina successiva riparte dall'indice, senza OFFSET.
+           I timestamp rimasti testuali seguono tutti quelli interi e sono esclusi dai filtri su "da" e "a"."""
+        condizioni, parametri = [], []
+        if tipo != None:
+            condizioni.append("type = ?")
+            parametri.append(tipo)
+        if da != None or a != None:
+            condizioni.append("timestamp BETWEEN ? AND ?")
+            parametri += [TIMESTAMP_MINIMO if da == None else da, TIMESTAMP_MASSIMO if a == None else a]
+
+        righe = []
+        if dopo != None:
+            # Prima le righe con lo stesso timestamp dell'ultima restituita, poi quelle con timestamp maggiore: SQLite
+            # non usa l'id per posizionarsi nell'indice con "(timestamp, id) > (?, ?)", con "timestamp = ? AND id > ?" sì
+            righe = self._cerca(condizioni + ["timestamp = ?", "id > ?"], parametri + list(dopo), limite)
+            condizioni, parametri = condizioni + ["timestamp > ?"], parametri + [dopo[0]]
+        if len(righe) < limite:
+            righe += self._cerca(condizioni, parametri, limite - len(righe))
+        return righe
+
+    def _cerca(self, condizioni, parametri, limite):
+        where = " WHERE " + " AND ".join(condizioni) if condizioni else ""
+        return self.db.execute("SELECT " + COLONNE + " FROM blockchain" + where + " ORDER BY timestamp, id LIMIT ?",
+                               parametri + [limite]).fetchall()
+
+    def dimensione(self):
+        # Byte occupati dal database, compreso il WAL.
+        return sum( os.path.getsize(self.percorso + suffisso) for suffisso in ("", "-wal") if os.path.exists(self.percorso + suffisso) )
@@ -0,0 +1,471 @@
+import os
+import mmap
+import struct
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+
+from Codifica import codifica_riga, decodifica_riga, HEADER_BLOCCO, LUNGHEZZA_TESTO, FLAG_TIMESTAMP_TESTO, TIMESTAMP_MINIMO
+from Validatore import riga_header_da_riga
+from Scrittore import Scrittore
+
+
+# Archivio dei blocchi come log append-only, in una directory che contiene:
+#   - i segmenti "segmento-NNNNNN.dat": i blocchi in ordine di id, codificati come nei messaggi tra i nodi (vedi
+#     Codifica.codifica_riga); quando un segmento supera DIMENSIONE_SEGMENTO i blocchi successivi vanno nel seguente;
+#   - l'indice "indice.dat": una voce a dimensione fissa (VOCE_INDICE) per ogni blocco, all'offset (id - 1) * 24,
+#     con segmento, offset e lunghezza del blocco e i primi 8 byte del suo hash.
+# Segmenti e indice sono letti tramite mmap: la lettura di un blocco per id è una voce dell'indice e la decodifica
+# del blocco direttamente dalla mappa. La ricerca per hash usa un dizionario in memoria (prefisso dell'hash -> id),
+# ricostruito dall'indice all'apertura; le ricerche per tipo e timestamp usano degli IndiceTemporale in memoria,
+# ricostruiti leggendo gli header dei blocchi. I blocchi sono scritti prima nel segmento e poi nell'indice: all'apertura le
+# voci che puntano oltre la fine del segmento e i byte non indicizzati (scrittura interrotta) vengono scartati.
+# L'archivio va aperto da un solo processo alla volta.
+DIMENSIONE_SEGMENTO = 64 * 1024 * 1024
+VOCE_INDICE = struct.Struct('!IQIQ')
+NOME_INDICE = "indice.dat"
+
+# Posizione e lunghezza dell'hash nell'header di un blocco codificato (vedi Codifica.HEADER_BLOCCO).
+POSIZIONE_HASH = struct.calcsize('!BBQqQ64s64s')
+LUNGHEZZA_HASH = 64
+
+
+def nome_segmento(numero):
+    return "segmento-%06d.dat" % numero
+
+def prefisso_hash(hash):
+    return int.from_bytes(hash[:8], "big")
+
+def tipo_e_timestamp(mappa, offset):
+    # Legge tipo e timestamp dall'header del blocco codificato in "offset", senza decodificare il resto.
+    _, flag, _, timestamp, _, _, _, _, lunghezza = HEADER_BLOCCO.unpack_from(mappa, offset)
+    offset += HEADER_BLOCCO.size
+    tipo = bytes(mappa[offset:offset + lunghezza]).decode("utf-8")
+    if flag & FLAG_TIMESTAMP_TESTO:
+        offset += lunghezza
+        lunghezza, = LUNGHEZZA_TESTO.unpack_from(mappa, offset)
+        offset += LUNGHEZZA_TESTO.size
+        timestamp = bytes(mappa[offset:offset + lunghezza]).decode("utf-8")
+    return tipo, timestamp
+
+
+class FileMappato:
+    """File in sola lettura mappato in memoria. Quando si chiedono byte oltre la fine della mappa (il file è cresciuto)
+       viene creata una nuova mappa; quelle precedenti restano valide per chi le sta usando."""
+
+    def __init__(self, percorso):
+        self.file = open(percorso, "rb")
+        self.mappa = None
+        self.lock = threading.Lock()
+
+    def mappa_fino_a(self, fine):
+        mappa = self.mappa
+        if mappa != None and len(mappa) >= fine:
+            return mappa
+
+        with self.lock:
+            if self.mappa == None or len(self.mappa) < fine:
+                self.mappa = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            return self.mappa
+
+    def chiudi(self):
+        if self.mappa != None:
+            try:
+                self.mappa.close()
+            except BufferError: # Una lettura in corso usa ancora la mappa: verrà chiusa dal garbage collector
+                pass
+        self.file.close()
+
+
+class IndiceTemporale:
+    """Le coppie (timestamp, id) di un insieme di blocchi in ordine, per le ricerche per intervallo di tempo con la
+       paginazione di ArchivioSQLite.cerca. I timestamp interi sono in due array paralleli (16 byte per blocco), quelli
+       rimasti testuali, rari, in una lista ordinata e seguono tutti quelli interi come in SQLite."""
+
+    def __init__(self):
+        self.tempi = array('q')
+        self.ids = array('q')
+        self.testuali = []
+        self.lock = threading.Lock()
+
+    def aggiungi(self, coppie):
+        # Aggiunge le coppie (timestamp, id) dei blocchi, con id crescenti.
+        with self.lock:
+            for timestamp, id in coppie:
+                if type(timestamp) is not int:
+                    insort(self.testuali, (timestamp, id))
+                elif not self.tempi or timestamp >= self.tempi[-1]:
+                    # Il caso normale: i blocchi successivi hanno timestamp successivi
+                    self.tempi.append(timestamp)
+                    self.ids.append(id)
+                else:
+                    i = self.posizione(timestamp, id)
+                    self.tempi.insert(i, timestamp)
+                    self.ids.insert(i, id)
+
+    def posizione(self, timestamp, id):
+        # La prima posizione con (timestamp, id) maggiore o uguale a quelli dati: a parità di timestamp gli id sono ordinati.
+        return bisect_left(self.ids, id, bisect_left(self.tempi, timestamp), bisect_right(self.tempi, timestamp))
+
+    def cerca(self, da, a, dopo, limite):
+        # Restituisce al massimo "limite" id, come le righe di ArchivioSQLite.cerca.
+        with self.lock:
+            ids = []
+            if dopo == None or isinstance(dopo[0], int):
+                inizio = self.posizione(TIMESTAMP_MINIMO if da == None else da, 0)
+                if dopo != None:
+                    inizio = max(inizio, self.posizione(dopo[0], dopo[1] + 1))
+                fine = len(self.tempi) if a == None else bisect_right(self.tempi, a)
+                ids = self.ids[inizio:min(fine, inizio + limite)].tolist()
+
+            if da == None and a == None and len(ids) < limite:
+                inizio = bisect_right(self.testuali, tuple(dopo)) if dopo != None and not isinstance(dopo[0], int) else 0
+                ids += [ id for _, id in self.testuali[inizio:inizio + limite - len(ids)] ]
+            return ids
+
+
+class TransazioneLog:
+    # Transazione dell'ArchivioLog: i blocchi inseriti restano in memoria, codificati, fino al commit del gruppo.
+
+    def __init__(self, archivio):
+        self.archivio = archivio
+        self.righe = []   # (riga, blocco codificato) in attesa del commit
+        self.hash = {}    # hash -> id dei blocchi in attesa
+        self.ripristino = 0
+
+    def altezza(self):
+        return self.archivio.altezza + len(self.righe)
+
+    def hash_blocco(self, id):
+        if id <= self.archivio.altezza:
+            return self.archivio.hash_blocco(id)
+        i = id - self.archivio.altezza - 1
+        return self.righe[i][0][6] if i < len(self.righe) else None
+
+    def inserisci(self, riga):
+        """Aggiunge il blocco in coda al log. Restituisce False se un blocco con lo stesso hash è già presente.
+           Il log non ha buchi: il blocco deve seguire l'ultimo, altrimenti viene sollevato ValueError."""
+        if riga[0] != self.altezza() + 1:
+            raise ValueError("il log accetta solo il blocco %d, non il blocco %d" % (self.altezza() + 1, riga[0]))
+
+        hash = bytes(riga[6])
+        if hash in self.hash or self.archivio.cerca_hash(hash) != None:
+            return False
+
+        self.righe.append( (riga, codifica_riga(riga)) )
+        self.hash[hash] = riga[0]
+        return True
+
+    def inserisci_righe(self, righe):
+        for riga in righe:
+            if not self.inserisci(riga):
+                raise ValueError("blocco %d: hash già presente nel log" % riga[0])
+
+
+class ScrittoreLog(Scrittore):
+    """Scrittore dell'ArchivioLog: le operazioni di un gruppo aggiungono blocchi a una TransazioneLog, che al commit
+       vengono scritti con un'unica scrittura sul segmento e una sull'indice."""
+
+    def __init__(self, archivio, max_peso = 5000, finestra = 0.0, metriche = None):
+        super(ScrittoreLog, self).__init__(max_peso, finestra, metriche)
+        self.archivio = archivio
+
+    def inizia(self):
+        return TransazioneLog(self.archivio)
+
+    def punto(self, t):
+        t.ripristino = len(t.righe)
+
+    def rilascia(self, t):
+        pass
+
+    def ripristina(self, t):
+        for riga, _ in t.righe[t.ripristino:]:
+            del t.hash[bytes(riga[6])]
+        del t.righe[t.ripristino:]
+
+    def conferma(self, t):
+        self.archivio.aggiungi(t.righe)
+
+    def annulla(self, t):
+        t.righe.clear()
+        t.hash.clear()
+
+    def termina(self):
+        self.archivio.chiudi_file()
+
+
+class ArchivioLog:
+    """Archivio dei blocchi in un log di segmenti append-only con indice a voci fisse (vedi il commento iniziale).
+       Le letture non prendono lock: vedono solo i blocchi fino ad "altezza", che viene aggiornata dopo che segmento
+       e indice sono stati scritti."""
+
+    def __init__(self, percorso = 'blockchain.log', metriche = None, dimensione_segmento = DIMENSIONE_SEGMENTO, sincronizza = False):
+        """percorso: La directory dell'archivio (creata se non esiste).
+           dimensione_segmento: I byte oltre i quali si passa al segmento successivo.
+           sincronizza: True per eseguire fsync di segmento e indice a ogni commit; altrimenti i dati sono scritti nel
+                        sistema operativo a ogni commit e su disco alla chiusura (come synchronous=NORMAL di SQLite)."""
+        self.percorso = os.path.abspath(percorso)
+        self.dimensione_segmento = dimensione_segmento
+        self.sincronizza = sincronizza
+        os.makedirs(self.percorso, exist_ok=True)
+
+        self.segmenti = {} # numero -> FileMappato
+        self.lock_segmenti = threading.Lock()
+        self.prefissi = {}   # prefisso_hash -> id
+        self.collisioni = {} # hash -> id dei blocchi il cui prefisso era già in "prefissi"
+        self.per_tempo = IndiceTemporale()
+        self.per_tipo = {}   # tipo -> IndiceTemporale
+
+        self.recupera()
+        self.indice = FileMappato(os.path.join(self.percorso, NOME_INDICE))
+        self.carica_hash()
+        self.carica_indici()
+
+        self.scrittore = ScrittoreLog(self, metriche = metriche)
+        self.scrittore.start()
+
+    def recupera(self):
+        # Scarta le scritture interrotte e apre in append l'indice e l'ultimo segmento.
+        percorso_indice = os.path.join(self.percorso, NOME_INDICE)
+        with open(percorso_indice, "ab+") as f:
+            f.seek(0)
+            dati = f.read()
+
+        voci = len(dati) // VOCE_INDICE.size
+        while voci > 0:
+            segmento, offset, lunghezza, _ = VOCE_INDICE.unpack_from(dati, (voci - 1) * VOCE_INDICE.size)
+            percorso_segmento = os.path.join(self.percorso, nome_segmento(segmento))
+            if os.path.exists(percorso_segmento) and os.path.getsize(percorso_segmento) >= offset + lunghezza:
+                break
+            voci -= 1
+
+        self.altezza = voci
+        self.segmento, self.fine_segmento = 0, 0
+        if voci > 0:
+            self.segmento, offset, lunghezza, _ = VOCE_INDICE.unpack_from(dati, (voci - 1) * VOCE_INDICE.size)
+            self.fine_segmento = offset + lunghezza
+
+        with open(percorso_indice, "r+b") as f:
+            f.truncate(voci * VOCE_INDICE.size)
+        for nome in os.listdir(self.percorso):
+            if nome.startswith("segmento-") and int(nome[9:15]) > self.segmento:
+                os.remove(os.path.join(self.percorso, nome))
+        with open(os.path.join(self.percorso, nome_segmento(self.segmento)), "ab+") as f:
+            f.truncate(self.fine_segmento)
+
+        self.file_indice = open(percorso_indice, "ab")
+        self.file_segmento = open(os.path.join(self.percorso, nome_segmento(self.segmento)), "ab")
+
+    def carica_hash(self):
+        # Ricostruisce la ricerca per hash dai prefissi salvati nell'indice.
+        if self.altezza == 0:
+            return
+        mappa = self.indice.mappa_fino_a(self.altezza * VOCE_INDICE.size)
+        for id, (_, _, _, prefisso) in enumerate(VOCE_INDICE.iter_unpack(mappa[:self.altezza * VOCE_INDICE.size]), 1):
+            if prefisso in self.prefissi:
+                self.collisioni[self.hash_blocco(id)] = id
+            else:
+                self.prefissi[prefisso] = id
+
+    def carica_indici(self):
+        # Ricostruisce gli indici per tipo e timestamp leggendo gli header di tutti i blocchi.
+        if self.altezza == 0:
+            return
+        mappa = self.indice.mappa_fino_a(self.altezza * VOCE_INDICE.size)
+        blocchi = []
+        for id, (segmento, offset, lunghezza, _) in enumerate(VOCE_INDICE.iter_unpack(mappa[:self.altezza * VOCE_INDICE.size]), 1):
+            blocchi.append( (id,) + tipo_e_timestamp(self.file_segmento_mappato(segmento).mappa_fino_a(offset + lunghezza), offset) )
+            if len(blocchi) == 10000:
+                self.indicizza(blocchi)
+                blocchi = []
+        self.indicizza(blocchi)
+
+    def indicizza(self, blocchi):
+        # Aggiunge agli indici per tipo e timestamp i blocchi (id, tipo, timestamp), in ordine di id.
+        per_tipo = {}
+        for id, tipo, timestamp in blocchi:
+            per_tipo.setdefault(tipo, []).append( (timestamp, id) )
+        for tipo, coppie in per_tipo.items():
+            indice = self.per_tipo.get(tipo)
+            if indice == None:
+                indice = self.per_tipo.setdefault(tipo, IndiceTemporale())
+            indice.aggiungi(coppie)
+        self.per_tempo.aggiungi( (timestamp, id) for id, _, timestamp in blocchi )
+
+    def esegui(self, funzione, *argomenti, peso = 1):
+        # Accoda funzione(transazione, *argomenti) allo scrittore (vedi Scrittore.esegui).
+        return self.scrittore.esegui(funzione, *argomenti, peso = peso)
+
+    def aggiungi(self, righe):
+        """Eseguito dallo scrittore al commit: scrive i blocchi (riga, blocco codificato) nei segmenti e le loro voci
+           nell'indice, poi li rende visibili ai lettori. Se la scrittura non riesce i file tornano allo stato precedente."""
+        if not righe:
+            return
+
+        stato = (self.segmento, self.fine_segmento)
+        voci = []
+        dati = []
+        try:
+            for riga, codificato in righe:
+                if self.fine_segmento > 0 and self.fine_segmento + len(codificato) > self.dimensione_segmento:
+                    self.scrivi_segmento(dati)
+                    dati = []
+                    self.nuovo_segmento()
+                voci.append( VOCE_INDICE.pack(self.segmento, self.fine_segmento, len(codificato), prefisso_hash(riga[6])) )
+                dati.append(codificato)
+                self.fine_segmento += len(codificato)
+
+            self.scrivi_segmento(dati)
+            self.file_indice.write(b"".join(voci))
+            self.file_indice.flush()
+            if self.sincronizza:
+                os.fsync(self.file_indice.fileno())
+
+        except Exception:
+            self.ripristina(*stato)
+            raise
+
+        self.altezza += len(righe)
+        for riga, _ in righe:
+            prefisso = prefisso_hash(riga[6])
+            if prefisso in self.prefissi:
+                self.collisioni[bytes(riga[6])] = riga[0]
+            else:
+                self.prefissi[prefisso] = riga[0]
+        self.indicizza([ (riga[0], riga[2], riga[3]) for riga, _ in righe ])
+
+    def scrivi_segmento(self, dati):
+        self.file_segmento.write(b"".join(dati))
+        self.file_segmento.flush()
+        if self.sincronizza:
+            os.fsync(self.file_segmento.fileno())
+
+    def nuovo_segmento(self):
+        self.file_segmento.close()
+        self.segmento += 1
+        self.fine_segmento = 0
+        self.file_segmento = open(os.path.join(self.percorso, nome_segmento(self.segmento)), "ab")
+
+    def ripristina(self, segmento, fine_segmento):
+        # Riporta indice e segmenti alla situazione precedente un commit non riuscito.
+        self.file_segmento.close()
+        for numero in range(segmento + 1, self.segmento + 1):
+            percorso = os.path.join(self.percorso, nome_segmento(numero))
+            if os.path.exists(percorso):
+                os.remove(percorso)
+        self.segmento, self.fine_segmento = segmento, fine_segmento
+        self.file_segmento = open(os.path.join(self.percorso, nome_segmento(segmento)), "ab")
+        self.file_segmento.truncate(fine_segmento)
+        self.file_indice.truncate(self.altezza * VOCE_INDICE.size)
+
+    def chiudi_file(self):
+        # Eseguito dallo scrittore alla chiusura: porta su disco e chiude i file aperti in scrittura.
+        for f in (self.file_segmento, self.file_indice):
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+
+    def chiudi(self):
+        # Conferma le scritture in attesa, ferma lo scrittore e chiude le mappe.
+        self.scrittore.chiudi()
+        self.indice.chiudi()
+        with self.lock_segmenti:
+            for f in self.segmenti.values():
+                f.chiudi()
+            self.segmenti.clear()
+
+    def file_segmento_mappato(self, numero):
+        f = self.segmenti.get(numero)
+        if f == None:
+            with self.lock_segmenti:
+                f = self.segmenti.get(numero)
+                if f == None:
+                    f = FileMappato(os.path.join(self.percorso, nome_segmento(numero)))
+                    self.segmenti[numero] = f
+        return f
+
+    def posizione(self, id):
+        # Restituisce (mappa del segmento, offset) del blocco "id", oppure None se non è nell'archivio.
+        if not 1 <= id <= self.altezza:
+            return None
+        segmento, offset, lunghezza, _ = VOCE_INDICE.unpack_from(self.indice.mappa_fino_a(id * VOCE_INDICE.size), (id - 1) * VOCE_INDICE.size)
+        return self.file_segmento_mappato(segmento).mappa_fino_a(offset + lunghezza), offset
+
+    def hash_blocco(self, id):
+        # L'hash (binario) del blocco "id", letto dall'header senza decodificare il blocco.
+        posizione = self.posizione(id)
+        if posizione == None:
+            return None
+        mappa, offset = posizione
+        return mappa[offset + POSIZIONE_HASH:offset + POSIZIONE_HASH + LUNGHEZZA_HASH]
+
+    def cerca_hash(self, hash):
+        # Restituisce l'id del blocco con l'hash (binario) dato, oppure None.
+        id = self.prefissi.get(prefisso_hash(hash))
+        if id != None and self.hash_blocco(id) == hash:
+            return id
+        return self.collisioni.get(hash)
+
+    def leggi(self, id):
+        posizione = self.posizione(id)
+        if posizione == None:
+            return None
+        return decodifica_riga(*posizione)[0]
+
+    def leggi_da_hash(self, digest):
+        id = self.cerca_hash(bytes(digest))
+        return self.leggi(id) if id != None else None
+
+    def leggi_ultimo(self):
+        return self.leggi(self.altezza)
+
+    def limite_potatura(self):
+        # I segmenti non vengono riscritti, quindi ogni blocco conserva il suo contenuto (vedi apri_archivio).
+        return 0
+
+    def leggi_blocchi(self, da, a = None, dimensione_lotto = 500):
+        """Restituisce, a lotti di al massimo "dimensione_lotto" righe, i blocchi con id tra "da" e "a" (estremi inclusi,
+           None per arrivare all'ultimo blocco presente all'inizio della lettura)."""
+        fine = self.altezza if a == None else min(a, self.altezza)
+        id = max(1, da)
+        while id <= fine:
+            ultimo = min(fine, id + dimensione_lotto - 1)
+            yield self.leggi_consecutivi(id, ultimo)
+            id = ultimo + 1
+
+    def leggi_consecutivi(self, da, a):
+        # I blocchi da "da" ad "a": quelli nello stesso segmento sono contigui e vengono decodificati uno dopo l'altro,
+        # senza leggere l'indice per ognuno.
+        indice = self.indice.mappa_fino_a(a * VOCE_INDICE.size)
+        segmento_a = VOCE_INDICE.unpack_from(indice, (a - 1) * VOCE_INDICE.size)[0]
+        righe = []
+        while da <= a:
+            segmento, offset, _, _ = VOCE_INDICE.unpack_from(indice, (da - 1) * VOCE_INDICE.size)
+            if segmento != segmento_a:
+                righe.append(self.leggi(da))
+                da += 1
+                continue
+            ultimo_segmento, ultimo_offset, ultima_lunghezza, _ = VOCE_INDICE.unpack_from(indice, (a - 1) * VOCE_INDICE.size)
+            mappa = self.file_segmento_mappato(segmento).mappa_fino_a(ultimo_offset + ultima_lunghezza)
+            for _ in range(da, a + 1):
+                riga, offset = decodifica_riga(mappa, offset)
+                righe.append(riga)
+            break
+        return righe
+
+    def leggi_header(self, da, a = None, dimensione_lotto = 2000):
+        # Come leggi_blocchi, ma restituisce solo gli header (ordine di COLONNE_HEADER).
+        for righe in self.leggi_blocchi(da, a, dimensione_lotto):
+            yield [ riga_header_da_riga(r) for r in righe ]
+
+    def cerca(self, tipo = None, da = None, a = None, dopo = None, limite = 500):
+        # Come ArchivioSQLite.cerca, con gli indici per tipo e timestamp in memoria.
+        indice = self.per_tempo if tipo == None else self.per_tipo.get(tipo)
+        if indice == None:
+            return []
+        return [ self.leggi(id) for id in indice.cerca(da, a, dopo, limite) ]
+
+    def dimensione(self):
+        # Byte occupati da segmenti e indice.
+        return sum( os.path.getsize(os.path.join(self.percorso, nome)) for nome in os.listdir(self.percorso) )
@@ -1,8 +1,183 @@
 import socket
 import time
+import struct
+import selectors
 import threading
 import json
 
+from CodaInvio import CodaInvio, DIMENSIONE_LOTTO
+
+
+# Carattere di fine trasmissione per i messaggi in streaming di rete (framing "eot").
+EOT_CHAR = 0x04.to_bytes(1, 'big')
+
+# Modalità di framing dei messaggi sul socket. "eot" termina ogni messaggio con il carattere 0x04 (compatibile con i nodi
+# precedenti), "lp" antepone a ogni messaggio un header con la lunghezza e il tipo del contenuto.
+FRAMING_EOT = 'eot'
+FRAMING_LP = 'lp'
+
+# Separatore tra l'id del nodo e le modalità di framing proposte durante lo scambio degli ID.
+SEPARATORE_HANDSHAKE = '\x1f'
+
+# Fine della risposta allo scambio degli ID data ai nodi che propongono il framing: i byte successivi sono già messaggi.
+TERMINATORE_HANDSHAKE = '\n'
+
+# Header dei messaggi "lp": lunghezza del contenuto (4 byte, big endian) e tipo del contenuto (1 byte).
+HEADER_LP = struct.Struct('!IB')
+TIPO_BYTES = 0
+TIPO_STR = 1
+TIPO_JSON = 2
+
+# Dimensione massima di un messaggio ricevuto e dimensione iniziale del buffer di ricezione.
+DIMENSIONE_MAX_FRAME = 16 * 1024 * 1024
+DIMENSIONE_BUFFER = 64 * 1024
+
+
+def handshake_offerta(id, framing):
+    # Messaggio inviato da chi apre la connessione: l'id del nodo seguito dalle modalità di framing supportate.
+    if framing == FRAMING_LP:
+        return id + SEPARATORE_HANDSHAKE + FRAMING_LP + ',' + FRAMING_EOT
+    return id
+
+def handshake_leggi(messaggio):
+    """Separa l'id del nodo dalle modalità di framing indicate nel messaggio di handshake. Un nodo che non conosce
+       il framing "lp" invia solo il proprio id: in quel caso l'unica modalità è "eot"."""
+    if messaggio.endswith(TERMINATORE_HANDSHAKE):
+        messaggio = messaggio[:-len(TERMINATORE_HANDSHAKE)]
+    id, _, modalita = messaggio.partition(SEPARATORE_HANDSHAKE)
+    return id, (modalita.split(',') if modalita else [FRAMING_EOT])
+
+def handshake_risposta(id, offerta, framing):
+    """Risposta di chi accetta la connessione e modalità scelta. Se l'altro nodo non ha proposto nulla si risponde
+       con il solo id, come i nodi precedenti, e si usa il framing "eot". Altrimenti la risposta termina con
+       TERMINATORE_HANDSHAKE, perché i messaggi inviati subito dopo possono arrivare nella stessa lettura (vedi
+       handshake_separa)."""
+    if framing == FRAMING_LP and FRAMING_LP in offerta:
+        return id + SEPARATORE_HANDSHAKE + FRAMING_LP + TERMINATORE_HANDSHAKE, FRAMING_LP
+    if FRAMING_LP in offerta:
+        return id + SEPARATORE_HANDSHAKE + FRAMING_EOT + TERMINATORE_HANDSHAKE, FRAMING_EOT
+    return id, FRAMING_EOT
+
+def handshake_separa(dati):
+    """Separa la risposta allo scambio degli ID dai byte che la seguono, tra quelli ricevuti finora da chi ha aperto
+       la connessione. Restituisce (risposta, avanzo), dove avanzo sono i primi byte dei messaggi successivi, oppure
+       None se la risposta non è ancora arrivata tutta. La risposta senza terminatore (il solo id, data dai nodi
+       precedenti o a chi propone solo "eot") non ha un limite riconoscibile e occupa tutti i byte ricevuti."""
+    fine = dati.find(TERMINATORE_HANDSHAKE.encode('utf-8'))
+    if fine >= 0:
+        return dati[:fine].decode('utf-8'), dati[fine + 1:]
+    if SEPARATORE_HANDSHAKE.encode('utf-8') in dati:
+        return None
+    return dati.decode('utf-8'), b''
+
+
+def codifica_frame(data, framing, encoding_type='utf-8'):
+    """Restituisce i byte da scrivere sul socket per il messaggio "data" (str, dict inviato come json o bytes) secondo
+       il framing indicato, oppure None se il tipo di dato non è supportato. Solleva TypeError se il dict non è serializzabile."""
+    if isinstance(data, str):
+        tipo, contenuto = TIPO_STR, data.encode(encoding_type)
+
+    elif isinstance(data, dict):
+        tipo, contenuto = TIPO_JSON, json.dumps(data).encode(encoding_type)
+
+    elif isinstance(data, bytes):
+        tipo, contenuto = TIPO_BYTES, data
+
+    else:
+        return None
+
+    if framing == FRAMING_LP:
+        return HEADER_LP.pack(len(contenuto), tipo) + contenuto
+
+    return contenuto + EOT_CHAR
+
+def decodifica_frame(tipo, contenuto):
+    # Decodifica un messaggio ricevuto con il framing "lp": il tipo è indicato nell'header, non va indovinato.
+    if tipo == TIPO_STR:
+        return contenuto.decode('utf-8')
+
+    if tipo == TIPO_JSON:
+        return json.loads(contenuto)
+
+    return contenuto
+
+def decodifica_pacchetto(packet):
+    """Analizza il pacchetto ricevuto con il framing "eot" e determina se è stato inviato in formato str, json o byte.
+       Restituisce i dati corrispondenti."""
+    try:
+        packet_decoded = packet.decode('utf-8')
+
+        try:
+            return json.loads(packet_decoded)
+
+        except json.decoder.JSONDecodeError:
+            return packet_decoded
+
+    except UnicodeDecodeError:
+        return packet
+
+
+class FrameNonValido(Exception):
+    # Sollevata quando un messaggio ricevuto supera la dimensione massima consentita.
+    pass
+
+
+class BufferRicezione:
+    """Buffer di ricezione preallocato per il framing "lp". I dati vengono scritti direttamente nel bytearray con
+       recv_into tramite memoryview, senza concatenazioni. Quando lo spazio finale è esaurito i byte non ancora letti
+       vengono spostati all'inizio; il buffer cresce solo se un singolo messaggio non ci sta, fino al massimo consentito."""
+
+    def __init__(self, dimensione = DIMENSIONE_BUFFER, max_frame = DIMENSIONE_MAX_FRAME):
+        self.max_frame = max_frame
+        self.buffer = bytearray(min(dimensione, max_frame + HEADER_LP.size))
+        self.vista = memoryview(self.buffer)
+        self.inizio = 0 # Primo byte non ancora letto
+        self.fine = 0   # Primo byte libero
+
+    def spazio(self):
+        # Restituisce la memoryview in cui ricevere i prossimi byte.
+        if self.fine == len(self.buffer):
+            self._compatta()
+        return self.vista[self.fine:]
+
+    def scritti(self, n):
+        # Registra che "n" byte sono stati ricevuti nello spazio restituito da spazio().
+        self.fine += n
+
+    def _compatta(self):
+        pendenti = self.fine - self.inizio
+        if self.inizio > 0:
+            self.vista[:pendenti] = self.vista[self.inizio:self.fine]
+            self.inizio, self.fine = 0, pendenti
+
+        if self.fine == len(self.buffer): # Un solo messaggio occupa tutto il buffer: si raddoppia
+            nuovo = bytearray(min(2*len(self.buffer), self.max_frame + HEADER_LP.size))
+            nuovo[:pendenti] = self.vista[:pendenti]
+            self.vista.release()
+            self.buffer = nuovo
+            self.vista = memoryview(self.buffer)
+
+    def estrai(self):
+        """Restituisce il prossimo messaggio completo come (tipo, contenuto) oppure None se non è ancora arrivato
+           tutto. Solleva FrameNonValido se la lunghezza dichiarata supera la dimensione massima."""
+        if self.fine - self.inizio < HEADER_LP.size:
+            return None
+
+        lunghezza, tipo = HEADER_LP.unpack_from(self.buffer, self.inizio)
+        if lunghezza > self.max_frame:
+            raise FrameNonValido("messaggio di %d byte, massimo %d" % (lunghezza, self.max_frame))
+
+        inizio = self.inizio + HEADER_LP.size
+        if self.fine - inizio < lunghezza:
+            return None
+
+        contenuto = bytes(self.vista[inizio:inizio + lunghezza])
+        self.inizio = inizio + lunghezza
+        if self.inizio == self.fine:
+            self.inizio = self.fine = 0
+
+        return tipo, contenuto
+
 
 class Connessione(threading.Thread):
     """La classe "Connessione" è utilizzata dalla classe "Nodo" e rappresenta la connessione socket TCP/IP con un altro nodo.
@@ -11,13 +186,16 @@ class Connessione(threading.Thread):
        Crea un'istanza di una nuova connessione."""
 
 
-    def __init__(self, main_node, sock, id, host, porta):
+    def __init__(self, main_node, sock, id, host, porta, framing = FRAMING_EOT, max_frame = DIMENSIONE_MAX_FRAME, coda = None):
         """Istanzia una nuova "Connessione". Tutta la comunicazione TCP/IP è gestita da questa classe.
             main_node: La classe Nodo che ha ricevuto la connessione.
             sock: Il socket associato alla connessione del client.
             id: L'id del nodo connesso (sul lato opposto della connessione TCP/IP).
             host: L'host/ip del nodo principale (main).
-            porta: La porta del nodo principale (main)."""
+            porta: La porta del nodo principale (main).
+            framing: La modalità di framing concordata durante lo scambio degli ID (FRAMING_EOT o FRAMING_LP).
+            max_frame: La dimensione massima in byte di un messaggio ricevuto.
+            coda: La CodaInvio dei messaggi in uscita (default: CodaInvio con i limiti predefiniti)."""
 
         super(Connessione, self).__init__()
 
@@ -31,7 +209,10 @@ class Connessione(threading.Thread):
         self.id = str(id) 
 
         # Carattere di fine trasmissione per i messaggi in streaming di rete.
-        self.EOT_CHAR = 0x04.to_bytes(1, 'big')
+        self.EOT_CHAR = EOT_CHAR
+
+        self.framing = framing
+        self.max_frame = max_frame
 
         # Datastore per memorizzare informazioni aggiuntive relative al nodo.
         self.info = {}
@@ -39,74 +220,200 @@ class Connessione(threading.Thread):
         # Uso il timeout del socket per determinare i problemi con la connessione
         self.sock.settimeout(10.0)
 
+        # Buffer di ricezione: bytearray per il framing "eot", buffer preallocato per il framing "lp"
+        self.buffer = bytearray()
+        self.buffer_lp = BufferRicezione(max_frame=max_frame)
+        self.da_elaborare = False # True se i buffer contengono byte letti prima dell'avvio (vedi aggiungi_ricevuti)
+
+        # Il thread attende che il socket sia leggibile; stop() lo risveglia scrivendo sulla coppia di socket "risveglio"
+        self.risveglio_r, self.risveglio_w = socket.socketpair()
+        self.risveglio_r.setblocking(False)
+        self.selettore = selectors.DefaultSelector()
+        self.selettore.register(self.sock, selectors.EVENT_READ)
+        self.selettore.register(self.risveglio_r, selectors.EVENT_READ)
+
+        # I messaggi da inviare passano dalla coda; un thread dedicato li scrive sul socket accorpandoli
+        self.coda = coda if coda != None else CodaInvio()
+        self.scrittore = threading.Thread(target=self.scrivi_coda, daemon=True)
+
         self.main_node.debug_print("Connessione.send: Inizio con client (" + self.id + ") '" + self.host + ":" + str(self.porta) + "'")
 
     def send(self, data, encoding_type='utf-8'):
         """Invia i dati al nodo connesso. I dati possono essere di puro testo (str), oggetto dizionario (json) e oggetto bytes.
-           Quando si invia l'oggetto byte, si utilizza la comunicazione socket standard. Un carattere di fine trasmissione 0x04
-           utf-8/ascii sarà usato per decodificare i pacchetti ricevuti dall'altro nodo. Quando il socket è danneggiato, la connessione del nodo
-           viene interrotta."""
-        if isinstance(data, str):
-            try:
-                self.sock.sendall( data.encode(encoding_type) + self.EOT_CHAR )
+           Con il framing "eot" un carattere di fine trasmissione 0x04 utf-8/ascii sarà usato per decodificare i pacchetti
+           ricevuti dall'altro nodo; con il framing "lp" ogni messaggio è preceduto da lunghezza e tipo.
+           Il messaggio viene messo nella coda di invio e scritto dal thread scrittore, quindi un nodo lento non blocca
+           chi invia (salvo con la politica POLITICA_BLOCCA a coda piena). Quando la coda non accetta il messaggio
+           secondo la politica scelta, o il socket è danneggiato, la connessione del nodo viene interrotta."""
+        try:
+            frame = self.codifica(data, encoding_type)
 
-            except Exception as e: # Quando l'invio non riesce chiude la connessione
-                self.main_node.debug_print("Connessione.send: Errore nell'invio dei dati al nodo: " + str(e))
-                self.stop() # Termina il nodo
+        except TypeError as type_error:
+            self.main_node.debug_print('Dict non valido')
+            self.main_node.debug_print(str(type_error))
+            return
+
+        if frame == None:
+            self.main_node.debug_print('datatype non valido, usare str, dict (sarà inviato come json) o bytes')
+            return
+
+        if not self.coda.inserisci(frame):
+            self.main_node.debug_print("Connessione.send: Coda di invio piena o chiusa, disconnessione dal nodo " + self.id)
+            self.stop() # Termina il nodo
+            return
+
+        self.main_node.conta_messaggio_inviato(self)
+
+    def scrivi_coda(self):
+        """Ciclo del thread scrittore: estrae i messaggi dalla coda di invio e li scrive sul socket, accorpando in una
+           sola scrittura i messaggi già in attesa. Termina quando la coda è chiusa e vuota o quando l'invio non riesce."""
+        while True:
+            lotto = self.coda.estrai_lotto(DIMENSIONE_LOTTO)
+            if not lotto:
+                if self.coda.chiusa:
+                    return
+                continue
 
-        elif isinstance(data, dict):
             try:
-                json_data = json.dumps(data)
-                json_data = json_data.encode(encoding_type) + self.EOT_CHAR
-                self.sock.sendall(json_data)
-                
-            except TypeError as type_error:
-                self.main_node.debug_print('Dict non valido')
-                self.main_node.debug_print(str(type_error))
+                dati = lotto[0] if len(lotto) == 1 else b''.join(lotto)
+                self.sock.sendall(dati)
+                self.main_node.conta_byte_inviati(self, len(dati))
 
             except Exception as e: # Quando l'invio non riesce chiude la connessione
                 self.main_node.debug_print("Connessione.send: Errore nell'invio dei dati al nodo: " + str(e))
-                self.stop() 
-
-        elif isinstance(data, bytes):
-            bin_data = data + self.EOT_CHAR
-            self.sock.sendall(bin_data)
+                self.stop() # Termina il nodo
+                return
 
-        else:
-            self.main_node.debug_print('datatype non valido, usare str, dict (sarà inviato come json) o bytes')
+    def stato_coda(self):
+        # Restituisce lo stato della coda di invio (messaggi e byte in attesa, messaggi scartati, limiti).
+        return self.coda.stato()
 
+    def codifica(self, data, encoding_type='utf-8'):
+        """Restituisce i byte da scrivere sul socket per il messaggio "data" secondo il framing della connessione,
+           oppure None se il tipo di dato non è supportato."""
+        return codifica_frame(data, self.framing, encoding_type)
 
     def stop(self):
         # Termina la connessione e il thread viene interrotto.
         self.terminate_flag.set()
+        self.coda.chiudi()
+        try:
+            self.risveglio_w.send(b'\x00')
+        except OSError:
+            pass # Il thread è già terminato
+
+    def chiudi(self):
+        # Chiude il socket e le risorse di una connessione mai avviata (es. rifiutata per il limite di connessioni).
+        self.coda.chiudi()
+        self.selettore.close()
+        self.risveglio_r.close()
+        self.risveglio_w.close()
+        self.sock.close()
+
+    def parse_frame(self, tipo, contenuto):
+        # Decodifica un messaggio ricevuto con il framing "lp".
+        return decodifica_frame(tipo, contenuto)
 
     def parse_packet(self, packet):
         """Analizza il pacchetto e determina se è stato inviato in formato str, json o byte. Restituisce
            i dati corrispondenti."""
-        try:
-            packet_decoded = packet.decode('utf-8')
+        return decodifica_pacchetto(packet)
+
+    def attendi_dati(self, timeout):
+        """Attende al massimo "timeout" secondi che il socket abbia dati da leggere. Restituisce True se il socket
+           è leggibile, False se il tempo è scaduto o se la connessione è stata fermata con stop()."""
+        leggibile = False
+        for key, _ in self.selettore.select(timeout):
+            if key.fileobj is self.sock:
+                leggibile = True
+            else:
+                try:
+                    self.risveglio_r.recv(64)
+                except BlockingIOError:
+                    pass
+
+        return leggibile and not self.terminate_flag.is_set()
+
+    def aggiungi_ricevuti(self, dati):
+        """Aggiunge al buffer di ricezione i byte già letti dal socket prima dell'avvio del thread (es. ricevuti
+           insieme alla risposta dello scambio degli ID): i messaggi completi sono elaborati all'avvio."""
+        if not dati:
+            return
+        self.da_elaborare = True
+        if self.framing == FRAMING_LP:
+            dati = memoryview(dati)
+            while dati:
+                spazio = self.buffer_lp.spazio()
+                n = min(len(spazio), len(dati))
+                spazio[:n] = dati[:n]
+                self.buffer_lp.scritti(n)
+                dati = dati[n:]
+        else:
+            self.buffer += dati
+
+    def ricevi(self):
+        # Legge i dati disponibili sul socket ed elabora i messaggi completi.
+        if self.framing == FRAMING_LP:
+            n = self.sock.recv_into( self.buffer_lp.spazio() )
+            if n == 0:
+                raise ConnectionError("connessione chiusa dal nodo")
+            self.buffer_lp.scritti(n)
+        else:
+            chunk = self.sock.recv(65536)
+            if chunk == b'':
+                raise ConnectionError("connessione chiusa dal nodo")
+            self.buffer += chunk
+
+        self.elabora()
+
+    def elabora(self):
+        # Invoca node_message per ogni messaggio completo nel buffer di ricezione.
+        if self.framing == FRAMING_LP:
+            messaggio = self.buffer_lp.estrai()
+            while messaggio != None:
+                self.main_node.conta_messaggio_ricevuto(self, HEADER_LP.size + len(messaggio[1]))
+                self.main_node.messaggio_ricevuto( self, self.parse_frame(*messaggio) )
+                messaggio = self.buffer_lp.estrai()
 
-            try:
-                return json.loads(packet_decoded)
+        else:
+            eot_pos = self.buffer.find(self.EOT_CHAR)
+            while eot_pos >= 0:
+                packet = bytes(self.buffer[:eot_pos])
+                del self.buffer[:eot_pos + 1]
 
-            except json.decoder.JSONDecodeError:
-                return packet_decoded
+                if packet != b'':
+                    self.main_node.conta_messaggio_ricevuto(self, len(packet) + 1)
+                    self.main_node.messaggio_ricevuto( self, self.parse_packet(packet) )
 
-        except UnicodeDecodeError:
-            return packet
+                eot_pos = self.buffer.find(self.EOT_CHAR)
+
+            # Evita l'overflow del buffer quando non viene trovato EOT_CHAR
+            if len(self.buffer) > self.max_frame:
+                raise FrameNonValido("nessun EOT_CHAR nei primi %d byte" % self.max_frame)
 
     def run(self):
         """Il ciclo principale del thread per gestire la connessione con il nodo. 
-           All'interno del ciclo principale il thread attende di ricevere i dati dal nodo. 
+           All'interno del ciclo principale il thread attende che il socket diventi leggibile (o che venga chiamato stop())
+           e legge tutti i dati disponibili prima di rimettersi in attesa.
            Se i dati vengono ricevuti, verrà invocato il metodo node_message del nodo principale."""  
-           
-        buffer = b'' # Controlla il flusso in entrata
 
-        while not self.terminate_flag.is_set():
-            chunk = b''
+        self.scrittore.start()
 
+        while not self.terminate_flag.is_set():
             try:
-                chunk = self.sock.recv(4096) 
+                if self.da_elaborare:
+                    self.da_elaborare = False
+                    self.elabora()
+
+                if not self.attendi_dati(10.0):
+                    if not self.terminate_flag.is_set():
+                        self.main_node.debug_print("Connessione: timeout")
+                    continue
+
+                # Svuota il socket: continua a leggere finché ci sono dati pronti
+                self.ricevi()
+                while not self.terminate_flag.is_set() and self.attendi_dati(0):
+                    self.ricevi()
 
             except socket.timeout:
                 self.main_node.debug_print("Connessione: timeout")
@@ -116,22 +423,13 @@ class Connessione(threading.Thread):
                 self.main_node.debug_print('Errore')
                 self.main_node.debug_print(str(e))
 
-            # Possibile overflow del buffer quando non viene trovato EOT_CHAR 
-            if chunk != b'':
-                buffer += chunk
-                eot_pos = buffer.find(self.EOT_CHAR)
-
-                while eot_pos > 0:
-                    packet = buffer[:eot_pos]
-                    buffer = buffer[eot_pos + 1:]
-
-                    self.main_node.message_count_ricevuti += 1
-                    self.main_node.node_message( self, self.parse_packet(packet) )
-
-                    eot_pos = buffer.find(self.EOT_CHAR)
-
-            time.sleep(1)
+        # Lo scrittore invia i messaggi rimasti in coda prima della chiusura del socket
+        self.coda.chiudi()
+        self.scrittore.join()
 
+        self.selettore.close()
+        self.risveglio_r.close()
+        self.risveglio_w.close()
         self.sock.settimeout(None)
         self.sock.close()
         self.main_node.node_disconnected( self ) 
@@ -1,11 +1,34 @@
 import json
 import hashlib
-import sqlite3
+import threading
+from time import perf_counter
 from datetime import time, date, datetime
 
 from base64 import b64decode, b64encode
 
 from Nodo import Nodo
+from Minatore import Minatore
+from Merkle import TIPO_TRANSAZIONI, hash_transazione, radice_merkle_blocco, transazioni_blocco, prova_merkle
+from Validatore import Validatore, blocco_da_riga, riga_da_blocco, header_da_riga, riga_header_da_riga, controlla_blocco, controlla_header, \
+                       controlla_collegamento, COLONNE, PREV_HASH_GENESI
+from Archivio import apri_archivio, ARCHIVIO_SQLITE
+from CacheBlocchi import CacheBlocchi
+from Snapshot import Snapshot, SnapshotNonValido, scrivi_snapshot, DIMENSIONE_LOTTO_SNAPSHOT
+from Codifica import riga_testo, riga_da_testo, digest_binario, timestamp_intero
+
+
+# Nomi dei campi delle righe della tabella blockchain, nell'ordine di COLONNE.
+INTESTAZIONE = tuple( c.strip() for c in COLONNE.split(",") )
+
+# Motivo del rifiuto di un blocco il cui predecessore non è ancora nella blockchain.
+PRECEDENTE_MANCANTE = "blocco precedente non presente nella blockchain"
+
+# Motivo del rifiuto di un blocco all'altezza del checkpoint con un hash diverso.
+DIVERSO_DAL_CHECKPOINT = "blocco diverso da quello del checkpoint"
+
+# Blocchi potati in ogni operazione dello scrittore e pagine restituite al file system dopo ognuna (vedi Blockchain.pota).
+DIMENSIONE_LOTTO_POTATURA = 1000
+PAGINE_COMPATTAZIONE = 1000
 
 
 class Blockchain:
@@ -14,53 +37,351 @@ class Blockchain:
     Una blockchain è un registro che crea e modifica i record dello stato degli oggetti. Prima di poter aggiungere un record,
     questo deve essere prima verificato."""
 
-    def __init__(self):
+    def __init__(self, difficolta = 5, workers = None, percorso = None, dimensione_cache = 4096, metriche = None,
+                 checkpoint = None, archivio = ARCHIVIO_SQLITE, potatura_blocchi = None, potatura_byte = None):
+        """percorso: Il file del database o la directory del log (default: blockchain.db o blockchain.log nella directory corrente).
+           archivio: Dove sono salvati i blocchi: ARCHIVIO_SQLITE (database SQLite) o ARCHIVIO_LOG (log di segmenti
+                     append-only letto con mmap), vedi Archivio.
+           metriche: Il RegistroMetriche (vedi Metriche) in cui registrare altezza, tempi di validazione, proof-of-work
+                     e latenze del database; None per non registrarle.
+           checkpoint: (altezza, hash) di un blocco noto della catena. I blocchi di uno snapshot collegati fino al
+                       checkpoint vengono importati senza verificarli (vedi carica_snapshot) e i blocchi ricevuti
+                       all'altezza del checkpoint con un hash diverso vengono rifiutati.
+           potatura_blocchi: Se indicato, solo gli ultimi "potatura_blocchi" blocchi conservano il contenuto ("data"):
+                             dei blocchi precedenti resta l'header (id, prev_hash, type, timestamp, nonce, hash e
+                             merkle_root), che basta a verificare la catena (vedi pota). Solo con ARCHIVIO_SQLITE.
+           potatura_byte: Se indicato, il contenuto dei blocchi più vecchi viene tolto finché quello conservato non
+                          supera "potatura_byte" byte. Con entrambi i limiti vale il più restrittivo."""
         super(Blockchain, self).__init__()
+        self.checkpoint = checkpoint
+
+        if potatura_blocchi != None and potatura_blocchi < 1:
+            raise ValueError("potatura_blocchi deve essere almeno 1")
+        self.potatura_blocchi = potatura_blocchi
+        self.potatura_byte = potatura_byte
+        potatura = potatura_blocchi != None or potatura_byte != None
+
+        # L'archivio che contiene la blockchain. Tutte le scritture passano dal suo scrittore, che le conferma a gruppi;
+        # le letture non attendono le scritture.
+        self.archivio = apri_archivio(archivio, percorso, metriche, potatura)
+        self.percorso = self.archivio.percorso
+        self.scrittore = self.archivio.scrittore
+
+        # L'ultimo blocco è tenuto in memoria e aggiornato dopo ogni inserimento confermato; i blocchi letti o inseriti
+        # di recente sono in una cache LRU indicizzata per id e per hash.
+        self.cache = CacheBlocchi(dimensione_cache)
+        self.lock_punta = threading.Lock()
+        self.punta = self.leggi_ultimo_blocco()
+
+        # I blocchi fino a potato_fino_a non hanno più il contenuto; byte_conservati sono i byte del contenuto degli altri,
+        # contati solo con il limite potatura_byte
+        self.lock_potatura = threading.Lock()
+        self.potatura = potatura
+        self.potatura_in_corso = False
+        self.potato_fino_a = self.archivio.limite_potatura()
+        self.byte_conservati = self.archivio.byte_contenuto(self.potato_fino_a + 1) if potatura_byte != None else 0
+
+        # Motore della proof-of-work: difficoltà e numero di processi di default per crea_blocco.
+        self.minatore = Minatore(difficolta, workers)
 
-        # Il database che contiene la blockchain.
-        self.db = sqlite3.connect('blockchain.db', check_same_thread = False)
-        self.init_database()
+        # Controllo dei blocchi prima dell'inserimento e verifica completa del database.
+        self.validatore = Validatore(difficolta, workers)
+
+        self.metriche = metriche
+        if metriche != None:
+            self.istogramma_validazione = metriche.istogramma("validazione_blocco_secondi", "Secondi di validazione di un blocco ricevuto (collegamento, hash e proof-of-work)")
+            self.istogramma_pow = metriche.istogramma("pow_durata_secondi", "Secondi di proof-of-work per ogni blocco creato")
+            self.contatore_pow_hash = metriche.contatore("pow_hash_totale", "Hash calcolati dalla proof-of-work")
+            self.contatore_pow_secondi = metriche.contatore("pow_secondi_totale", "Secondi spesi nella proof-of-work")
+            self.misura_pow = metriche.misura("pow_hash_al_secondo", "Hash al secondo dell'ultima proof-of-work")
+            metriche.misura("blockchain_altezza", "Id dell'ultimo blocco della blockchain", lambda: self.restituisci_punta()[0])
+            metriche.misura("blockchain_potata_fino_a", "Id dell'ultimo blocco senza contenuto", lambda: self.potato_fino_a)
+            self.contatore_potati = metriche.contatore("potatura_blocchi_totale", "Blocchi a cui è stato tolto il contenuto")
+            self.contatore_pagine = metriche.contatore("potatura_pagine_totale", "Pagine del database restituite al file system dopo la potatura")
+
+        # I blocchi già oltre i limiti (es. limiti ridotti dall'ultimo avvio) sono potati subito, mentre si ricevono i nuovi
+        self.pota()
         
-    def init_database(self):
-        c = self.db.cursor()
-        c.execute("SELECT count(name) FROM sqlite_master WHERE type='table' AND name='blockchain'")
-        if ( c.fetchone()[0] != 1 ):
-            c.execute("""CREATE TABLE blockchain(
-                       id INTEGER PRIMARY KEY AUTOINCREMENT,
-                       prev_hash TEXT,
-                       type TEXT,
-                       timestamp TEXT,
-                       data TEXT,
-                       nonce TEXT, 
-                       hash TEXT)""")
+    @property
+    def db(self):
+        # La connessione al database del thread corrente, solo con ARCHIVIO_SQLITE (vedi ArchivioSQLite.db).
+        return self.archivio.db
+
+    def chiudi(self):
+        # Conferma le scritture in attesa e chiude l'archivio.
+        self.archivio.chiudi()
 
     def check_blocco(self, blocco):
+        """Controlla che il blocco sia collegato al blocco precedente già presente nella blockchain, che il suo hash
+           corrisponda al contenuto e che soddisfi la difficoltà della proof-of-work."""
+        precedente = None
+        if blocco.get("id", 1) > 1:
+            precedente = self.restituisci_blocco(blocco["id"] - 1)
+            if precedente == None:
+                print("check_blocco: blocco precedente (" + str(blocco["id"] - 1) + ") non presente nella blockchain")
+                return False
+
+        if not self.validatore.verifica_blocco(blocco, precedente):
+            print("check_blocco: blocco " + str(blocco.get("id")) + " rifiutato: " + self.validatore.errore)
+            return False
+
         return True
+
+    def blocco_da_record(self, record):
+        # Converte un record restituito da restituisci_blocco nel blocco su cui è stata calcolata la proof-of-work.
+        return blocco_da_riga( riga_da_testo([ record[k] for k in INTESTAZIONE ]) )
+
+    def verifica_catena(self, da = None, a = None):
+        """Verifica l'intera blockchain (o i blocchi con id tra "da" e "a") leggendo il database a lotti e
+           ricalcolando gli hash in parallelo. Restituisce il risultato di Validatore.verifica_catena."""
+        da = 1 if da == None else max(1, da)
+        riga_precedente = self.archivio.leggi(da - 1) if da > 1 else None
+        return self.validatore.verifica_lotti(self.archivio.leggi_blocchi(da, a, self.validatore.dimensione_lotto), da, riga_precedente)
             
     def aggiungi_blocco(self, blocco):
         """Questo metodo aggiunge un nuovo blocco alla blockchain. 
-           Controlla che gli hash del blocco e del blocco precedente siano corretti prima che venga aggiunto."""
-        if ( self.check_blocco(blocco) ):
-            c = self.db.cursor()
-            c.execute("INSERT INTO blockchain (prev_hash, type, timestamp, data, nonce, hash) VALUES (?, ?, ?, ?, ?, ?)",
-                      ( blocco["prev_hash"],
-                        blocco["type"], 
-                        blocco["timestamp"],
-                        json.dumps(blocco["data"], sort_keys=True),
-                        blocco["nonce"],
-                        blocco["hash"] ))
-            self.db.commit()
-            return True
-
-        return False
+           Controlla che gli hash del blocco e del blocco precedente siano corretti prima che venga aggiunto.
+           Il blocco è scritto dallo scrittore del database; il metodo ritorna dopo il commit."""
+        esito = self.importa_blocchi([ riga_da_blocco(blocco) ])
+        if esito["rifiutato"] != None:
+            print("check_blocco: blocco " + str(esito["rifiutato"][0]) + " rifiutato: " + esito["rifiutato"][1])
+
+        return esito["inseriti"] == 1
+
+    def importa_blocchi(self, righe):
+        # Importa il lotto di righe con importa_con_cursore tramite lo scrittore e restituisce l'esito dopo il commit.
+        return self.accoda_blocchi(righe).result()
+
+    def accoda_blocchi(self, righe):
+        """Come importa_blocchi, ma non attende: restituisce un Future con l'esito. I lotti accodati da più thread
+           (es. da più nodi connessi) vengono confermati insieme dallo scrittore."""
+        futuro = self.archivio.esegui(self.importa_con_cursore, righe, peso = max(1, len(righe)))
+        futuro.add_done_callback(self.aggiorna_cache)
+        return futuro
+
+    def aggiorna_cache(self, futuro):
+        """Eseguito dallo scrittore dopo il commit di un lotto: i blocchi inseriti entrano nella cache e l'ultimo
+           blocco in memoria viene aggiornato. Tutti gli inserimenti passano da accoda_blocchi, quindi anche i blocchi
+           ricevuti dai nodi connessi mantengono la cache coerente con il database."""
+        if futuro.exception() != None:
+            return
+
+        for riga in futuro.result()["righe_inserite"]:
+            record = self.restituisci_record_blockchain(riga)
+            self.cache.inserisci(record)
+
+            with self.lock_punta:
+                if self.punta == None or record["id"] > self.punta["id"]:
+                    self.punta = record
+
+        if self.potatura:
+            if self.potatura_byte != None:
+                with self.lock_potatura:
+                    self.byte_conservati += sum( len(riga[4]) for riga in futuro.result()["righe_inserite"] )
+            self.pota()
+
+    def pota(self):
+        """Se la catena supera potatura_blocchi o potatura_byte, accoda allo scrittore la potatura del prossimo lotto di
+           DIMENSIONE_LOTTO_POTATURA blocchi, i più vecchi ancora con il contenuto: al termine il lotto successivo viene
+           accodato dopo i blocchi ricevuti nel frattempo, quindi l'importazione non si ferma durante la potatura e la
+           catena non deve essere letta tutta. L'ultimo blocco conserva sempre il contenuto. Chiamato dopo ogni
+           inserimento; una sola potatura alla volta è in corso."""
+        if not self.potatura:
+            return
+
+        altezza = self.restituisci_punta()[0]
+        with self.lock_potatura:
+            fino_a = altezza - self.potatura_blocchi if self.potatura_blocchi != None else 0
+            eccesso = self.byte_conservati - self.potatura_byte if self.potatura_byte != None else 0
+            if self.potatura_in_corso or self.potato_fino_a >= altezza - 1 or (fino_a <= self.potato_fino_a and eccesso <= 0):
+                return
+            self.potatura_in_corso = True
+            da = self.potato_fino_a + 1
+
+        a = min(altezza - 1, da + DIMENSIONE_LOTTO_POTATURA - 1)
+        futuro = self.archivio.esegui(self.pota_con_cursore, da, a, fino_a, eccesso, peso = DIMENSIONE_LOTTO_POTATURA)
+        futuro.add_done_callback(self.potatura_eseguita)
+
+    def pota_con_cursore(self, t, da, a, fino_a, eccesso):
+        """Eseguito dallo scrittore: tra i blocchi da "da" ad "a" toglie il contenuto a quelli fino a "fino_a" e ai
+           successivi finché non sono stati tolti "eccesso" byte, poi restituisce al file system le pagine liberate.
+           Restituisce l'id dell'ultimo blocco potato, i byte tolti e le pagine liberate."""
+        fine, byte = da - 1, 0
+        for id, lunghezza in t.lunghezze_contenuto(da, a):
+            if id > fino_a and byte >= eccesso:
+                break
+            fine, byte = id, byte + (lunghezza or 0)
+
+        if fine >= da:
+            t.pota(da, fine)
+        return {"fino_a": fine, "byte": byte, "pagine": t.compatta(PAGINE_COMPATTAZIONE)}
+
+    def potatura_eseguita(self, futuro):
+        # Eseguito dopo il commit di un lotto della potatura: aggiorna i contatori e accoda il lotto successivo.
+        with self.lock_potatura:
+            self.potatura_in_corso = False
+            if futuro.exception() != None:
+                print("pota: potatura non riuscita: " + str(futuro.exception()))
+                return
+            esito = futuro.result()
+            potati = esito["fino_a"] - self.potato_fino_a
+            self.potato_fino_a = esito["fino_a"]
+            self.byte_conservati -= esito["byte"]
+
+        if self.metriche != None:
+            self.contatore_potati.incrementa(potati)
+            self.contatore_pagine.incrementa(esito["pagine"])
+        if potati > 0:
+            self.pota()
+
+    def statistiche_cache(self):
+        # Restituisce hit/miss e occupazione della cache dei blocchi.
+        return self.cache.statistiche()
+
+    def importa_con_cursore(self, c, righe):
+        """Importa nella transazione corrente un lotto di righe ricevute da un altro nodo (nel formato della tabella
+           blockchain, vedi COLONNE, con hash e timestamp in formato binario). Le righe già presenti vengono riconosciute tramite la chiave primaria e l'indice
+           sugli hash e saltate; le altre vengono salvate solo se valide e collegate al blocco precedente. L'importazione
+           si ferma al primo blocco non valido, dato che i successivi dipendono da esso.
+           Restituisce un dizionario con il numero di blocchi inseriti e duplicati e l'eventuale rifiuto (id, motivo).
+           c è la transazione dell'archivio (vedi Archivio)."""
+        esito = {"inseriti": 0, "duplicati": 0, "rifiutato": None, "righe_inserite": []}
+        precedente = None
+
+        for riga in righe:
+            try:
+                blocco = blocco_da_riga(riga)
+            except (ValueError, TypeError, AttributeError) as e:
+                esito["rifiutato"] = (riga[0] if riga else None, "riga non decodificabile: " + str(e))
+                break
+
+            presente = c.hash_blocco(blocco["id"])
+            if presente != None:
+                if presente != riga[6]:
+                    esito["rifiutato"] = (blocco["id"], "blocco diverso da quello già presente con lo stesso id")
+                    break
+                esito["duplicati"] += 1
+                precedente = blocco
+                continue
+
+            # Il blocco precedente è l'ultimo del lotto oppure va letto dall'archivio (ricerca per id)
+            if precedente == None or precedente["id"] != blocco["id"] - 1:
+                precedente = None
+                if blocco["id"] > 1:
+                    hash_precedente = c.hash_blocco(blocco["id"] - 1)
+                    if hash_precedente == None:
+                        esito["rifiutato"] = (blocco["id"], PRECEDENTE_MANCANTE)
+                        break
+                    precedente = {"id": blocco["id"] - 1, "hash": hash_precedente.hex()}
+
+            if self.checkpoint != None and blocco["id"] == self.checkpoint[0] and blocco["hash"] != self.checkpoint[1]:
+                esito["rifiutato"] = (blocco["id"], DIVERSO_DAL_CHECKPOINT)
+                break
+
+            inizio = perf_counter()
+            errore = controlla_collegamento(blocco, precedente) or controlla_blocco(blocco, self.validatore.difficolta)
+            if self.metriche != None:
+                self.istogramma_validazione.osserva(perf_counter() - inizio)
+            if errore != None:
+                esito["rifiutato"] = (blocco["id"], errore)
+                break
+
+            riga = list(riga)
+            riga[5] = int(riga[5])
+            if c.inserisci(riga):
+                esito["inseriti"] += 1
+                esito["righe_inserite"].append(riga)
+            else:
+                esito["duplicati"] += 1 # Stesso hash già presente con un altro id
+            precedente = blocco
+
+        return esito
+
+    def crea_snapshot(self, percorso, altezza = None):
+        """Salva in "percorso" lo snapshot dei blocchi da 1 ad "altezza" (default: l'ultimo blocco), leggendoli con un
+           cursore. Restituisce (altezza, hash) dell'ultimo blocco salvato, da usare come checkpoint dei nodi che
+           caricheranno lo snapshot."""
+        if altezza == None:
+            altezza = self.restituisci_punta()[0]
+        if self.potato_fino_a > 0:
+            raise SnapshotNonValido("il contenuto dei blocchi fino a %d è stato potato" % self.potato_fino_a)
+        return scrivi_snapshot(percorso, self.leggi_blocchi(1, altezza, DIMENSIONE_LOTTO_SNAPSHOT))
+
+    def carica_snapshot(self, percorso):
+        """Importa i blocchi dello snapshot "percorso" (vedi Snapshot) che mancano alla blockchain, in un'unica
+           transazione: se lo snapshot non è valido non viene importato nulla e viene sollevato SnapshotNonValido.
+           Se lo snapshot arriva al checkpoint (con lo stesso hash) dei blocchi fino al checkpoint si controllano
+           collegamento, hash dell'header e proof-of-work, che li legano all'hash del checkpoint, ma non la radice di
+           Merkle: il loro contenuto ("data") non viene decodificato né confrontato con l'header, quindi un contenuto
+           alterato fino al checkpoint non viene rilevato (lo rileva verifica_catena). I blocchi oltre il checkpoint
+           sono verificati come i blocchi ricevuti. Il tempo di avvio dipende quindi dai blocchi oltre il checkpoint,
+           che i nodi connessi invieranno con la normale sincronizzazione.
+           Restituisce un dizionario con altezza e hash dello snapshot, blocchi inseriti e blocchi verificati."""
+        with Snapshot(percorso) as snapshot:
+            if not snapshot.verifica_integrita():
+                raise SnapshotNonValido(percorso + ": il contenuto non corrisponde al digest dell'intestazione")
+            esito = self.archivio.esegui(self.importa_snapshot_con_cursore, snapshot, peso = self.scrittore.max_peso).result()
+
+        if esito["inseriti"]:
+            punta = self.leggi_ultimo_blocco()
+            with self.lock_punta:
+                self.punta = punta
+            if self.potatura_byte != None:
+                with self.lock_potatura:
+                    self.byte_conservati = self.archivio.byte_contenuto(self.potato_fino_a + 1)
+            self.pota()
+
+        return esito
+
+    def importa_snapshot_con_cursore(self, c, snapshot):
+        # Eseguito dallo scrittore nella transazione corrente (vedi carica_snapshot).
+        esito = {"altezza": snapshot.altezza, "hash": snapshot.hash, "inseriti": 0, "verificati": 0}
+        altezza_locale = c.altezza()
+        if snapshot.altezza <= altezza_locale:
+            return esito
+
+        # Senza un checkpoint raggiunto dallo snapshot, l'hash della sua intestazione non è un'ancora affidabile
+        fidati = 0
+        if self.checkpoint != None and self.checkpoint[0] <= snapshot.altezza:
+            fidati = self.checkpoint[0]
+        hash_locale = c.hash_blocco(altezza_locale)
+
+        for righe in snapshot.lotti():
+            if righe[-1][0] < altezza_locale:
+                continue
+
+            nuove = []
+            for riga in righe:
+                if riga[0] == altezza_locale and riga[6] != hash_locale:
+                    raise SnapshotNonValido("lo snapshot diverge dalla blockchain locale al blocco %d" % riga[0])
+                if riga[0] == fidati and riga[6].hex() != self.checkpoint[1]:
+                    raise SnapshotNonValido("il blocco %d dello snapshot è diverso dal checkpoint" % riga[0])
+                if riga[0] <= altezza_locale:
+                    continue
+
+                if riga[0] > fidati:
+                    errore = controlla_blocco(blocco_da_riga(riga), self.validatore.difficolta)
+                    esito["verificati"] += 1
+                else: # Solo l'header: il collegamento fino al checkpoint vale se ogni hash è quello del suo header
+                    errore = controlla_header(header_da_riga(riga_header_da_riga(riga)), self.validatore.difficolta)
+                if errore != None:
+                    raise SnapshotNonValido("blocco %d dello snapshot non valido: %s" % (riga[0], errore))
+                nuove.append(riga)
+
+            c.inserisci_righe(nuove)
+            esito["inseriti"] += len(nuove)
+
+        return esito
 
     def restituisci_record_blockchain(self, data):
-        header = ("id", "prev_hash", "type", "timestamp", "data", "nonce", "hash")
+        # Converte una riga della tabella nel record restituito da restituisci_blocco, con i campi in formato testuale.
+        header = INTESTAZIONE
         
         if ( len(data) != len(header) ):
-            print("La Blockchain non contiene i " + len(header) + " elementi richiesti")
+            print("La Blockchain non contiene i " + str(len(header)) + " elementi richiesti")
             return None
 
+        data = riga_testo(data)
         record = {}
         for i in range(len(header)):
             record[header[i]] = data[i]
@@ -69,49 +390,139 @@ class Blockchain:
         
     def restituisci_blocco(self, index):
         # Questo metodo restituisce il blocco dell'indice dato. Quando l'indice non esiste, viene restituito None.
-        c = self.db.cursor()
-        c.execute("SELECT * FROM blockchain WHERE id=?", (index,))
+        record = self.cache.per_indice(index)
+        if record != None:
+            return dict(record)
+
+        data = self.archivio.leggi(index)
+        if ( data != None ):
+            record = self.restituisci_record_blockchain(data)
+            self.cache.inserisci(record)
+            return dict(record)
+
+        return None
 
-        data = c.fetchone()
+    def restituisci_blocco_da_hash(self, hash):
+        # Restituisce il blocco con l'hash dato, oppure None se non esiste.
+        record = self.cache.per_hash_blocco(hash)
+        if record != None:
+            return dict(record)
+
+        try:
+            digest = digest_binario(hash)
+        except (ValueError, TypeError):
+            return None
+
+        data = self.archivio.leggi_da_hash(digest)
         if ( data != None ):
-            return self.restituisci_record_blockchain(data)
+            record = self.restituisci_record_blockchain(data)
+            self.cache.inserisci(record)
+            return dict(record)
 
         return None
             
     def restituisci_ultimo_blocco(self):
-        # Questo metodo restituisce l'ultimo blocco della blockchain.
-        c = self.db.cursor()
-        for row in c.execute('SELECT * FROM blockchain ORDER BY id DESC LIMIT 1'):
-            return self.restituisci_record_blockchain(row)
-        return None
+        # Questo metodo restituisce l'ultimo blocco della blockchain, tenuto in memoria.
+        with self.lock_punta:
+            return dict(self.punta) if self.punta != None else None
+
+    def leggi_ultimo_blocco(self):
+        # Legge dall'archivio l'ultimo blocco della blockchain.
+        riga = self.archivio.leggi_ultimo()
+        return self.restituisci_record_blockchain(riga) if riga != None else None
+
+    def restituisci_punta(self):
+        # Restituisce (id, hash) dell'ultimo blocco, oppure (0, prev_hash del primo blocco) se la blockchain è vuota.
+        ultimo = self.restituisci_ultimo_blocco()
+        if ultimo == None:
+            return 0, PREV_HASH_GENESI
+        return ultimo["id"], ultimo["hash"]
+
+    def leggi_blocchi(self, da, a = None, dimensione_lotto = 500):
+        """Restituisce, a lotti di al massimo "dimensione_lotto" righe, i blocchi con id tra "da" e "a" (estremi inclusi,
+           None per arrivare all'ultimo blocco). Le righe sono lette a lotti dall'archivio, quindi la memoria usata non
+           dipende dalla lunghezza della catena."""
+        return self.archivio.leggi_blocchi(da, a, dimensione_lotto)
+
+    def leggi_header(self, da, a = None, dimensione_lotto = 2000):
+        # Come leggi_blocchi, ma restituisce solo gli header (colonne COLONNE_HEADER) richiesti dai nodi leggeri.
+        return self.archivio.leggi_header(da, a, dimensione_lotto)
+
+    def cerca_blocchi(self, tipo = None, da = None, a = None, dimensione_pagina = 500):
+        """Restituisce uno alla volta, in ordine di timestamp, i blocchi (come restituisci_blocco) di tipo "tipo" con
+           timestamp tra "da" e "a" (estremi inclusi, datetime o testo ISO 8601; None per non filtrare), es. i blocchi
+           "transazione1" dell'ultima ora: cerca_blocchi("transazione1", datetime.now() - timedelta(hours=1)).
+           I blocchi sono letti dagli indici dell'archivio a pagine di "dimensione_pagina", ognuna a partire dall'ultimo
+           blocco della precedente: la memoria usata non dipende dal numero di risultati e i blocchi inseriti durante
+           la lettura non fanno ripetere quelli già restituiti. I filtri su "da" e "a" escludono i blocchi con timestamp
+           testuale (vedi Codifica.timestamp_binario)."""
+        da, a = timestamp_intero(da), timestamp_intero(a)
+        dopo = None
+        while True:
+            righe = self.archivio.cerca(tipo, da, a, dopo, dimensione_pagina)
+            for riga in righe:
+                yield self.restituisci_record_blockchain(riga)
+            if len(righe) < dimensione_pagina:
+                return
+            dopo = (righe[-1][3], righe[-1][0])
 
-    def crea_blocco(self, data, type):
+    def prova_inclusione(self, id_blocco, hash_transazione):
+        """Restituisce la prova che la transazione con l'hash dato è contenuta nel blocco "id_blocco": un dizionario con
+           id del blocco, hash e posizione della transazione e la lista dei nodi fratelli (vedi Merkle.prova_merkle).
+           Restituisce None se il blocco non esiste, non contiene la transazione o è stato potato."""
+        record = self.restituisci_blocco(id_blocco)
+        if record == None or record["data"] == None:
+            return None
+
+        foglie = self.hash_transazioni_blocco(record)
+        if hash_transazione not in foglie:
+            return None
+
+        indice = foglie.index(hash_transazione)
+        return {"blocco": record["id"], "transazione": hash_transazione, "indice": indice, "prova": prova_merkle(foglie, indice)}
+
+    def crea_blocco(self, data, type, difficolta = None, workers = None):
         """Questo metodo crea un nuovo blocco da inserire nella blockchain. 
            Utilizza la proof-of-work per rendere la blockchain immutabile e non hackerabile. 
-           Per migliorare la catena, i blocchi devono essere aggiunti costantemente."""
+           Per migliorare la catena, i blocchi devono essere aggiunti costantemente.
+           difficolta e workers permettono di scegliere, per questo blocco, la difficoltà e il numero di processi. La
+           difficoltà non può essere inferiore a quella della blockchain, altrimenti il blocco verrebbe rifiutato da
+           aggiungi_blocco: in quel caso solleva ValueError."""
+        if difficolta != None and difficolta < self.validatore.difficolta:
+            raise ValueError("difficoltà %d inferiore a quella della blockchain (%d)" % (difficolta, self.validatore.difficolta))
+
         ultimo_blocco = self.restituisci_ultimo_blocco()
-        print("LAST:")
-        print(ultimo_blocco)
         timestamp = datetime.now()
         blocco = {
             "id"       : (ultimo_blocco["id"] + 1) if ultimo_blocco != None else 1,
-            "prev_hash": ultimo_blocco["hash"] if ultimo_blocco != None else 0,
+            "prev_hash": ultimo_blocco["hash"] if ultimo_blocco != None else "0"*128,
             "type"     : type,
             "timestamp": timestamp.isoformat(),
             "data"     : data,
             "nonce"    : 0
         }
+        blocco["merkle_root"] = radice_merkle_blocco(type, data)
 
-        # Implementazione della proof-of-work
-        difficoltà = 5
-        h = hashlib.sha512()
-        h.update( json.dumps(blocco, sort_keys=True).encode("utf-8") )
-        while ( h.hexdigest()[:difficoltà] != "0"*difficoltà ):
-            blocco["nonce"] = blocco["nonce"] + 1
-            h.update( json.dumps(blocco, sort_keys=True).encode("utf-8") )
-
-        blocco["hash"] = h.hexdigest()
+        # Implementazione della proof-of-work (parallela, vedi Minatore). Le statistiche dell'ultima proof-of-work
+        # restano in self.minatore.statistiche e, se presente, nel registro delle metriche.
+        self.minatore.mina(blocco, difficolta, workers)
+        if self.metriche != None:
+            statistiche = self.minatore.statistiche
+            self.istogramma_pow.osserva(statistiche["secondi"])
+            self.contatore_pow_hash.incrementa(statistiche["hash"])
+            self.contatore_pow_secondi.incrementa(statistiche["secondi"])
+            self.misura_pow.imposta(statistiche["hash_al_secondo"])
 
         return blocco
 
+    def crea_blocco_transazioni(self, transazioni, difficolta = None, workers = None):
+        """Crea un blocco di tipo TIPO_TRANSAZIONI che contiene la lista di transazioni data (es. estratta dal Mempool).
+           L'header contiene la radice di Merkle delle transazioni, quindi una sola proof-of-work conferma tutte le
+           transazioni del blocco."""
+        return self.crea_blocco(list(transazioni), TIPO_TRANSAZIONI, difficolta, workers)
+
+    def hash_transazioni_blocco(self, record):
+        # Restituisce gli hash delle transazioni contenute nel blocco (record della tabella blockchain).
+        return [ hash_transazione(t) for t in transazioni_blocco(record["type"], json.loads(record["data"])) ]
+
 
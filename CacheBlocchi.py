@@ -0,0 +1,66 @@
+import threading
+import collections
+
+
+class CacheBlocchi:
+    """Cache LRU di dimensione limitata dei blocchi letti di recente, indicizzata per id e per hash. I blocchi sono
+       i record restituiti da Blockchain.restituisci_blocco; i contatori hit/miss permettono di valutarne l'efficacia."""
+
+    def __init__(self, capacita = 4096):
+        # capacita: Il numero massimo di blocchi in cache (0 disabilita la cache).
+        self.capacita = capacita
+        self.per_id = collections.OrderedDict()
+        self.per_hash = {}
+        self.lock = threading.Lock()
+
+        self.hit = 0
+        self.miss = 0
+
+    def inserisci(self, record):
+        # Inserisce (o aggiorna) il blocco e, se necessario, elimina il blocco usato meno di recente.
+        if self.capacita <= 0:
+            return
+
+        with self.lock:
+            self.per_id[record["id"]] = record
+            self.per_id.move_to_end(record["id"])
+            self.per_hash[record["hash"]] = record["id"]
+
+            while len(self.per_id) > self.capacita:
+                _, vecchio = self.per_id.popitem(last=False)
+                if self.per_hash.get(vecchio["hash"]) == vecchio["id"]:
+                    del self.per_hash[vecchio["hash"]]
+
+    def per_indice(self, id):
+        # Restituisce il blocco con l'id dato, oppure None se non è in cache.
+        with self.lock:
+            record = self.per_id.get(id)
+            if record == None:
+                self.miss += 1
+                return None
+
+            self.per_id.move_to_end(id)
+            self.hit += 1
+            return record
+
+    def per_hash_blocco(self, hash):
+        # Restituisce il blocco con l'hash dato, oppure None se non è in cache.
+        with self.lock:
+            id = self.per_hash.get(hash)
+            if id == None:
+                self.miss += 1
+                return None
+
+            self.per_id.move_to_end(id)
+            self.hit += 1
+            return self.per_id[id]
+
+    def svuota(self):
+        with self.lock:
+            self.per_id.clear()
+            self.per_hash.clear()
+
+    def statistiche(self):
+        # Restituisce hit, miss, numero di blocchi in cache e capacità.
+        with self.lock:
+            return {"hit": self.hit, "miss": self.miss, "dimensione": len(self.per_id), "capacita": self.capacita}
@@ -0,0 +1,149 @@
+import os
+import time
+import threading
+
+from Merkle import verifica_prova
+from Validatore import header_da_riga, controlla_header, controlla_collegamento, COLONNE_HEADER, PREV_HASH_GENESI
+from Scrittore import ScrittoreDB, apri_connessione
+
+
+# Nomi dei campi delle righe della tabella header, nell'ordine di COLONNE_HEADER.
+INTESTAZIONE_HEADER = tuple( c.strip() for c in COLONNE_HEADER.split(",") )
+
+# Motivo del rifiuto di un header il cui predecessore non è ancora nella catena.
+HEADER_PRECEDENTE_MANCANTE = "header precedente non presente nella catena"
+
+
+class CatenaHeader:
+    """Catena dei soli header dei blocchi, usata dai nodi leggeri. Ogni header contiene la radice di Merkle delle
+       transazioni del blocco ed è verificato (collegamento, hash e proof-of-work) come i blocchi completi, quindi
+       una transazione si può verificare con una prova di inclusione ricevuta da un nodo completo, senza scaricare
+       il contenuto dei blocchi. Un header occupa qualche centinaio di byte qualunque sia la dimensione del blocco."""
+
+    def __init__(self, difficolta = 5, percorso = 'header.db', metriche = None):
+        # Come in Blockchain le scritture passano dallo scrittore e ogni thread legge con una propria connessione.
+        self.difficolta = difficolta
+        self.percorso = os.path.abspath(percorso)
+        self.locale = threading.local()
+        self.scrittore = ScrittoreDB(percorso, metriche = metriche)
+        self.init_database()
+        self.scrittore.start()
+
+        self.lock_punta = threading.Lock()
+        self.punta = self.leggi_ultimo_header()
+
+        self.metriche = metriche
+        if metriche != None:
+            self.istogramma_validazione = metriche.istogramma("validazione_header_secondi", "Secondi di validazione di un header ricevuto (collegamento, hash e proof-of-work)")
+            metriche.misura("catena_header_altezza", "Id dell'ultimo header della catena", lambda: self.restituisci_punta()[0])
+
+    @property
+    def db(self):
+        # La connessione al database del thread corrente.
+        db = getattr(self.locale, "db", None)
+        if db == None:
+            db = apri_connessione(self.percorso)
+            self.locale.db = db
+        return db
+
+    def chiudi(self):
+        self.scrittore.chiudi()
+
+    def init_database(self):
+        c = self.scrittore.db.cursor()
+        c.execute("""CREATE TABLE IF NOT EXISTS header(
+                   id INTEGER PRIMARY KEY,
+                   prev_hash BLOB,
+                   type TEXT,
+                   timestamp INTEGER,
+                   merkle_root BLOB,
+                   nonce INTEGER,
+                   hash BLOB)""")
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS header_hash ON header(hash)")
+
+    def importa_header(self, righe):
+        """Importa un lotto di righe di header (ordine di COLONNE_HEADER, in formato binario) e restituisce l'esito dopo il commit:
+           un dizionario con il numero di header inseriti e duplicati e l'eventuale rifiuto (id, motivo)."""
+        esito = self.scrittore.esegui(self.importa_con_cursore, righe, peso = max(1, len(righe))).result()
+
+        if esito["ultimo"] != None:
+            with self.lock_punta:
+                if self.punta == None or esito["ultimo"]["id"] > self.punta["id"]:
+                    self.punta = esito["ultimo"]
+
+        return esito
+
+    def importa_con_cursore(self, c, righe):
+        # Come Blockchain.importa_con_cursore, ma per gli header: si ferma al primo header non valido.
+        esito = {"inseriti": 0, "duplicati": 0, "rifiutato": None, "ultimo": None}
+        precedente = None
+
+        for riga in righe:
+            try:
+                header = header_da_riga(riga)
+            except (ValueError, TypeError, AttributeError) as e:
+                esito["rifiutato"] = (riga[0] if riga else None, "riga non decodificabile: " + str(e))
+                break
+
+            presente = c.execute("SELECT hash FROM header WHERE id=?", (header["id"],)).fetchone()
+            if presente != None:
+                if presente[0] != riga[6]:
+                    esito["rifiutato"] = (header["id"], "header diverso da quello già presente con lo stesso id")
+                    break
+                esito["duplicati"] += 1
+                precedente = header
+                continue
+
+            if precedente == None or precedente["id"] != header["id"] - 1:
+                precedente = None
+                if header["id"] > 1:
+                    riga_precedente = c.execute("SELECT id, hash FROM header WHERE id=?", (header["id"] - 1,)).fetchone()
+                    if riga_precedente == None:
+                        esito["rifiutato"] = (header["id"], HEADER_PRECEDENTE_MANCANTE)
+                        break
+                    precedente = {"id": riga_precedente[0], "hash": riga_precedente[1].hex()}
+
+            inizio = time.perf_counter()
+            errore = controlla_collegamento(header, precedente) or controlla_header(header, self.difficolta)
+            if self.metriche != None:
+                self.istogramma_validazione.osserva(time.perf_counter() - inizio)
+            if errore != None:
+                esito["rifiutato"] = (header["id"], errore)
+                break
+
+            riga = list(riga)
+            riga[5] = int(riga[5])
+            c.execute("INSERT OR IGNORE INTO header (" + COLONNE_HEADER + ") VALUES (" + ", ".join("?"*len(INTESTAZIONE_HEADER)) + ")", riga)
+            if c.rowcount == 1:
+                esito["inseriti"] += 1
+                esito["ultimo"] = header
+            else:
+                esito["duplicati"] += 1
+            precedente = header
+
+        return esito
+
+    def restituisci_header(self, id):
+        # Restituisce l'header del blocco "id" come dizionario (vedi header_da_riga), oppure None se non è nella catena.
+        riga = self.db.execute("SELECT " + COLONNE_HEADER + " FROM header WHERE id=?", (id,)).fetchone()
+        return header_da_riga(riga) if riga != None else None
+
+    def leggi_ultimo_header(self):
+        riga = self.db.execute("SELECT " + COLONNE_HEADER + " FROM header ORDER BY id DESC LIMIT 1").fetchone()
+        return header_da_riga(riga) if riga != None else None
+
+    def restituisci_punta(self):
+        # Restituisce (id, hash) dell'ultimo header, oppure (0, prev_hash del primo blocco) se la catena è vuota.
+        with self.lock_punta:
+            if self.punta == None:
+                return 0, PREV_HASH_GENESI
+            return self.punta["id"], self.punta["hash"]
+
+    def verifica_inclusione(self, prova):
+        """Verifica una prova restituita da Blockchain.prova_inclusione: la transazione è nel blocco se, combinata con
+           i nodi della prova, produce la radice di Merkle dell'header già verificato. Restituisce True o False."""
+        try:
+            header = self.restituisci_header(prova["blocco"])
+            return header != None and verifica_prova(prova["transazione"], prova["prova"], header["merkle_root"])
+        except (KeyError, TypeError):
+            return False
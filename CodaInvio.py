@@ -0,0 +1,135 @@
+import time
+import threading
+import collections
+
+
+# Politiche applicate quando la coda di invio di un nodo è piena.
+POLITICA_SCARTA_VECCHI = 'scarta_vecchi' # Scarta i messaggi più vecchi ancora in coda
+POLITICA_BLOCCA = 'blocca'               # Blocca chi invia finché si libera spazio (al massimo timeout_blocco secondi)
+POLITICA_DISCONNETTI = 'disconnetti'     # Disconnette il nodo lento
+
+# Byte scritti al massimo con una sola chiamata al socket quando più messaggi vengono accorpati.
+DIMENSIONE_LOTTO = 256 * 1024
+
+
+class CodaInvio:
+    """Coda limitata dei messaggi (già codificati in byte) in attesa di essere scritti sul socket di un nodo connesso.
+       Chi invia inserisce i messaggi senza toccare il socket; lo scrittore della connessione li estrae a lotti e li
+       scrive con una sola chiamata. Il limite è espresso sia in numero di messaggi sia in byte: quando viene superato
+       si applica la politica scelta. Un messaggio più grande di max_byte viene accettato solo a coda vuota."""
+
+    def __init__(self, max_messaggi = 10000, max_byte = 32 * 1024 * 1024, politica = POLITICA_DISCONNETTI, timeout_blocco = 10.0, istogramma_attesa = None):
+        """max_messaggi: Il numero massimo di messaggi in coda.
+           max_byte: Il numero massimo di byte in coda.
+           politica: POLITICA_SCARTA_VECCHI, POLITICA_BLOCCA o POLITICA_DISCONNETTI.
+           timeout_blocco: Con POLITICA_BLOCCA, dopo quanti secondi di attesa il nodo viene disconnesso (None: nessun limite).
+           istogramma_attesa: L'Istogramma (vedi Metriche) in cui osservare quanti secondi ogni messaggio resta in coda."""
+        if politica not in (POLITICA_SCARTA_VECCHI, POLITICA_BLOCCA, POLITICA_DISCONNETTI):
+            raise ValueError("politica della coda non valida: " + str(politica))
+
+        self.max_messaggi = max_messaggi
+        self.max_byte = max_byte
+        self.politica = politica
+        self.timeout_blocco = timeout_blocco
+        self.istogramma_attesa = istogramma_attesa
+
+        # Coppie (frame, istante di inserimento)
+        self.messaggi = collections.deque()
+        self.byte = 0
+        self.scartati = 0
+        self.chiusa = False
+        self.condizione = threading.Condition()
+
+    def piena(self, dimensione):
+        # True se un messaggio di "dimensione" byte non può essere inserito senza superare i limiti.
+        if not self.messaggi:
+            return False
+        return len(self.messaggi) >= self.max_messaggi or self.byte + dimensione > self.max_byte
+
+    def inserisci(self, frame, puo_bloccare = True):
+        """Inserisce il frame in coda applicando la politica se la coda è piena. Restituisce False se il nodo deve essere
+           disconnesso (POLITICA_DISCONNETTI, attesa scaduta con POLITICA_BLOCCA o coda chiusa). Con puo_bloccare=False
+           (es. dall'event loop) POLITICA_BLOCCA si comporta come se l'attesa fosse già scaduta."""
+        with self.condizione:
+            if self.chiusa:
+                return False
+
+            if self.piena(len(frame)):
+                if self.politica == POLITICA_DISCONNETTI:
+                    return False
+
+                if self.politica == POLITICA_SCARTA_VECCHI:
+                    while self.piena(len(frame)):
+                        self.byte -= len(self.messaggi.popleft()[0])
+                        self.scartati += 1
+
+                else:
+                    if not puo_bloccare:
+                        return False
+
+                    scadenza = None if self.timeout_blocco == None else time.monotonic() + self.timeout_blocco
+                    while self.piena(len(frame)) and not self.chiusa:
+                        attesa = None if scadenza == None else scadenza - time.monotonic()
+                        if attesa != None and attesa <= 0:
+                            return False
+                        self.condizione.wait(attesa)
+
+                    if self.chiusa:
+                        return False
+
+            self.messaggi.append( (frame, time.perf_counter()) )
+            self.byte += len(frame)
+            self.condizione.notify_all()
+            return True
+
+    def _estrai(self, max_byte):
+        estratti = [ self.messaggi.popleft() ]
+        dimensione = len(estratti[0][0])
+        while self.messaggi and dimensione + len(self.messaggi[0][0]) <= max_byte:
+            dimensione += len(self.messaggi[0][0])
+            estratti.append(self.messaggi.popleft())
+
+        self.byte -= dimensione
+        self.condizione.notify_all() # Risveglia chi è bloccato in inserisci
+
+        if self.istogramma_attesa != None:
+            adesso = time.perf_counter()
+            self.istogramma_attesa.osserva_valori([ adesso - istante for _, istante in estratti ])
+        return [ frame for frame, _ in estratti ]
+
+    def estrai_lotto(self, max_byte = DIMENSIONE_LOTTO, timeout = None):
+        """Attende che ci sia almeno un messaggio e restituisce i messaggi in coda fino a max_byte (sempre almeno uno).
+           Restituisce una lista vuota se il tempo è scaduto o se la coda è chiusa e non ha più messaggi."""
+        with self.condizione:
+            if not self.messaggi and not self.chiusa:
+                self.condizione.wait(timeout)
+
+            if not self.messaggi:
+                return []
+
+            return self._estrai(max_byte)
+
+    def estrai_lotto_nowait(self, max_byte = DIMENSIONE_LOTTO):
+        # Come estrai_lotto ma senza attendere: restituisce una lista vuota se la coda è vuota.
+        with self.condizione:
+            if not self.messaggi:
+                return []
+            return self._estrai(max_byte)
+
+    def chiudi(self):
+        # Chiude la coda: i nuovi messaggi vengono rifiutati, quelli già in coda possono ancora essere estratti.
+        with self.condizione:
+            self.chiusa = True
+            self.condizione.notify_all()
+
+    def stato(self):
+        # Restituisce lo stato della coda: messaggi e byte in attesa, messaggi scartati e limiti configurati.
+        with self.condizione:
+            return {
+                "messaggi": len(self.messaggi),
+                "byte": self.byte,
+                "scartati": self.scartati,
+                "max_messaggi": self.max_messaggi,
+                "max_byte": self.max_byte,
+                "politica": self.politica
+            }
@@ -0,0 +1,177 @@
+import struct
+from datetime import datetime, timedelta
+
+
+# Formato binario dei blocchi, usato per il salvataggio (colonne BLOB e INTEGER) e per la trasmissione tra i nodi.
+# Gli hash SHA-512 occupano 64 byte invece dei 128 caratteri esadecimali e il timestamp è un intero (microsecondi
+# dal 1970-01-01, senza fuso orario come i timestamp creati da Blockchain.crea_blocco).
+#
+# Un blocco codificato è composto da:
+#   - header a dimensione fissa (HEADER_BLOCCO): versione, flag, id, timestamp, nonce, prev_hash, merkle_root, hash
+#     e lunghezza del campo "type";
+#   - il campo "type" (UTF-8);
+#   - se è presente FLAG_TIMESTAMP_TESTO, la lunghezza (2 byte) e il testo del timestamp, per i timestamp che non si
+#     possono rappresentare come intero senza perdere informazioni (es. con fuso orario);
+#   - se non è presente FLAG_SOLO_HEADER, la lunghezza (4 byte) e il JSON del campo "data".
+VERSIONE = 1
+HEADER_BLOCCO = struct.Struct('!BBQqQ64s64s64sH')
+LUNGHEZZA_TESTO = struct.Struct('!H')
+LUNGHEZZA_DATI = struct.Struct('!I')
+FLAG_TIMESTAMP_TESTO = 0x01
+FLAG_SOLO_HEADER = 0x02
+
+# Messaggi binari tra i nodi: un byte con il tipo, il numero di elementi (4 byte) e i blocchi (o gli header) codificati.
+MESSAGGIO_BLOCCHI = 1
+MESSAGGIO_HEADER = 2
+NUMERO_ELEMENTI = struct.Struct('!I')
+
+# Origine dei timestamp interi.
+EPOCA = datetime(1970, 1, 1)
+MICROSECONDO = timedelta(microseconds=1)
+
+# Limiti dei timestamp interi (8 byte con segno nell'header).
+TIMESTAMP_MINIMO = -2**63
+TIMESTAMP_MASSIMO = 2**63 - 1
+
+
+def timestamp_binario(timestamp):
+    """Converte il timestamp ISO 8601 nell'intero salvato nel database. Se la conversione inversa non restituisce
+       esattamente lo stesso testo (su cui è calcolata la proof-of-work) il timestamp resta testuale."""
+    try:
+        intero = (datetime.fromisoformat(timestamp) - EPOCA) // MICROSECONDO
+    except (ValueError, TypeError):
+        return timestamp
+    return intero if timestamp_testo(intero) == timestamp else timestamp
+
+def timestamp_testo(timestamp):
+    # Converte il timestamp salvato nel database (intero o testo) nel testo ISO 8601 originale.
+    if isinstance(timestamp, int):
+        return (EPOCA + timestamp * MICROSECONDO).isoformat()
+    return timestamp
+
+def timestamp_intero(valore):
+    """Converte un istante (datetime senza fuso orario, testo ISO 8601 o intero già convertito) nell'intero con cui
+       i timestamp sono salvati, per confrontarlo con quelli dei blocchi. None resta None."""
+    if valore == None or isinstance(valore, int):
+        return valore
+    if isinstance(valore, str):
+        valore = datetime.fromisoformat(valore)
+    return (valore - EPOCA) // MICROSECONDO
+
+def digest_binario(digest):
+    return bytes.fromhex(digest) if digest != None else None
+
+def digest_testo(digest):
+    return digest.hex() if digest != None else None
+
+
+# Posizione dei campi convertiti nelle righe dei blocchi (ordine di COLONNE) e degli header (ordine di COLONNE_HEADER).
+DIGEST_BLOCCO = (1, 6, 7)
+DIGEST_HEADER = (1, 4, 6)
+
+def _converti(riga, digest, funzione_digest, funzione_timestamp, funzione_nonce):
+    riga = list(riga)
+    for i in digest:
+        riga[i] = funzione_digest(riga[i])
+    riga[3] = funzione_timestamp(riga[3])
+    riga[5] = funzione_nonce(riga[5])
+    return riga
+
+def riga_testo(riga):
+    """Converte una riga binaria della tabella blockchain nel formato testuale JSON (hash esadecimali, timestamp
+       ISO 8601, nonce come testo), usato dai nodi precedenti e dai messaggi JSON."""
+    return _converti(riga, DIGEST_BLOCCO, digest_testo, timestamp_testo, str)
+
+def riga_da_testo(riga):
+    # Converte una riga in formato testuale (vedi riga_testo) nel formato binario della tabella blockchain.
+    return _converti(riga, DIGEST_BLOCCO, digest_binario, timestamp_binario, int)
+
+def riga_header_testo(riga):
+    return _converti(riga, DIGEST_HEADER, digest_testo, timestamp_testo, str)
+
+def riga_header_da_testo(riga):
+    return _converti(riga, DIGEST_HEADER, digest_binario, timestamp_binario, int)
+
+
+def _codifica(id, prev_hash, type, timestamp, merkle_root, nonce, hash, data):
+    flag = 0 if data != None else FLAG_SOLO_HEADER
+    type = type.encode("utf-8")
+
+    if isinstance(timestamp, int):
+        coda = b""
+    else:
+        flag |= FLAG_TIMESTAMP_TESTO
+        testo = timestamp.encode("utf-8")
+        coda = LUNGHEZZA_TESTO.pack(len(testo)) + testo
+        timestamp = 0
+
+    if data != None:
+        data = data.encode("utf-8")
+        coda += LUNGHEZZA_DATI.pack(len(data)) + data
+
+    return HEADER_BLOCCO.pack(VERSIONE, flag, id, timestamp, nonce, prev_hash, merkle_root, hash, len(type)) + type + coda
+
+def codifica_riga(riga):
+    # Codifica una riga binaria della tabella blockchain (ordine di COLONNE).
+    id, prev_hash, type, timestamp, data, nonce, hash, merkle_root = riga
+    return _codifica(id, prev_hash, type, timestamp, merkle_root, nonce, hash, data)
+
+def codifica_riga_header(riga):
+    # Codifica una riga binaria di header (ordine di COLONNE_HEADER): il blocco senza il campo "data".
+    id, prev_hash, type, timestamp, merkle_root, nonce, hash = riga
+    return _codifica(id, prev_hash, type, timestamp, merkle_root, nonce, hash, None)
+
+def decodifica_riga(buffer, posizione = 0):
+    """Decodifica il blocco che inizia in "posizione" e restituisce (riga, posizione successiva). La riga è nell'ordine
+       di COLONNE oppure, per gli header, di COLONNE_HEADER. Solleva ValueError se i dati non sono validi."""
+    try:
+        versione, flag, id, timestamp, nonce, prev_hash, merkle_root, hash, lunghezza = HEADER_BLOCCO.unpack_from(buffer, posizione)
+        if versione != VERSIONE:
+            raise ValueError("versione del formato dei blocchi non supportata: %d" % versione)
+        posizione += HEADER_BLOCCO.size
+
+        type = bytes(buffer[posizione:posizione + lunghezza]).decode("utf-8")
+        posizione += lunghezza
+
+        if flag & FLAG_TIMESTAMP_TESTO:
+            lunghezza, = LUNGHEZZA_TESTO.unpack_from(buffer, posizione)
+            posizione += LUNGHEZZA_TESTO.size
+            timestamp = bytes(buffer[posizione:posizione + lunghezza]).decode("utf-8")
+            posizione += lunghezza
+
+        if flag & FLAG_SOLO_HEADER:
+            return [id, prev_hash, type, timestamp, merkle_root, nonce, hash], posizione
+
+        lunghezza, = LUNGHEZZA_DATI.unpack_from(buffer, posizione)
+        posizione += LUNGHEZZA_DATI.size
+        data = bytes(buffer[posizione:posizione + lunghezza])
+        if len(data) != lunghezza:
+            raise ValueError("blocco troncato")
+        data = data.decode("utf-8")
+        posizione += lunghezza
+
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError("blocco non decodificabile: " + str(e))
+
+    return [id, prev_hash, type, timestamp, data, nonce, hash, merkle_root], posizione
+
+
+def codifica_messaggio(tipo, righe):
+    # Costruisce il messaggio binario (MESSAGGIO_BLOCCHI o MESSAGGIO_HEADER) con le righe date.
+    codifica = codifica_riga_header if tipo == MESSAGGIO_HEADER else codifica_riga
+    return b"".join( [bytes([tipo]), NUMERO_ELEMENTI.pack(len(righe))] + [ codifica(r) for r in righe ] )
+
+def decodifica_messaggio(messaggio):
+    # Restituisce (tipo, righe) del messaggio binario. Solleva ValueError se il messaggio non è valido.
+    if len(messaggio) < 1 + NUMERO_ELEMENTI.size or messaggio[0] not in (MESSAGGIO_BLOCCHI, MESSAGGIO_HEADER):
+        raise ValueError("messaggio binario non riconosciuto")
+
+    vista = memoryview(messaggio)
+    numero, = NUMERO_ELEMENTI.unpack_from(vista, 1)
+    posizione = 1 + NUMERO_ELEMENTI.size
+    righe = []
+    for _ in range(numero):
+        riga, posizione = decodifica_riga(vista, posizione)
+        righe.append(riga)
+
+    return messaggio[0], righe
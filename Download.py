@@ -0,0 +1,367 @@
+import heapq
+import threading
+from concurrent.futures import Future
+
+from Validatore import header_da_riga, controlla_header, controlla_collegamento
+
+
+class GestoreDownload:
+    """Download dei blocchi mancanti da più nodi contemporaneamente, a partire dagli header ("headers-first").
+       Prima viene scaricata dal nodo più avanti la catena degli header, verificata come in CatenaHeader (collegamento,
+       hash e proof-of-work): gli header sono piccoli e fissano l'hash atteso di ogni blocco. I blocchi già coperti
+       dagli header sono divisi in intervalli di "dimensione_intervallo" blocchi, richiesti in parallelo ai nodi
+       abbastanza avanti (al massimo "intervalli_per_nodo" a testa, ai nodi meno carichi per primi).
+       Un blocco ricevuto è accettato solo se ha l'hash del suo header: il nodo che invia header o blocchi diversi
+       viene escluso e i suoi intervalli riassegnati. Anche gli intervalli di un nodo che non invia nulla per
+       "timeout" secondi sono riassegnati, e il nodo viene sospeso: per altri "timeout" secondi non riceve nuovi
+       intervalli. Un nodo invia i suoi intervalli uno dopo l'altro, quindi un intervallo in attesa non è considerato
+       fermo finché il nodo invia lotti degli altri. I blocchi arrivano in ordine sparso e sono importati in ordine di
+       id, a lotti, con Blockchain.importa_blocchi; gli intervalli richiesti non superano di "finestra" blocchi
+       l'ultimo importato, così i blocchi in attesa in memoria restano limitati.
+       Il gestore usa l'orologio e i timer del nodo (Nodo.adesso e Nodo.pianifica), quindi funziona anche sulla
+       rete simulata. Si avvia con NodoBlockchain.scarica_blocchi."""
+
+    def __init__(self, nodo, dimensione_intervallo = 500, intervalli_per_nodo = 2, finestra = 50000, timeout = 5.0,
+                 intervallo_controllo = 1.0):
+        """nodo: Il NodoBlockchain (completo) che scarica i blocchi.
+           dimensione_intervallo: I blocchi richiesti a un nodo con un unico messaggio SYNC_RICHIESTA.
+           intervalli_per_nodo: Gli intervalli richiesti a ogni nodo e non ancora ricevuti.
+           finestra: La distanza massima, in blocchi, tra l'ultimo blocco importato e la fine di un intervallo
+                     richiesto.
+           timeout: I secondi senza blocchi (o header) dopo i quali un intervallo (o la richiesta di header) è
+                    riassegnato; per altrettanti secondi il nodo non riceve nuovi intervalli.
+           intervallo_controllo: Ogni quanti secondi si controllano i timeout."""
+        self.nodo = nodo
+        self.blockchain = nodo.blockchain
+        self.dimensione_intervallo = dimensione_intervallo
+        self.intervalli_per_nodo = intervalli_per_nodo
+        self.finestra = finestra
+        self.timeout = timeout
+        self.intervallo_controllo = intervallo_controllo
+
+        self.lock = threading.Lock()
+        self.lock_scrittura = threading.Lock()
+        self.futuro = Future() # Completato con le statistiche (vedi statistiche) al termine del download
+        self.terminato = False
+
+        self.nodi = {}        # id -> connessione dei nodi da cui scaricare
+        self.altezze = {}     # id -> altezza annunciata dal nodo (SYNC_PUNTA)
+        self.potati = {}      # id -> ultimo blocco senza contenuto del nodo (SYNC_PUNTA): ne invia solo gli header
+        self.esclusi = set()  # id dei nodi che hanno inviato header o blocchi non validi
+        self.sospesi = {}     # id -> istante fino al quale il nodo non riceve nuovi intervalli
+        self.attivita = {}    # id -> istante dell'ultimo lotto (di blocchi o di header) ricevuto dal nodo
+
+        # Catena degli header scaricati: l'hash (binario) di ogni blocco da base + 1 ad altezza_header
+        self.base, hash = self.blockchain.restituisci_punta()
+        self.obiettivo = self.base
+        self.hash_attesi = bytearray()
+        self.altezza_header = self.base
+        self.ultimo_header = {"id": self.base, "hash": hash} if self.base else None
+        self.richiesta_header = None # {"nodo", "a", "ultimo"} della richiesta di header in corso
+
+        # Intervalli di blocchi: da richiedere (heap di (da, a)) e richiesti, per id di inizio
+        self.prossimo_intervallo = self.base + 1
+        self.da_assegnare = []
+        self.assegnati = {}   # da -> {"da", "a", "ricevuto" (prossimo id atteso), "nodo", "ultimo" (istante dell'ultimo lotto)}
+
+        # Blocchi ricevuti e non ancora importati: id -> (riga, id del nodo)
+        self.pronti = {}
+        self.prossimo = self.base + 1
+        self.inizio = None
+
+        self.contatori = { nome: nodo.metriche.contatore("download_" + nome + "_totale", descrizione) for nome, descrizione in (
+            ("blocchi", "Blocchi importati dal download da più nodi"),
+            ("riassegnati", "Intervalli di blocchi riassegnati dopo un timeout o la disconnessione del nodo"),
+            ("esclusi", "Nodi esclusi dal download per header o blocchi non validi")) }
+
+    def avvia(self, nodi):
+        # Avvia il download dai nodi (connessioni) dati: chiede a ognuno la sua altezza (vedi NodoBlockchain.sincronizza).
+        with self.lock:
+            self.inizio = self.nodo.adesso()
+            for n in nodi:
+                self.nodi[n.id] = n
+        for n in nodi:
+            self.nodo.sincronizza(n)
+        self.nodo.pianifica(self.intervallo_controllo, self.controlla)
+        return self.futuro
+
+    def statistiche(self):
+        with self.lock:
+            return {"base": self.base, "altezza": self.prossimo - 1, "obiettivo": self.obiettivo,
+                    "altezza_header": self.altezza_header, "blocchi": self.prossimo - 1 - self.base,
+                    "intervalli": len(self.assegnati), "in_attesa": len(self.pronti), "nodi": sorted(self.nodi),
+                    "esclusi": sorted(self.esclusi), "completo": self.prossimo > self.obiettivo,
+                    "secondi": self.nodo.adesso() - self.inizio if self.inizio != None else 0.0}
+
+    def punta(self, node, altezza, potato_fino_a = 0):
+        """Il nodo "node" ha annunciato la sua altezza (maggiore della nostra): diventa una fonte di header e dei blocchi
+           successivi a "potato_fino_a". Se ha potato anche il prossimo blocco da importare i suoi blocchi non sono
+           raggiungibili e non entrano nell'obiettivo del download."""
+        with self.lock:
+            if self.terminato or node.id in self.esclusi:
+                return
+            self.nodi[node.id] = node
+            self.altezze[node.id] = altezza
+            self.potati[node.id] = potato_fino_a
+            self.obiettivo = self.calcola_obiettivo()
+            invii = self.richiedi_header() + self.assegna()
+        self.invia(invii)
+
+    def nodo_perso(self, node):
+        # Il nodo si è disconnesso: la richiesta di header e gli intervalli richiesti a lui passano agli altri nodi.
+        with self.lock:
+            if self.nodi.pop(node.id, None) == None:
+                return
+            self.altezze.pop(node.id, None)
+            self.potati.pop(node.id, None)
+            self.libera_nodo(node.id)
+            # Senza il nodo, i blocchi oltre l'altezza degli altri non si possono più scaricare
+            self.obiettivo = self.calcola_obiettivo()
+            self.crea_intervalli()
+            invii = self.richiedi_header() + self.assegna()
+        self.invia(invii)
+
+    def ricevi_header(self, node, righe):
+        # Verifica e aggiunge alla catena degli header un lotto ricevuto da "node" in risposta a SYNC_HEADER_RICHIESTA.
+        with self.lock:
+            if self.terminato or self.richiesta_header == None or self.richiesta_header["nodo"] != node.id:
+                return
+            difficolta = self.blockchain.validatore.difficolta
+            for riga in righe:
+                if riga[0] <= self.altezza_header: # Già ricevuto (es. da un nodo precedente)
+                    continue
+                try:
+                    header = header_da_riga(riga)
+                    errore = controlla_collegamento(header, self.ultimo_header) or controlla_header(header, difficolta)
+                except (ValueError, TypeError, AttributeError) as e:
+                    errore = "riga non decodificabile: " + str(e)
+                if errore != None:
+                    print("download: header %s di %s non valido: %s" % (riga[0] if riga else None, node.id, errore))
+                    self.escludi(node.id)
+                    break
+                self.hash_attesi += riga[6]
+                self.altezza_header = header["id"]
+                self.ultimo_header = {"id": header["id"], "hash": header["hash"]}
+
+            self.attivita[node.id] = self.nodo.adesso()
+            if self.richiesta_header != None and self.richiesta_header["nodo"] == node.id:
+                self.richiesta_header["ultimo"] = self.nodo.adesso()
+                if self.altezza_header >= self.richiesta_header["a"]:
+                    self.richiesta_header = None
+            self.crea_intervalli()
+            invii = self.richiedi_header() + self.assegna()
+        self.invia(invii)
+
+    def ricevi_blocchi(self, node, righe):
+        """Gestisce un lotto di blocchi ricevuto da "node". Restituisce False se il lotto non riguarda il download (es. un
+           blocco appena creato, annunciato con gossip), che va quindi importato normalmente."""
+        with self.lock:
+            if self.terminato or not righe or not self.base < righe[0][0] <= self.altezza_header:
+                return False
+            if node.id in self.esclusi: # Lotti già in viaggio quando il nodo è stato escluso
+                return True
+            self.attivita[node.id] = self.nodo.adesso()
+
+            for riga in righe:
+                id = riga[0]
+                if not self.base < id <= self.altezza_header or bytes(riga[6]) != self.hash_atteso(id):
+                    print("download: blocco %d di %s diverso dal suo header" % (id, node.id))
+                    self.escludi(node.id)
+                    break
+                if id >= self.prossimo and id not in self.pronti:
+                    self.pronti[id] = (riga, node.id)
+            else:
+                self.avanza_intervallo(node.id, righe[0][0], righe[-1][0])
+
+            invii = self.assegna()
+        self.invia(invii)
+        self.importa()
+        return True
+
+    def hash_atteso(self, id):
+        i = (id - self.base - 1) * 64
+        return bytes(self.hash_attesi[i:i + 64])
+
+    def avanza_intervallo(self, id_nodo, da, a):
+        # Registra l'arrivo dei blocchi da "da" ad "a" nell'intervallo richiesto a "id_nodo" che li contiene.
+        for intervallo in list(self.assegnati.values()):
+            if intervallo["nodo"] == id_nodo and intervallo["ricevuto"] <= da <= intervallo["a"]:
+                intervallo["ricevuto"] = a + 1
+                intervallo["ultimo"] = self.nodo.adesso()
+                if intervallo["ricevuto"] > intervallo["a"]:
+                    del self.assegnati[intervallo["da"]]
+                return
+
+    def crea_intervalli(self):
+        # Divide in intervalli i blocchi coperti dagli header; l'ultimo intervallo può essere più corto solo a header completi.
+        while self.prossimo_intervallo <= self.altezza_header:
+            a = self.prossimo_intervallo + self.dimensione_intervallo - 1
+            if a > self.altezza_header:
+                if self.altezza_header < self.obiettivo:
+                    return
+                a = self.altezza_header
+            heapq.heappush(self.da_assegnare, (self.prossimo_intervallo, a))
+            self.prossimo_intervallo = a + 1
+
+    def calcola_obiettivo(self):
+        # L'altezza più alta tra i nodi che hanno ancora il contenuto del prossimo blocco da importare.
+        return max([ h for id, h in self.altezze.items() if self.potati.get(id, 0) < self.prossimo ] + [self.prossimo - 1])
+
+    def fonti(self, altezza, da = None):
+        # I nodi utilizzabili che hanno almeno "altezza" blocchi (e il contenuto dei blocchi da "da"), i meno carichi per primi.
+        adesso = self.nodo.adesso()
+        carico = {}
+        if self.richiesta_header != None: # Il nodo che invia gli header ha già la banda occupata
+            carico[self.richiesta_header["nodo"]] = 1
+        for intervallo in self.assegnati.values():
+            carico[intervallo["nodo"]] = carico.get(intervallo["nodo"], 0) + 1
+        return sorted( (carico.get(id, 0), id) for id, h in self.altezze.items()
+                       if h >= altezza and (da == None or self.potati.get(id, 0) < da)
+                       and id not in self.esclusi and self.sospesi.get(id, adesso) <= adesso )
+
+    def richiedi_header(self):
+        # Se mancano header e nessuna richiesta è in corso, li richiede al nodo più avanti. Restituisce i messaggi da inviare.
+        if self.richiesta_header != None or self.altezza_header >= self.obiettivo:
+            return []
+        fonti = self.fonti(self.altezza_header + 1)
+        if not fonti:
+            return []
+        id = max(fonti, key=lambda f: (self.altezze[f[1]], -f[0]))[1]
+        a = self.altezze[id]
+        self.richiesta_header = {"nodo": id, "a": a, "ultimo": self.nodo.adesso()}
+        return [ (self.nodo.richiedi_header, self.nodi[id], self.altezza_header + 1, a) ]
+
+    def assegna(self):
+        # Richiede gli intervalli da assegnare ai nodi con posti liberi. Restituisce i messaggi da inviare.
+        invii = []
+        rimandati = []
+        while self.da_assegnare and self.da_assegnare[0][1] < self.prossimo + self.finestra:
+            da, a = heapq.heappop(self.da_assegnare)
+            fonti = [ f for f in self.fonti(a, da) if f[0] < self.intervalli_per_nodo ]
+            if not fonti:
+                rimandati.append( (da, a) )
+                if not self.fonti(a, da): # Nessun nodo ha questi blocchi: si prova con i successivi
+                    continue
+                break
+            id = fonti[0][1]
+            self.assegnati[da] = {"da": da, "a": a, "ricevuto": da, "nodo": id, "ultimo": self.nodo.adesso()}
+            invii.append( (self.nodo.richiedi_blocchi, self.nodi[id], da, a) )
+        for intervallo in rimandati:
+            heapq.heappush(self.da_assegnare, intervallo)
+        return invii
+
+    def libera_nodo(self, id_nodo):
+        # Rimette da assegnare la parte non ricevuta degli intervalli richiesti a "id_nodo" e la sua richiesta di header.
+        for intervallo in list(self.assegnati.values()):
+            if intervallo["nodo"] == id_nodo:
+                self.riassegna(intervallo)
+        if self.richiesta_header != None and self.richiesta_header["nodo"] == id_nodo:
+            self.richiesta_header = None
+
+    def riassegna(self, intervallo):
+        del self.assegnati[intervallo["da"]]
+        da = max(intervallo["ricevuto"], self.prossimo)
+        if da <= intervallo["a"]:
+            heapq.heappush(self.da_assegnare, (da, intervallo["a"]))
+            self.contatori["riassegnati"].incrementa()
+
+    def escludi(self, id_nodo):
+        # Esclude dal download il nodo che ha inviato dati non validi e scarta i blocchi ricevuti da lui.
+        if id_nodo in self.esclusi:
+            return
+        self.esclusi.add(id_nodo)
+        self.contatori["esclusi"].incrementa()
+        self.libera_nodo(id_nodo)
+        scartati = sorted( id for id, (_, fonte) in self.pronti.items() if fonte == id_nodo )
+        for id in scartati:
+            del self.pronti[id]
+        # I blocchi scartati tornano da assegnare, a intervalli di id consecutivi
+        inizio = None
+        for i, id in enumerate(scartati):
+            if inizio == None:
+                inizio = id
+            if i + 1 == len(scartati) or scartati[i + 1] != id + 1:
+                heapq.heappush(self.da_assegnare, (inizio, id))
+                inizio = None
+
+    def importa(self):
+        """Importa in ordine di id i blocchi pronti, a lotti di DIMENSIONE_LOTTO_SYNC. Un solo thread alla volta importa:
+           gli altri lasciano i blocchi in "pronti", dove li trova chi sta importando."""
+        while self.lock_scrittura.acquire(blocking=False):
+            try:
+                while True:
+                    with self.lock:
+                        righe = []
+                        while self.prossimo + len(righe) in self.pronti and len(righe) < self.nodo.DIMENSIONE_LOTTO_SYNC:
+                            righe.append(self.pronti[self.prossimo + len(righe)][0])
+                    if not righe:
+                        break
+
+                    esito = self.blockchain.importa_blocchi(righe)
+                    self.nodo.rimuovi_transazioni_confermate(esito["righe_inserite"])
+
+                    with self.lock:
+                        ultimo = righe[-1][0] if esito["rifiutato"] == None else esito["rifiutato"][0] - 1
+                        for id in range(self.prossimo, ultimo + 1):
+                            del self.pronti[id]
+                        self.prossimo = ultimo + 1
+                        self.contatori["blocchi"].incrementa(esito["inseriti"])
+                        if esito["rifiutato"] != None:
+                            # Il blocco ha l'hash dell'header ma non è valido (es. contenuto diverso dalla radice di Merkle)
+                            fonte = self.pronti[esito["rifiutato"][0]][1]
+                            print("download: blocco %d di %s non valido: %s" % (esito["rifiutato"][0], fonte, esito["rifiutato"][1]))
+                            self.escludi(fonte)
+                        invii = self.assegna()
+                    self.invia(invii)
+            finally:
+                self.lock_scrittura.release()
+
+            with self.lock: # Blocchi arrivati mentre si rilasciava il lock: vanno importati ora
+                if self.prossimo not in self.pronti:
+                    break
+        self.termina_se_completo()
+
+    def controlla(self):
+        # Eseguito ogni intervallo_controllo secondi: riassegna gli intervalli e la richiesta di header fermi da "timeout" secondi.
+        if self.terminato:
+            return
+        with self.lock:
+            adesso = self.nodo.adesso()
+            for intervallo in list(self.assegnati.values()):
+                ultimo = max(intervallo["ultimo"], self.attivita.get(intervallo["nodo"], intervallo["ultimo"]))
+                if adesso - ultimo > self.timeout:
+                    self.debug("intervallo %d-%d di %s fermo da %.1f s, riassegnato" % (intervallo["da"], intervallo["a"], intervallo["nodo"], adesso - ultimo))
+                    self.sospesi[intervallo["nodo"]] = adesso + self.timeout
+                    self.riassegna(intervallo)
+            if self.richiesta_header != None and adesso - self.richiesta_header["ultimo"] > self.timeout:
+                self.sospesi[self.richiesta_header["nodo"]] = adesso + self.timeout
+                self.richiesta_header = None
+            invii = self.richiedi_header() + self.assegna()
+        self.invia(invii)
+        self.termina_se_completo()
+        if not self.terminato:
+            self.nodo.pianifica(self.intervallo_controllo, self.controlla)
+
+    def termina_se_completo(self):
+        """Il download termina quando tutti i blocchi annunciati sono stati importati e, dall'avvio, è passato almeno un
+           intervallo di controllo (i nodi che non sono più avanti di noi non rispondono a SYNC_PUNTA), oppure quando
+           il nodo viene arrestato ("completo" è False nelle statistiche)."""
+        with self.lock:
+            if self.terminato:
+                return
+            if not self.nodo.terminate_flag.is_set() and \
+               (self.prossimo <= self.obiettivo or self.nodo.adesso() - self.inizio < self.intervallo_controllo):
+                return
+            self.terminato = True
+        statistiche = self.statistiche()
+        self.nodo.download_terminato(self)
+        self.futuro.set_result(statistiche)
+
+    def invia(self, invii):
+        # Invia le richieste (funzione, nodo, da, a) preparate sotto il lock: fuori dal lock, perché l'invio può attendere
+        # la coda del nodo.
+        for funzione, node, da, a in invii:
+            funzione(node, da, a)
+
+    def debug(self, messaggio):
+        self.nodo.debug_print("download: " + messaggio)
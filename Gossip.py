@@ -0,0 +1,40 @@
+import os
+import time
+import threading
+import collections
+
+
+class InsiemeVisti:
+    """Insieme limitato degli id dei messaggi già visti. Ogni id scade dopo "durata" secondi e, oltre "capacita"
+       elementi, vengono dimenticati gli id più vecchi. Inserimento e ricerca sono O(1)."""
+
+    def __init__(self, capacita = 100000, durata = 300.0):
+        self.capacita = capacita
+        self.durata = durata
+        self.visti = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def aggiungi(self, id):
+        # Registra l'id. Restituisce True se l'id non era già stato visto (o se era scaduto).
+        adesso = time.monotonic()
+        with self.lock:
+            # Gli id sono in ordine di inserimento: quelli scaduti o in eccesso sono all'inizio
+            while self.visti:
+                vecchio, istante = next(iter(self.visti.items()))
+                if len(self.visti) < self.capacita and adesso - istante < self.durata:
+                    break
+                del self.visti[vecchio]
+
+            if id in self.visti:
+                return False
+
+            self.visti[id] = adesso
+            return True
+
+    def __len__(self):
+        return len(self.visti)
+
+
+def nuovo_id_gossip():
+    # Genera un id casuale per un nuovo messaggio di gossip.
+    return os.urandom(16).hex()
@@ -0,0 +1,58 @@
+import json
+import threading
+import collections
+
+from Merkle import hash_transazione
+
+
+class Mempool:
+    """Insieme delle transazioni in attesa di essere inserite in un blocco, ricevute sia dal nodo locale sia dagli
+       altri nodi. Le transazioni sono identificate dal loro hash, quindi ogni transazione è presente una sola volta;
+       vengono estratte nell'ordine di arrivo e rimosse quando entrano in un blocco della catena."""
+
+    def __init__(self, capacita = 100000):
+        # capacita: Il numero massimo di transazioni in attesa; oltre questo limite le nuove transazioni sono rifiutate.
+        self.capacita = capacita
+        self.transazioni = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def aggiungi(self, transazione):
+        # Aggiunge la transazione. Restituisce il suo hash, oppure None se è già presente o se il mempool è pieno.
+        hash = hash_transazione(transazione)
+        with self.lock:
+            if hash in self.transazioni or len(self.transazioni) >= self.capacita:
+                return None
+            self.transazioni[hash] = transazione
+        return hash
+
+    def estrai(self, max_transazioni = None, max_byte = None):
+        """Restituisce, senza rimuoverle, le transazioni più vecchie come lista di coppie (hash, transazione): al massimo
+           max_transazioni e, se indicato, fino a max_byte di JSON (almeno una transazione)."""
+        selezionate = []
+        dimensione = 0
+        with self.lock:
+            for hash, transazione in self.transazioni.items():
+                if max_transazioni != None and len(selezionate) >= max_transazioni:
+                    break
+
+                if max_byte != None:
+                    dimensione += len(json.dumps(transazione, sort_keys=True))
+                    if selezionate and dimensione > max_byte:
+                        break
+
+                selezionate.append( (hash, transazione) )
+        return selezionate
+
+    def rimuovi(self, hash_transazioni):
+        # Rimuove le transazioni con gli hash dati (es. perché sono entrate in un blocco).
+        with self.lock:
+            for hash in hash_transazioni:
+                self.transazioni.pop(hash, None)
+
+    def __contains__(self, hash):
+        with self.lock:
+            return hash in self.transazioni
+
+    def __len__(self):
+        with self.lock:
+            return len(self.transazioni)
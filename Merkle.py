@@ -0,0 +1,95 @@
+import json
+import hashlib
+
+
+# Tipo dei blocchi che contengono una lista di transazioni (costruiti dal mempool). Negli altri blocchi il campo
+# "data" è un'unica transazione.
+TIPO_TRANSAZIONI = "transazioni"
+
+
+def hash_transazione(transazione):
+    # Hash SHA-512 (esadecimale) della serializzazione canonica di una transazione.
+    return hashlib.sha512( json.dumps(transazione, sort_keys=True).encode("utf-8") ).hexdigest()
+
+
+def combina(sinistra, destra):
+    # Hash di un nodo interno dell'albero di Merkle a partire dagli hash (esadecimali) dei due figli.
+    return hashlib.sha512( bytes.fromhex(sinistra) + bytes.fromhex(destra) ).hexdigest()
+
+
+def radice_merkle(hash_foglie):
+    """Calcola la radice dell'albero di Merkle degli hash dati. Se un livello ha un numero dispari di nodi l'ultimo
+       viene combinato con se stesso, quindi liste che ripetono gli ultimi hash (es. [a, b, c] e [a, b, c, c]) hanno
+       la stessa radice: le foglie di un blocco devono essere distinte (vedi radice_merkle_blocco). La radice di una
+       sola foglia è la foglia stessa."""
+    if not hash_foglie:
+        return hashlib.sha512(b"").hexdigest()
+
+    livello = list(hash_foglie)
+    while len(livello) > 1:
+        if len(livello) % 2 == 1:
+            livello.append(livello[-1])
+        livello = [ combina(livello[i], livello[i + 1]) for i in range(0, len(livello), 2) ]
+
+    return livello[0]
+
+
+def transazioni_blocco(type, data):
+    # Restituisce la lista delle transazioni contenute in un blocco con il tipo e il campo "data" dati.
+    return data if type == TIPO_TRANSAZIONI else [data]
+
+
+def radice_merkle_blocco(type, data):
+    """Radice di Merkle delle transazioni di un blocco: è il valore del campo "merkle_root" dell'header. Solleva
+       ValueError se il blocco contiene due volte la stessa transazione, perché altrimenti si potrebbero aggiungere
+       copie delle ultime transazioni senza cambiare la radice (vedi radice_merkle)."""
+    foglie = [ hash_transazione(t) for t in transazioni_blocco(type, data) ]
+    if len(set(foglie)) != len(foglie):
+        raise ValueError("transazioni duplicate nel blocco")
+    return radice_merkle(foglie)
+
+
+# Posizione del nodo fratello in un passo di una prova di inclusione.
+SINISTRA = "s"
+DESTRA = "d"
+
+
+def prova_merkle(hash_foglie, indice):
+    """Restituisce la prova di inclusione della foglia in posizione "indice": la lista, dal basso verso la radice, dei
+       nodi fratelli come coppie [hash, posizione] (SINISTRA o DESTRA rispetto al nodo da combinare). La prova contiene
+       log2(n) hash, quindi chi conosce solo la radice può verificare una transazione senza le altre del blocco."""
+    if not 0 <= indice < len(hash_foglie):
+        raise IndexError("indice %d fuori dalle %d foglie" % (indice, len(hash_foglie)))
+
+    prova = []
+    livello = list(hash_foglie)
+    while len(livello) > 1:
+        if len(livello) % 2 == 1:
+            livello.append(livello[-1])
+
+        if indice % 2 == 0:
+            prova.append( [livello[indice + 1], DESTRA] )
+        else:
+            prova.append( [livello[indice - 1], SINISTRA] )
+
+        livello = [ combina(livello[i], livello[i + 1]) for i in range(0, len(livello), 2) ]
+        indice //= 2
+
+    return prova
+
+
+def verifica_prova(hash_foglia, prova, radice):
+    # Ricalcola la radice a partire dalla foglia e dalla prova di prova_merkle e la confronta con quella attesa.
+    try:
+        corrente = hash_foglia
+        for hash, posizione in prova:
+            if posizione == SINISTRA:
+                corrente = combina(hash, corrente)
+            elif posizione == DESTRA:
+                corrente = combina(corrente, hash)
+            else:
+                return False
+    except (ValueError, TypeError):
+        return False
+
+    return corrente == radice
@@ -0,0 +1,289 @@
+import time
+import json
+import bisect
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+# Metriche dei nodi, delle connessioni e del database: contatori, misure istantanee e istogrammi di latenza, raccolti
+# in un RegistroMetriche ed esportati come istantanea (dizionario) o nel formato testuale di Prometheus, anche tramite
+# un server HTTP locale (vedi ServerMetriche). Aggiornare una metrica costa un lock e poche operazioni aritmetiche;
+# le metriche con etichette (es. per nodo connesso) vanno ottenute una volta dal registro e conservate.
+
+# Limiti superiori (in secondi) dei bucket predefiniti degli istogrammi di latenza: da 10 µs a 10 s.
+BUCKET_LATENZA = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                  0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Bucket per le dimensioni (es. operazioni in un commit, byte di un messaggio).
+BUCKET_DIMENSIONE = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 100000, 1000000)
+
+
+class Contatore:
+    # Valore che può solo crescere (messaggi, byte, errori...).
+    tipo = "counter"
+
+    def __init__(self):
+        self.valore = 0
+        self.lock = threading.Lock()
+
+    def incrementa(self, n = 1):
+        with self.lock:
+            self.valore += n
+
+    def leggi(self):
+        return self.valore
+
+
+class Misura:
+    """Valore istantaneo (connessioni aperte, messaggi in coda...). Si imposta con imposta() oppure, se è indicata una
+       funzione, viene calcolato a ogni lettura."""
+    tipo = "gauge"
+
+    def __init__(self, funzione = None):
+        self.valore = 0
+        self.funzione = funzione
+
+    def imposta(self, valore):
+        self.valore = valore
+
+    def leggi(self):
+        if self.funzione != None:
+            try:
+                return self.funzione()
+            except Exception:
+                return None
+        return self.valore
+
+
+class Istogramma:
+    """Distribuzione dei valori osservati (tipicamente durate in secondi) in bucket cumulativi con limiti fissi, più
+       somma, numero e massimo delle osservazioni."""
+    tipo = "histogram"
+
+    def __init__(self, bucket = BUCKET_LATENZA):
+        self.bucket = tuple(bucket)
+        self.conteggi = [0] * (len(self.bucket) + 1) # L'ultimo conta i valori oltre l'ultimo limite
+        self.somma = 0.0
+        self.numero = 0
+        self.massimo = 0.0
+        self.lock = threading.Lock()
+
+    def osserva(self, valore):
+        i = bisect.bisect_left(self.bucket, valore)
+        with self.lock:
+            self.conteggi[i] += 1
+            self.somma += valore
+            self.numero += 1
+            if valore > self.massimo:
+                self.massimo = valore
+
+    def osserva_valori(self, valori):
+        # Come osserva() per più valori, con una sola acquisizione del lock.
+        indici = [ bisect.bisect_left(self.bucket, v) for v in valori ]
+        with self.lock:
+            for i, valore in zip(indici, valori):
+                self.conteggi[i] += 1
+                self.somma += valore
+                if valore > self.massimo:
+                    self.massimo = valore
+            self.numero += len(indici)
+
+    def tempo(self):
+        # Context manager che osserva la durata del blocco "with".
+        return Cronometro(self)
+
+    def percentile(self, p):
+        # Stima del percentile p (0-100): il limite superiore del bucket che lo contiene (il massimo per l'ultimo).
+        with self.lock:
+            if self.numero == 0:
+                return None
+            soglia = self.numero * p / 100
+            cumulato = 0
+            for i, conteggio in enumerate(self.conteggi):
+                cumulato += conteggio
+                if cumulato >= soglia and conteggio:
+                    return min(self.bucket[i], self.massimo) if i < len(self.bucket) else self.massimo
+            return self.massimo
+
+    def leggi(self):
+        with self.lock:
+            cumulati = []
+            cumulato = 0
+            for conteggio in self.conteggi:
+                cumulato += conteggio
+                cumulati.append(cumulato)
+            return {"bucket": list(zip(self.bucket + ("+Inf",), cumulati)), "somma": self.somma, "numero": self.numero,
+                    "media": self.somma / self.numero if self.numero else 0.0, "massimo": self.massimo}
+
+
+class Cronometro:
+    # Misura la durata di un blocco "with" e la osserva nell'istogramma; notifica anche le tracce del registro.
+
+    def __init__(self, istogramma, registro = None, nome = None, etichette = None):
+        self.istogramma = istogramma
+        self.registro = registro
+        self.nome = nome
+        self.etichette = etichette
+
+    def __enter__(self):
+        self.inizio = time.perf_counter()
+        return self
+
+    def __exit__(self, *eccezione):
+        durata = time.perf_counter() - self.inizio
+        self.istogramma.osserva(durata)
+        if self.registro != None and self.registro.tracce:
+            self.registro.traccia(self.nome, self.etichette, self.inizio, durata)
+        return False
+
+
+class RegistroMetriche:
+    """Insieme delle metriche di un nodo. Ogni metrica ha un nome, una descrizione e, facoltativamente, delle etichette
+       (es. nodo="id"): contatore(), misura() e istogramma() restituiscono la metrica esistente con lo stesso nome ed
+       etichette o la creano. Le tracce sono funzioni traccia(nome, etichette, inizio, durata) invocate alla fine di
+       ogni intervallo misurato con tempo(): senza tracce registrate il costo è un solo controllo."""
+
+    def __init__(self, prefisso = ""):
+        self.prefisso = prefisso
+        self.metriche = {}     # nome -> {etichette (tupla ordinata) -> metrica}
+        self.descrizioni = {}
+        self.tipi = {}
+        self.tracce = []
+        self.lock = threading.Lock()
+
+    def _metrica(self, classe, nome, descrizione, etichette, *argomenti):
+        chiave = tuple(sorted( (k, str(v)) for k, v in etichette.items() ))
+        serie = self.metriche.get(nome)
+        if serie != None:
+            metrica = serie.get(chiave)
+            if metrica != None:
+                return metrica
+
+        with self.lock:
+            if self.tipi.setdefault(nome, classe.tipo) != classe.tipo:
+                raise ValueError("la metrica " + nome + " è già registrata con il tipo " + self.tipi[nome])
+            self.descrizioni.setdefault(nome, descrizione)
+            serie = self.metriche.setdefault(nome, {})
+            if chiave not in serie:
+                serie[chiave] = classe(*argomenti)
+            return serie[chiave]
+
+    def contatore(self, nome, descrizione = "", **etichette):
+        return self._metrica(Contatore, nome, descrizione, etichette)
+
+    def misura(self, nome, descrizione = "", funzione = None, **etichette):
+        return self._metrica(Misura, nome, descrizione, etichette, funzione)
+
+    def istogramma(self, nome, descrizione = "", bucket = BUCKET_LATENZA, **etichette):
+        return self._metrica(Istogramma, nome, descrizione, etichette, bucket)
+
+    def rimuovi(self, nome, **etichette):
+        # Rimuove la serie con le etichette date (es. le metriche di un nodo disconnesso).
+        chiave = tuple(sorted( (k, str(v)) for k, v in etichette.items() ))
+        with self.lock:
+            serie = self.metriche.get(nome)
+            if serie != None:
+                serie.pop(chiave, None)
+
+    def tempo(self, nome, descrizione = "", **etichette):
+        # Context manager che misura la durata del blocco "with" nell'istogramma "nome" e la passa alle tracce.
+        return Cronometro(self.istogramma(nome, descrizione, **etichette), self, nome, etichette)
+
+    def aggiungi_traccia(self, funzione):
+        self.tracce.append(funzione)
+
+    def rimuovi_traccia(self, funzione):
+        self.tracce.remove(funzione)
+
+    def traccia(self, nome, etichette, inizio, durata):
+        for funzione in list(self.tracce):
+            try:
+                funzione(nome, etichette, inizio, durata)
+            except Exception as e:
+                print("RegistroMetriche: errore nella traccia " + str(funzione) + ": " + str(e))
+
+    def _serie(self):
+        with self.lock:
+            return [ (nome, self.tipi[nome], self.descrizioni[nome], list(serie.items())) for nome, serie in sorted(self.metriche.items()) ]
+
+    def istantanea(self):
+        """Restituisce il valore di tutte le metriche: {nome: [{"etichette": {...}, "valore": ...}]}. Il valore degli
+           istogrammi è un dizionario con bucket cumulativi, somma, numero, media e massimo."""
+        return { nome: [ {"etichette": dict(chiave), "valore": metrica.leggi()} for chiave, metrica in serie ]
+                 for nome, _, _, serie in self._serie() }
+
+    def testo_prometheus(self):
+        # Restituisce tutte le metriche nel formato testuale di esposizione di Prometheus.
+        righe = []
+        for nome, tipo, descrizione, serie in self._serie():
+            nome = self.prefisso + nome
+            if descrizione:
+                righe.append("# HELP %s %s" % (nome, descrizione.replace("\\", "\\\\").replace("\n", "\\n")))
+            righe.append("# TYPE %s %s" % (nome, tipo))
+
+            for chiave, metrica in serie:
+                valore = metrica.leggi()
+                if tipo != "histogram":
+                    if valore != None:
+                        righe.append("%s%s %s" % (nome, _etichette(chiave), _numero(valore)))
+                    continue
+
+                for limite, cumulato in valore["bucket"]:
+                    righe.append("%s_bucket%s %d" % (nome, _etichette(chiave + (("le", _numero(limite)),)), cumulato))
+                righe.append("%s_sum%s %s" % (nome, _etichette(chiave), _numero(valore["somma"])))
+                righe.append("%s_count%s %d" % (nome, _etichette(chiave), valore["numero"]))
+
+        return "\n".join(righe) + "\n"
+
+
+def _numero(valore):
+    if isinstance(valore, str):
+        return valore
+    if isinstance(valore, bool):
+        return "1" if valore else "0"
+    return repr(valore) if isinstance(valore, float) else str(valore)
+
+def _etichette(chiave):
+    if not chiave:
+        return ""
+    return "{" + ",".join( '%s="%s"' % (k, v.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")) for k, v in chiave ) + "}"
+
+
+class ServerMetriche:
+    """Server HTTP che espone un RegistroMetriche: /metrics nel formato di Prometheus, /metriche.json come istantanea
+       JSON. È eseguito in un thread daemon e di default ascolta solo su 127.0.0.1."""
+
+    def __init__(self, registro, host = "127.0.0.1", porta = 9100):
+        self.registro = registro
+
+        class Gestore(BaseHTTPRequestHandler):
+            def do_GET(gestore):
+                percorso = gestore.path.split("?")[0]
+                if percorso in ("/", "/metrics"):
+                    corpo, tipo = self.registro.testo_prometheus().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+                elif percorso == "/metriche.json":
+                    corpo, tipo = json.dumps(self.registro.istantanea(), default=str).encode("utf-8"), "application/json"
+                else:
+                    gestore.send_error(404)
+                    return
+                gestore.send_response(200)
+                gestore.send_header("Content-Type", tipo)
+                gestore.send_header("Content-Length", str(len(corpo)))
+                gestore.end_headers()
+                gestore.wfile.write(corpo)
+
+            def log_message(gestore, *argomenti):
+                pass # Nessun log per ogni richiesta
+
+        self.server = ThreadingHTTPServer((host, porta), Gestore)
+        self.server.daemon_threads = True
+        self.porta = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metriche", daemon=True)
+
+    def avvia(self):
+        self.thread.start()
+        return self
+
+    def ferma(self):
+        self.server.shutdown()
+        self.server.server_close()
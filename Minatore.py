@@ -0,0 +1,139 @@
+import json
+import time
+import hashlib
+import threading
+import multiprocessing
+
+
+# Campi dell'header del blocco: la proof-of-work è calcolata solo su questi. Il contenuto ("data") entra nell'hash
+# tramite la radice di Merkle delle sue transazioni ("merkle_root"), quindi l'input dell'hash è piccolo e di
+# dimensione costante qualunque sia il numero di transazioni del blocco.
+CAMPI_HEADER = ("id", "prev_hash", "type", "timestamp", "merkle_root", "nonce")
+
+# Numero di nonce provati da ogni worker prima di controllare se un altro worker ha già trovato la soluzione.
+LOTTO = 4096
+
+
+def serializza_blocco(blocco):
+    # Restituisce la serializzazione canonica dell'header del blocco usata come input della proof-of-work.
+    campi = {k: blocco[k] for k in CAMPI_HEADER}
+    return json.dumps(campi, sort_keys=True).encode("utf-8")
+
+
+def calcola_hash(blocco):
+    # Calcola l'hash SHA-512 (esadecimale) del blocco.
+    return hashlib.sha512( serializza_blocco(blocco) ).hexdigest()
+
+
+def prefisso_suffisso(blocco):
+    """Divide la serializzazione canonica dell'header in due parti costanti, prima e dopo il valore del nonce.
+       Per ogni nonce l'input dell'hash è prefisso + str(nonce) + suffisso, identico a serializza_blocco(blocco),
+       così il JSON viene codificato una sola volta per blocco e non per ogni tentativo."""
+    campi = {k: blocco[k] for k in CAMPI_HEADER if k != "nonce"}
+    prima = {k: v for k, v in campi.items() if k < "nonce"}
+    dopo = {k: v for k, v in campi.items() if k > "nonce"}
+
+    prefisso = (json.dumps(prima, sort_keys=True)[:-1] + ", ") if prima else "{"
+    prefisso += '"nonce": '
+    suffisso = (", " + json.dumps(dopo, sort_keys=True)[1:]) if dopo else "}"
+
+    return prefisso.encode("utf-8"), suffisso.encode("utf-8")
+
+
+def soddisfa_difficolta(digest, difficolta):
+    # Verifica che il digest (bytes) inizi con almeno "difficolta" zeri esadecimali.
+    byte_pieni, mezzo = divmod(difficolta, 2)
+    if digest[:byte_pieni] != bytes(byte_pieni):
+        return False
+    return not mezzo or digest[byte_pieni] < 0x10
+
+
+def _cerca_nonce(prefisso, suffisso, difficolta, inizio, passo, trovato):
+    """Prova i nonce inizio, inizio + passo, inizio + 2*passo, ... finché non trova una soluzione o finché
+       l'evento "trovato" non viene impostato da un altro worker. Restituisce (nonce o None, tentativi)."""
+    base = hashlib.sha512(prefisso)
+    byte_pieni, mezzo = divmod(difficolta, 2)
+    zeri = bytes(byte_pieni)
+    nonce = inizio
+    tentativi = 0
+
+    while not trovato.is_set():
+        for _ in range(LOTTO):
+            h = base.copy()
+            h.update(str(nonce).encode("ascii") + suffisso)
+            digest = h.digest()
+
+            if digest[:byte_pieni] == zeri and (not mezzo or digest[byte_pieni] < 0x10):
+                trovato.set()
+                return nonce, tentativi + 1
+
+            nonce += passo
+            tentativi += 1
+
+    return None, tentativi
+
+
+def _worker(prefisso, suffisso, difficolta, inizio, passo, trovato, risultati):
+    # Punto di ingresso dei processi del pool: il risultato viene restituito tramite la coda "risultati".
+    risultati.put( _cerca_nonce(prefisso, suffisso, difficolta, inizio, passo, trovato) )
+
+
+class Minatore:
+    """La classe "Minatore" implementa la proof-of-work della blockchain. Lo spazio dei nonce viene diviso tra più
+       processi: il worker i prova i nonce i, i + W, i + 2W, ... e tutti i worker si fermano appena uno di loro trova
+       una soluzione. Dopo ogni estrazione le statistiche (hash provati, secondi, hash/secondo) sono in "statistiche"."""
+
+    def __init__(self, difficolta = 5, workers = None):
+        """difficolta: Il numero di zeri esadecimali iniziali richiesti all'hash del blocco.
+           workers: Il numero di processi da usare (default: 1, nessun processo aggiuntivo). Con più processi lo script
+                    che usa il Minatore deve essere importabile senza effetti (vedi "if __name__ == '__main__'"),
+                    perché i metodi di avvio spawn e forkserver lo importano di nuovo in ogni processo."""
+        self.difficolta = difficolta
+        self.workers = workers if workers != None else 1
+        self.statistiche = {}
+
+    def mina(self, blocco, difficolta = None, workers = None):
+        """Cerca il nonce che soddisfa la difficoltà e restituisce il blocco con i campi "nonce" e "hash" impostati.
+           difficolta e workers sovrascrivono, solo per questa chiamata, i valori del costruttore."""
+        difficolta = self.difficolta if difficolta == None else difficolta
+        workers = max(1, self.workers if workers == None else workers)
+
+        prefisso, suffisso = prefisso_suffisso(blocco)
+        inizio = time.perf_counter()
+
+        if workers == 1:
+            nonce, tentativi = _cerca_nonce(prefisso, suffisso, difficolta, 0, 1, threading.Event())
+
+        else:
+            trovato = multiprocessing.Event()
+            risultati = multiprocessing.Queue()
+            processi = [ multiprocessing.Process(target=_worker, args=(prefisso, suffisso, difficolta, i, workers, trovato, risultati), daemon=True)
+                         for i in range(workers) ]
+            for p in processi:
+                p.start()
+
+            nonce = None
+            tentativi = 0
+            for _ in processi:
+                n, t = risultati.get()
+                tentativi += t
+                # Se più worker trovano una soluzione nello stesso lotto si sceglie il nonce più piccolo
+                if n != None and (nonce == None or n < nonce):
+                    nonce = n
+
+            for p in processi:
+                p.join()
+
+        secondi = time.perf_counter() - inizio
+        self.statistiche = {
+            "hash": tentativi,
+            "secondi": secondi,
+            "hash_al_secondo": tentativi / secondi if secondi > 0 else 0.0,
+            "workers": workers,
+            "difficolta": difficolta
+        }
+
+        blocco["nonce"] = nonce
+        blocco["hash"] = calcola_hash(blocco)
+
+        return blocco
@@ -4,11 +4,28 @@ import threading
 import random
 import hashlib
 
-from Arco import Connessione
+from CodaInvio import CodaInvio, POLITICA_DISCONNETTI
+from Gossip import InsiemeVisti, nuovo_id_gossip
+from RegistroNodi import RegistroNodi
+from Riconnessione import PianificatoreRiconnessioni
+from Smistamento import Smistatore
+from Metriche import RegistroMetriche, ServerMetriche
+from Arco import Connessione, FRAMING_EOT, FRAMING_LP, DIMENSIONE_MAX_FRAME, handshake_offerta, handshake_leggi, handshake_risposta, \
+                 handshake_separa
+
+# Metriche di ogni nodo connesso (etichette "nodo" e "direzione"): nome e descrizione.
+METRICHE_CONNESSIONE = (
+    ("nodo_peer_messaggi_inviati_totale", "Messaggi accodati per l'invio al nodo connesso"),
+    ("nodo_peer_byte_inviati_totale", "Byte scritti sul socket del nodo connesso (framing compreso)"),
+    ("nodo_peer_messaggi_ricevuti_totale", "Messaggi ricevuti dal nodo connesso"),
+    ("nodo_peer_byte_ricevuti_totale", "Byte ricevuti dal nodo connesso (framing compreso)")
+)
+
 
 class Nodo(threading.Thread):
 
-    def __init__(self, host, porta, id = None):
+    def __init__(self, host, porta, id = None, max_entranti = 128, max_uscenti = 64):
+        # max_entranti, max_uscenti: Il numero massimo di nodi connessi in entrata e in uscita (None: nessun limite, vedi RegistroNodi).
 
         super(Nodo, self).__init__()
 
@@ -17,12 +34,22 @@ class Nodo(threading.Thread):
         self.host = host
         self.porta = porta
 
+        # Metriche del nodo e dei suoi componenti (vedi Metriche); avvia_server_metriche le espone via HTTP
+        self.metriche = RegistroMetriche()
+        self.server_metriche = None
+        self.messaggi_inviati = self.metriche.contatore("nodo_messaggi_inviati_totale", "Messaggi accodati per l'invio ai nodi connessi")
+        self.messaggi_ricevuti = self.metriche.contatore("nodo_messaggi_ricevuti_totale", "Messaggi ricevuti dai nodi connessi")
+        self.contatore_byte_inviati = self.metriche.contatore("nodo_byte_inviati_totale", "Byte scritti sui socket dei nodi connessi")
+        self.contatore_byte_ricevuti = self.metriche.contatore("nodo_byte_ricevuti_totale", "Byte ricevuti dai nodi connessi")
+
+        # Nodi connessi con me (in entrata) e a cui sono connesso (in uscita), indicizzati per id e indirizzo.
+        self.registro = RegistroNodi(max_entranti, max_uscenti)
 
-        self.nodes_inbound = []  # nodi connessi con me
-        self.nodes_outbound = []  # nodi a cui sono connesso
+        # Riconnessione ai nodi persi (connessi con reconnect=True), con attesa crescente tra i tentativi
+        self.riconnessioni = PianificatoreRiconnessioni(self)
 
-        # Lista di nodi a cui bisogna riconnettersi in caso di connessione persa
-        self.reconnect_to_nodes = []
+        # Secondi di attesa massima per l'apertura di una connessione in uscita
+        self.timeout_connessione = 5.0
 
         # Crea un ID per ogni nodo qualora non ne esista uno
         if id == None:
@@ -31,15 +58,45 @@ class Nodo(threading.Thread):
         else:
             self.id = str(id)
 
-        # Avvia il server TCP/IP
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Avvia il server TCP/IP (o il trasporto della sottoclasse, vedi NodoAsync e NodoSimulato)
+        self.sock = None
         self.init_server()
 
-        # Contatori di messaggi
-        self.message_count_inviati = 0
-        self.message_count_ricevuti = 0
-
         self.debug = False
+
+        # Framing proposto ai nodi durante lo scambio degli ID ("lp" se supportato anche dall'altro nodo,
+        # altrimenti "eot") e dimensione massima dei messaggi ricevuti.
+        self.framing = FRAMING_LP
+        self.max_frame = DIMENSIONE_MAX_FRAME
+
+        # Limiti e politica (POLITICA_SCARTA_VECCHI, POLITICA_BLOCCA o POLITICA_DISCONNETTI) della coda di invio
+        # di ogni nodo connesso. Di default un nodo che non legge viene disconnesso, così non rallenta gli invii agli
+        # altri nodi; POLITICA_BLOCCA ferma chi invia fino a timeout_coda secondi per ogni messaggio.
+        self.politica_coda = POLITICA_DISCONNETTI
+        self.max_coda_messaggi = 10000
+        self.max_coda_byte = 32 * 1024 * 1024
+        self.timeout_coda = 10.0
+
+        # Gossip: ogni messaggio inviato con gossip() ha un id; i messaggi già visti non vengono né consegnati né
+        # inoltrati di nuovo, gli altri sono inoltrati a gossip_fanout nodi scelti a caso (None: a tutti)
+        # per al massimo gossip_ttl passaggi.
+        self.gossip_fanout = 8
+        self.gossip_ttl = 16
+        self.gossip_visti = InsiemeVisti()
+        self.gossip_contatori = { nome: self.metriche.contatore("gossip_" + nome + "_totale", descrizione) for nome, descrizione in (
+            ("originati", "Messaggi di gossip originati dal nodo"),
+            ("ricevuti", "Buste di gossip ricevute"),
+            ("duplicati", "Buste di gossip scartate perché già viste"),
+            ("inoltrati", "Messaggi di gossip inoltrati ad altri nodi"),
+            ("inviati", "Buste di gossip inviate (originate o inoltrate)")) }
+
+        # I messaggi ricevuti sono consegnati a node_message da un pool di thread (vedi Smistatore), così la lettura
+        # dai socket non attende i gestori. Il numero di worker e la capacità delle code si impostano prima di start()
+        # con smistatore.workers e smistatore.capacita (workers = 0: node_message nel thread della connessione).
+        self.smistatore = Smistatore(self.node_message, metriche = self.metriche)
+
+        self.metriche.misura("nodo_connessioni", "Nodi connessi", lambda: len(self.registro.entranti()), direzione="entrante")
+        self.metriche.misura("nodo_connessioni", "Nodi connessi", lambda: len(self.registro.uscenti()), direzione="uscente")
         
         # METODI:
 
@@ -49,9 +106,114 @@ class Nodo(threading.Thread):
             print("DEBUG (" + self.id + "): " + message)
 
 
+    @property
+    def message_count_inviati(self):
+        # Messaggi accodati per l'invio ai nodi connessi (uno per ogni nodo destinatario).
+        return self.messaggi_inviati.leggi()
+
+    @property
+    def message_count_ricevuti(self):
+        return self.messaggi_ricevuti.leggi()
+
+    @property
+    def byte_inviati(self):
+        return self.contatore_byte_inviati.leggi()
+
+    @property
+    def byte_ricevuti(self):
+        return self.contatore_byte_ricevuti.leggi()
+
+    def crea_metriche_connessione(self, connessione, uscente):
+        # Crea i contatori del nodo connesso (METRICHE_CONNESSIONE) e li conserva nella connessione.
+        etichette = {"nodo": connessione.id, "direzione": "uscente" if uscente else "entrante"}
+        connessione.metriche = tuple( self.metriche.contatore(nome, descrizione, **etichette) for nome, descrizione in METRICHE_CONNESSIONE )
+
+    def rimuovi_metriche_connessione(self, connessione, uscente):
+        etichette = {"nodo": connessione.id, "direzione": "uscente" if uscente else "entrante"}
+        for nome, _ in METRICHE_CONNESSIONE:
+            self.metriche.rimuovi(nome, **etichette)
+
+    def conta_messaggio_inviato(self, connessione):
+        # Invocato dalla connessione per ogni messaggio accodato per l'invio.
+        self.messaggi_inviati.incrementa()
+        metriche = getattr(connessione, "metriche", None)
+        if metriche != None:
+            metriche[0].incrementa()
+
+    def conta_byte_inviati(self, connessione, n):
+        # Invocato dalla connessione dopo aver scritto "n" byte sul socket.
+        self.contatore_byte_inviati.incrementa(n)
+        metriche = getattr(connessione, "metriche", None)
+        if metriche != None:
+            metriche[1].incrementa(n)
+
+    def conta_messaggio_ricevuto(self, connessione, n):
+        # Invocato dalla connessione per ogni messaggio ricevuto, di "n" byte framing compreso.
+        self.messaggi_ricevuti.incrementa()
+        self.contatore_byte_ricevuti.incrementa(n)
+        metriche = getattr(connessione, "metriche", None)
+        if metriche != None:
+            metriche[2].incrementa()
+            metriche[3].incrementa(n)
+
+    def avvia_server_metriche(self, porta = 9100, host = "127.0.0.1"):
+        """Espone le metriche del nodo via HTTP su host:porta: /metrics nel formato di Prometheus, /metriche.json come
+           istantanea JSON (vedi ServerMetriche). Con porta=0 viene scelta una porta libera. Restituisce il server."""
+        self.server_metriche = ServerMetriche(self.metriche, host, porta).avvia()
+        return self.server_metriche
+
+    def ferma_server_metriche(self):
+        if self.server_metriche != None:
+            self.server_metriche.ferma()
+            self.server_metriche = None
+
+    def istantanea_metriche(self):
+        # Restituisce il valore di tutte le metriche del nodo (vedi RegistroMetriche.istantanea).
+        return self.metriche.istantanea()
+
+    @property
+    def nodes_inbound(self):
+        # I nodi connessi con me (tupla aggiornata dal registro a ogni connessione o disconnessione).
+        return self.registro.entranti()
+
+    @property
+    def nodes_outbound(self):
+        # I nodi a cui sono connesso.
+        return self.registro.uscenti()
+
     def all_nodes(self):
-        # Restituisce una lista con tutti i nodi connessi con l'attuale
-        return self.nodes_inbound + self.nodes_outbound
+        # Restituisce tutti i nodi connessi con l'attuale, senza copiare l'elenco del registro.
+        return self.registro.tutti()
+
+    def registra_nodo(self, connessione, uscente):
+        """Aggiunge la connessione al registro. Se il limite di connessioni è raggiunto e nessun nodo inattivo può
+           essere sostituito restituisce False; i nodi sostituiti vengono disconnessi."""
+        accettata, espulse = self.registro.aggiungi(connessione, uscente)
+        if accettata:
+            self.crea_metriche_connessione(connessione, uscente)
+        for n in espulse:
+            self.debug_print("registra_nodo: disconnesso il nodo inattivo " + n.id + " per fare posto a " + connessione.id)
+            n.stop()
+
+        if not accettata:
+            self.debug_print("registra_nodo: limite di connessioni raggiunto, rifiutato il nodo " + connessione.id)
+            connessione.chiudi()
+        return accettata
+
+    @property
+    def reconnect_to_nodes(self):
+        # Elenco dei nodi a cui bisogna riconnettersi in caso di connessione persa, con i tentativi falliti.
+        return self.riconnessioni.elenco()
+
+    def adesso(self):
+        # L'istante attuale in secondi (orologio monotono), per misurare attese e timeout.
+        return time.monotonic()
+
+    def pianifica(self, ritardo, funzione, *argomenti):
+        # Esegue funzione(*argomenti) tra "ritardo" secondi, in un thread separato.
+        timer = threading.Timer(ritardo, funzione, argomenti)
+        timer.daemon = True
+        timer.start()
 
     def generate_id(self):
         # Genera un ID univoco per ogni nodo
@@ -64,6 +226,7 @@ class Nodo(threading.Thread):
         """Inizializzazione del server TCP/IP per ricevere le connessioni.
         Si lega all'host e alla porta specificati"""
         print("Inizializzazione del nodo (" + self.id + ") sulla porta: " + str(self.porta) )
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.sock.bind((self.host, self.porta))
         self.sock.settimeout(10.0)
@@ -79,23 +242,67 @@ class Nodo(threading.Thread):
         """ Invia un messaggio a tutti i nodi connessi con l'attuale. 
         "data" è una variabile Python che è convertita in JSON che viene inviata a un altro nodo. 
         L'elenco di esclusione fornisce tutti i nodi a cui non deve essere inviato il messaggio."""
-        self.message_count_inviati = self.message_count_inviati + 1
-        for n in self.nodes_inbound:
+        for n in self.all_nodes():
             if n in exclude:
                 self.debug_print("send_to_nodes: Escluso nodo nell'invio del messaggio")
             else:
                 self.send_to_node(n, data)
 
-        for n in self.nodes_outbound:
-            if n in exclude:
-                self.debug_print("send_to_nodes: Escluso nodo nell'invio del messaggio")
-            else:
-                self.send_to_node(n, data)
+    def gossip(self, data):
+        """Diffonde "data" nella rete tramite gossip: il messaggio riceve un id, viene inviato a gossip_fanout nodi
+           scelti a caso e ogni nodo che lo riceve per la prima volta lo consegna con node_message e lo inoltra allo
+           stesso modo. Così il traffico per messaggio non cresce con il numero di nodi connessi. Restituisce l'id."""
+        id = nuovo_id_gossip()
+        self.gossip_visti.aggiungi(id)
+        self.conta_gossip("originati")
+        self.inoltra_gossip({"gossip": id, "ttl": self.gossip_ttl, "data": data}, None)
+        return id
+
+    def inoltra_gossip(self, busta, mittente):
+        # Invia la busta di gossip a gossip_fanout nodi scelti a caso, escluso il nodo da cui è arrivata.
+        candidati = [ n for n in self.all_nodes() if n is not mittente ]
+        if self.gossip_fanout != None and len(candidati) > self.gossip_fanout:
+            candidati = random.sample(candidati, self.gossip_fanout)
+
+        for n in candidati:
+            self.send_to_node(n, busta)
+        self.conta_gossip("inviati", len(candidati))
+
+    def conta_gossip(self, contatore, n = 1):
+        self.gossip_contatori[contatore].incrementa(n)
+
+    def statistiche_gossip(self):
+        # Restituisce i contatori del gossip (messaggi originati, ricevuti, duplicati scartati, inoltrati e invii totali).
+        statistiche = { nome: contatore.leggi() for nome, contatore in self.gossip_contatori.items() }
+        statistiche["visti"] = len(self.gossip_visti)
+        return statistiche
+
+    def messaggio_ricevuto(self, node, data):
+        """Invocato dalla connessione per ogni messaggio ricevuto. Le buste di gossip vengono filtrate (i duplicati
+           sono scartati) e inoltrate prima di consegnare il contenuto; gli altri messaggi vanno direttamente a node_message."""
+        self.registro.registra_attivita(node)
+
+        if isinstance(data, dict) and "gossip" in data and "data" in data:
+            self.conta_gossip("ricevuti")
+            if not self.gossip_visti.aggiungi(data["gossip"]):
+                self.conta_gossip("duplicati")
+                return
+
+            if data.get("ttl", 0) > 1:
+                self.conta_gossip("inoltrati")
+                self.inoltra_gossip({"gossip": data["gossip"], "ttl": data["ttl"] - 1, "data": data["data"]}, node)
+
+            data = data["data"]
+
+        self.smistatore.inserisci(node, data)
+
+    def statistiche_smistamento(self):
+        # Restituisce profondità delle code e latenza della gestione dei messaggi ricevuti (vedi Smistatore.statistiche).
+        return self.smistatore.statistiche()
 
     def send_to_node(self, n, data):
         # Invia il messaggio al nodo n, se esiste.
-        self.message_count_inviati = self.message_count_inviati + 1
-        if n in self.nodes_inbound or n in self.nodes_outbound:
+        if n in self.registro:
             n.send(data)
         else:
             self.debug_print("send_to_node: Impossibile inviare il messaggio, nodo non trovato!")
@@ -111,82 +318,95 @@ class Nodo(threading.Thread):
             return False
 
         # Verifica che il nodo non sia già connesso con noi
-        for node in self.nodes_outbound:
-            if node.host == host and node.porta == porta:
-                print("connect_with_node: Già connesso con questo nodo (" + node.id + ").")
-                return True
-
-        
+        node = self.registro.cerca_indirizzo(host, porta)
+        if node != None and self.registro.uscente(node):
+            print("connect_with_node: Già connesso con questo nodo (" + node.id + ").")
+            return True
 
         try:
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.debug_print("connessione a %s porta %s" % (host, porta))
+            sock.settimeout(self.timeout_connessione)
             sock.connect((host, porta))
 
-            # Scambio degli ID
-            sock.send(self.id.encode('utf-8')) # Invia l'ID al nodo connesso
-            connected_node_id = sock.recv(4096).decode('utf-8') # Riceve l'ID dal nodo connesso
+            # Scambio degli ID e scelta del framing
+            sock.send(handshake_offerta(self.id, self.framing).encode('utf-8')) # Invia l'ID al nodo connesso
+
+            # Riceve l'ID dal nodo connesso: i byte che seguono la risposta sono già messaggi della connessione
+            ricevuti, esito = b'', None
+            while esito == None:
+                chunk = sock.recv(4096)
+                if chunk == b'':
+                    raise ConnectionError("connessione chiusa durante lo scambio degli ID")
+                ricevuti += chunk
+                esito = handshake_separa(ricevuti)
+            risposta, avanzo = esito
+            connected_node_id, framing = handshake_leggi(risposta)
 
             # Verifica che il nodo non sia già connesso con noi
-            for node in self.nodes_inbound:
-                if node.host == host and node.id == connected_node_id:
-                    print("connect_with_node: Già connesso con questo nodo (" + node.id + ").")
-                    return True    
+            node = self.registro.cerca_id(connected_node_id)
+            if node != None and node.host == host and not self.registro.uscente(node):
+                print("connect_with_node: Già connesso con questo nodo (" + node.id + ").")
+                return True    
 
-            thread_client = self.create_new_connection(sock, connected_node_id, host, porta)
+            thread_client = self.create_new_connection(sock, connected_node_id, host, porta, framing[0])
+            thread_client.aggiungi_ricevuti(avanzo)
+            if not self.registra_nodo(thread_client, True):
+                return False
             thread_client.start()
 
-            self.nodes_outbound.append(thread_client)
-
-            # Se la riconnessione a questo host è richiesta, questo verrà aggiunto alla lista "reconnect_to_nodes"
+            # Se la riconnessione a questo host è richiesta, questo verrà aggiunto al pianificatore delle riconnessioni
             if reconnect:
                 self.debug_print("connect_with_node: Riconnessione abilitata per il nodo " + host + ":" + str(porta))
-                self.reconnect_to_nodes.append({
-                    "host": host, "porta": porta, "tries": 0
-                })
+                self.riconnessioni.registra(host, porta)
+            return True
 
         except Exception as e:
             self.debug_print("TcpServer.connect_with_node: Impossibile connettersi con il nodo. (" + str(e) + ")")
+            return False
 
 
     def disconnect_with_node(self, node):
         # Termina la connessione TCP/IP con il nodo specificato. Arresta il nodo e questo verrà eliminato dall'elenco nodes_outbound.
-        if node in self.nodes_outbound:
+        if self.registro.uscente(node):
             node.stop()
 
         else:
             self.debug_print("disconnect_with_node: Impossibile disconnettersi da questo nodo.")
 
+    def start(self):
+        # Avvia il thread del nodo, quello delle riconnessioni e i worker che gestiscono i messaggi.
+        self.smistatore.avvia()
+        self.riconnessioni.start()
+        super(Nodo, self).start()
+
     def stop(self):
             # Arresta questo nodo e termina tutti i nodi connessi.
             self.terminate_flag.set()
+            self.riconnessioni.ferma()
 
-    def create_new_connection(self, connection, id, host, porta):
+    def create_new_connection(self, connection, id, host, porta, framing = FRAMING_EOT):
         """Quando viene effettuata una nuova connessione con un nodo o un nodo si sta connettendo con noi, viene utilizzato questo metodo
             per creare la nuova connessione effettiva. In questo caso verrà istanziata una "Connessione" per rappresentare la connessione del nodo."""
-        return Connessione(self, connection, id, host, porta)
+        return Connessione(self, connection, id, host, porta, framing, self.max_frame, self.crea_coda_invio())
+
+    def crea_coda_invio(self):
+        # Crea la coda di invio di una nuova connessione con i limiti e la politica configurati nel nodo.
+        return CodaInvio(self.max_coda_messaggi, self.max_coda_byte, self.politica_coda, self.timeout_coda,
+                         self.metriche.istogramma("coda_invio_attesa_secondi", "Tempo dei messaggi nella coda di invio prima della scrittura sul socket"))
+
+    def stato_code(self):
+        # Restituisce, per ogni nodo connesso, lo stato della sua coda di invio (vedi CodaInvio.stato).
+        return { n.id: n.stato_coda() for n in self.all_nodes() }
 
     def reconnect_nodes(self):
         """Questo metodo controlla se i nodi con lo stato di riconnessione attiva sono ancora connessi. 
-            Se non sono collegati vengono riavviati."""
+            Per quelli non collegati viene pianificato un tentativo di riconnessione (vedi PianificatoreRiconnessioni).
+            Le connessioni perse vengono pianificate automaticamente da node_disconnected."""
         for node_to_check in self.reconnect_to_nodes:
-            found_node = False
-            self.debug_print("reconnect_nodes: Verifica nodo " + node_to_check["host"] + ":" + str(node_to_check["porta"]))
-
-            for node in self.nodes_outbound: # Controllo se il nodo è connesso
-                if node.host == node_to_check["host"] and node.porta == node_to_check["porta"]:
-                    found_node = True
-                    node_to_check["trials"] = 0 # Reset del conteggio
-                    self.debug_print("reconnect_nodes: Il nodo " + node_to_check["host"] + ":" + str(node_to_check["porta"]) + " è ancora connesso")
-
-            if not found_node: # Riconnessione con il nodo
-                node_to_check["trials"] += 1
-                if self.node_reconnection_error(node_to_check["host"], node_to_check["porta"], node_to_check["trials"]):
-                    self.connect_with_node(node_to_check["host"], node_to_check["porta"])
-
-                else:
-                    self.debug_print("reconnect_nodes: Rimuovo il nodo (" + node_to_check["host"] + ":" + str(node_to_check["porta"]) + ") dalla lista di riconnessione")
-                    self.reconnect_to_nodes.remove(node_to_check)
+            node = self.registro.cerca_indirizzo(node_to_check["host"], node_to_check["porta"])
+            if node == None or not self.registro.uscente(node):
+                self.riconnessioni.pianifica(node_to_check["host"], node_to_check["porta"])
 
     
     def run(self):
@@ -201,14 +421,14 @@ class Nodo(threading.Thread):
                 self.debug_print("Connessioni inbound totali: " + str(len(self.nodes_inbound)))
                 
                     
-                # Scambio degli ID
-                connected_node_id = connection.recv(4096).decode('utf-8') 
-                connection.send(self.id.encode('utf-8')) 
+                # Scambio degli ID e scelta del framing
+                connected_node_id, offerta = handshake_leggi(connection.recv(4096).decode('utf-8'))
+                risposta, framing = handshake_risposta(self.id, offerta, self.framing)
+                connection.send(risposta.encode('utf-8')) 
 
-                thread_client = self.create_new_connection(connection, connected_node_id, client_address[0], client_address[1])
-                thread_client.start()
-
-                self.nodes_inbound.append(thread_client)
+                thread_client = self.create_new_connection(connection, connected_node_id, client_address[0], client_address[1], framing)
+                if self.registra_nodo(thread_client, False):
+                    thread_client.start()
 
             
             except socket.timeout:
@@ -217,24 +437,20 @@ class Nodo(threading.Thread):
             except Exception as e:
                 raise e
 
-            self.reconnect_nodes()
-
             time.sleep(0.01)
 
         print("Terminazione nodo...")
-        for t in self.nodes_inbound:
-            t.stop()
-
-        for t in self.nodes_outbound:
+        connessioni = self.all_nodes()
+        for t in connessioni:
             t.stop()
 
         time.sleep(1)
 
-        for t in self.nodes_inbound:
+        for t in connessioni:
             t.join()
 
-        for t in self.nodes_outbound:
-            t.join()
+        self.smistatore.ferma()
+        self.ferma_server_metriche()
 
         self.sock.settimeout(None)   
         self.sock.close()
@@ -246,11 +462,13 @@ class Nodo(threading.Thread):
         Questa funzione assicura che venga utilizzato il metodo corretto."""
         self.debug_print("node_disconnected: " + node.id)
 
-        if node in self.nodes_inbound:
-            del self.nodes_inbound[self.nodes_inbound.index(node)]
+        uscente = self.registro.uscente(node)
+        if self.registro.rimuovi(node):
+            self.rimuovi_metriche_connessione(node, uscente)
 
-        if node in self.nodes_outbound:
-            del self.nodes_outbound[self.nodes_outbound.index(node)]
+        # Le connessioni in uscita perse vengono ripristinate dal pianificatore, se la riconnessione è abilitata
+        if uscente and not self.terminate_flag.is_set():
+            self.riconnessioni.pianifica(node.host, node.porta)
 
     def node_message(self, node, data):
         # Questo metodo viene invocato quando un nodo ci invia un messagio.
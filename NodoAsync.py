@@ -0,0 +1,400 @@
+import socket
+import asyncio
+import threading
+
+from Nodo import Nodo
+from CodaInvio import CodaInvio, DIMENSIONE_LOTTO
+from Arco import (FRAMING_EOT, FRAMING_LP, EOT_CHAR, HEADER_LP, DIMENSIONE_BUFFER, FrameNonValido,
+                  codifica_frame, decodifica_frame, decodifica_pacchetto,
+                  handshake_offerta, handshake_leggi, handshake_risposta, handshake_separa)
+
+
+class ConnessioneAsync:
+    """Versione asyncio della classe "Connessione": rappresenta la connessione con un altro nodo usando gli stream
+       di asyncio invece di un thread e di un socket bloccante. Espone la stessa interfaccia (id, host, porta, send,
+       stop, set_info, get_info), quindi i metodi di Nodo e delle sue sottoclassi la usano senza modifiche.
+       Tutta la lettura avviene nell'event loop del nodo principale."""
+
+    def __init__(self, main_node, reader, writer, id, host, porta, framing = FRAMING_EOT, max_frame = None, coda = None):
+        """main_node: Il NodoAsync che possiede la connessione.
+           reader, writer: Gli stream asyncio della connessione.
+           id: L'id del nodo connesso.
+           host, porta: L'indirizzo del nodo connesso.
+           framing: La modalità di framing concordata durante lo scambio degli ID.
+           max_frame: La dimensione massima in byte di un messaggio ricevuto.
+           coda: La CodaInvio dei messaggi in uscita."""
+        self.main_node = main_node
+        self.reader = reader
+        self.writer = writer
+        self.host = host
+        self.porta = porta
+        self.id = str(id)
+        self.framing = framing
+        self.max_frame = max_frame if max_frame != None else main_node.max_frame
+        self.EOT_CHAR = EOT_CHAR
+        self.terminate_flag = threading.Event()
+        self.info = {}
+        self.task = None
+
+        # Byte già letti dallo stream che precedono i successivi (vedi aggiungi_ricevuti)
+        self.ricevuti = bytearray()
+
+        # Coda di invio svuotata dal task scrittore; l'evento lo risveglia quando arrivano nuovi messaggi
+        self.coda = coda if coda != None else CodaInvio()
+        self.evento_coda = asyncio.Event()
+        self.task_scrittura = None
+
+        self.main_node.debug_print("ConnessioneAsync: Inizio con client (" + self.id + ") '" + self.host + ":" + str(self.porta) + "'")
+
+    def send(self, data, encoding_type='utf-8'):
+        """Invia i dati al nodo connesso. Può essere chiamato da qualsiasi thread: fuori dall'event loop la scrittura
+           viene passata al loop con call_soon_threadsafe."""
+        try:
+            frame = codifica_frame(data, self.framing, encoding_type)
+
+        except TypeError as type_error:
+            self.main_node.debug_print('Dict non valido')
+            self.main_node.debug_print(str(type_error))
+            return
+
+        if frame == None:
+            self.main_node.debug_print('datatype non valido, usare str, dict (sarà inviato come json) o bytes')
+            return
+
+        # Dall'event loop non si può attendere: con POLITICA_BLOCCA una coda piena disconnette subito il nodo
+        nel_loop = self.main_node.nel_loop()
+        if not self.coda.inserisci(frame, puo_bloccare=not nel_loop):
+            self.main_node.debug_print("ConnessioneAsync.send: Coda di invio piena o chiusa, disconnessione dal nodo " + self.id)
+            self.stop()
+            return
+
+        self.main_node.conta_messaggio_inviato(self)
+        if nel_loop:
+            self.evento_coda.set()
+        else:
+            self.main_node.loop.call_soon_threadsafe(self.evento_coda.set)
+
+    async def scrivi_coda(self):
+        """Task scrittore: estrae i messaggi dalla coda di invio e li scrive accorpati, attendendo drain() in modo che
+           un nodo lento faccia riempire la sua coda invece della memoria del transport."""
+        try:
+            while True:
+                lotto = self.coda.estrai_lotto_nowait(DIMENSIONE_LOTTO)
+                if not lotto:
+                    if self.coda.chiusa:
+                        return
+                    self.evento_coda.clear()
+                    await self.evento_coda.wait()
+                    continue
+
+                dati = lotto[0] if len(lotto) == 1 else b''.join(lotto)
+                self.writer.write(dati)
+                self.main_node.conta_byte_inviati(self, len(dati))
+                await self.writer.drain()
+
+        except Exception as e: # Quando l'invio non riesce chiude la connessione
+            self.main_node.debug_print("ConnessioneAsync.send: Errore nell'invio dei dati al nodo: " + str(e))
+            self.stop()
+
+    def stato_coda(self):
+        # Restituisce lo stato della coda di invio (messaggi e byte in attesa, messaggi scartati, limiti).
+        return self.coda.stato()
+
+    def stop(self):
+        # Termina la connessione: il task di lettura viene cancellato.
+        self.terminate_flag.set()
+        self.coda.chiudi()
+        if self.task != None:
+            if self.main_node.nel_loop():
+                self.task.cancel()
+            else:
+                self.main_node.loop.call_soon_threadsafe(self.task.cancel)
+
+    def chiudi(self):
+        # Chiude lo stream di una connessione mai avviata (es. rifiutata per il limite di connessioni).
+        self.coda.chiudi()
+        self.writer.close()
+
+    def aggiungi_ricevuti(self, dati):
+        # Byte letti dallo stream prima dell'avvio (es. insieme alla risposta dello scambio degli ID): ricevi li
+        # restituisce prima di leggere lo stream.
+        self.ricevuti += dati
+
+    async def leggi_esatti(self, n):
+        # Come reader.readexactly, ma restituisce prima i byte di self.ricevuti.
+        if not self.ricevuti:
+            return await self.reader.readexactly(n)
+        parte = bytes(self.ricevuti[:n])
+        del self.ricevuti[:n]
+        if len(parte) < n:
+            parte += await self.reader.readexactly(n - len(parte))
+        return parte
+
+    async def ricevi(self):
+        # Restituisce il prossimo messaggio ricevuto, già decodificato.
+        if self.framing == FRAMING_LP:
+            lunghezza, tipo = HEADER_LP.unpack( await self.leggi_esatti(HEADER_LP.size) )
+            if lunghezza > self.max_frame:
+                raise FrameNonValido("messaggio di %d byte, massimo %d" % (lunghezza, self.max_frame))
+            contenuto = await self.leggi_esatti(lunghezza)
+            self.main_node.conta_messaggio_ricevuto(self, HEADER_LP.size + lunghezza)
+            return decodifica_frame(tipo, contenuto)
+
+        packet = b''
+        while packet == b'': # I pacchetti vuoti vengono ignorati, come in Connessione
+            parti = []
+            dimensione = 0
+            if self.ricevuti: # Prima i byte già letti dallo stream
+                fine = self.ricevuti.find(self.EOT_CHAR)
+                if fine >= 0:
+                    packet = bytes(self.ricevuti[:fine])
+                    del self.ricevuti[:fine + 1]
+                    continue
+                parti.append(bytes(self.ricevuti))
+                dimensione = len(self.ricevuti)
+                self.ricevuti.clear()
+
+            while True:
+                try:
+                    parti.append( (await self.reader.readuntil(self.EOT_CHAR))[:-1] )
+                    break
+
+                except asyncio.LimitOverrunError as e:
+                    # Il messaggio supera il buffer dello stream: si legge a pezzi fino a max_frame
+                    parte = await self.reader.readexactly(e.consumed)
+                    dimensione += len(parte)
+                    if dimensione > self.max_frame:
+                        raise FrameNonValido("nessun EOT_CHAR nei primi %d byte" % self.max_frame)
+                    parti.append(parte)
+
+            packet = b''.join(parti)
+
+        self.main_node.conta_messaggio_ricevuto(self, len(packet) + 1)
+        return decodifica_pacchetto(packet)
+
+    async def esegui(self):
+        """Il ciclo principale della connessione: legge i messaggi e invoca node_message del nodo principale.
+           Quando la connessione termina viene invocato node_disconnected."""
+        try:
+            while not self.terminate_flag.is_set():
+                data = await self.ricevi()
+
+                # Con la coda dello smistatore piena si smette di leggere finché non si libera spazio
+                if not self.main_node.smistatore.ha_spazio(self):
+                    await self.main_node.attendi_smistamento(self)
+                self.main_node.messaggio_ricevuto(self, data)
+
+        except asyncio.CancelledError:
+            pass
+
+        except asyncio.IncompleteReadError:
+            self.main_node.debug_print("ConnessioneAsync: connessione chiusa dal nodo")
+
+        except Exception as e:
+            self.main_node.debug_print('Errore')
+            self.main_node.debug_print(str(e))
+
+        # Lo scrittore invia i messaggi rimasti in coda prima della chiusura
+        self.terminate_flag.set()
+        self.coda.chiudi()
+        self.evento_coda.set()
+        if self.task_scrittura != None:
+            try:
+                await asyncio.wait_for(self.task_scrittura, 10.0)
+            except Exception:
+                self.task_scrittura.cancel()
+
+        self.writer.close()
+        self.main_node.node_disconnected(self)
+        self.main_node.debug_print("ConnessioneAsync: Interrotta")
+
+    def set_info(self, key, value):
+        self.info[key] = value
+
+    def get_info(self, key):
+        return self.info[key]
+
+    def __str__(self):
+        return 'ConnessioneAsync: {}:{} <-> {}:{} ({})'.format(self.main_node.host, self.main_node.porta, self.host, self.porta, self.id)
+
+    def __repr__(self):
+        return '<ConnessioneAsync: Nodo {}:{} <-> Connessione {}:{}>'.format(self.main_node.host, self.main_node.porta, self.host, self.porta)
+
+
+class NodoAsync(Nodo):
+    """Versione asyncio della classe "Nodo". Invece di un thread per ogni connessione, tutte le connessioni in entrata
+       e in uscita sono gestite da un unico event loop (eseguito nel thread del nodo) con gli stream di asyncio.
+       I callback (node_message, node_disconnected, node_reconnection_error) e i metodi pubblici sono gli stessi di Nodo,
+       quindi una sottoclasse di Nodo può essere eseguita su questo runtime ereditando anche da NodoAsync
+       (vedi NodoBlockchainAsync). I callback vengono invocati nel thread dell'event loop."""
+
+    # Lunghezza della coda delle connessioni in attesa di essere accettate.
+    BACKLOG = 1024
+
+    # Tempo massimo per lo scambio degli ID con un nuovo nodo.
+    TIMEOUT_HANDSHAKE = 10.0
+
+    def __init__(self, host, porta, id = None, max_entranti = 10000, max_uscenti = 1000):
+        # Come Nodo, ma i limiti di default permettono migliaia di nodi connessi: ogni connessione costa solo un task.
+        self.loop = None
+        self.pronto = threading.Event() # Impostato quando l'event loop è in esecuzione
+
+        super(NodoAsync, self).__init__(host, porta, id, max_entranti, max_uscenti)
+
+    def init_server(self):
+        # Come Nodo.init_server, ma il socket è non bloccante e la coda delle connessioni è di BACKLOG elementi.
+        print("Inizializzazione del nodo asincrono (" + self.id + ") sulla porta: " + str(self.porta) )
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.porta))
+        self.sock.setblocking(False)
+        self.sock.listen(self.BACKLOG)
+
+    def nel_loop(self):
+        # True se il chiamante è in esecuzione nel thread dell'event loop.
+        return self.loop != None and threading.get_ident() == self.loop_thread
+
+    def stop(self):
+        # Arresta questo nodo e termina tutti i nodi connessi.
+        self.terminate_flag.set()
+        self.riconnessioni.ferma()
+        if self.loop != None:
+            self.loop.call_soon_threadsafe(self.fermato.set)
+
+    async def attendi_smistamento(self, connessione):
+        """Attende che la coda dello smistatore assegnata alla connessione abbia spazio: il worker della coda completa
+           il Future di Smistatore.attendi_spazio quando estrae un messaggio. Tutte le connessioni accodano dal thread
+           dell'event loop, quindi dopo l'attesa l'inserimento non blocca il loop. Se la connessione viene fermata
+           l'attesa termina con la cancellazione del suo task."""
+        with self.smistatore.lock:
+            self.smistatore.attese_coda_piena += 1
+        while not self.smistatore.ha_spazio(connessione) and not self.smistatore.fermato.is_set():
+            await asyncio.wrap_future(self.smistatore.attendi_spazio(connessione))
+
+    def create_new_connection(self, connection, id, host, porta, framing = FRAMING_EOT):
+        # "connection" è la coppia (reader, writer) degli stream asyncio.
+        reader, writer = connection
+        return ConnessioneAsync(self, reader, writer, id, host, porta, framing, self.max_frame, self.crea_coda_invio())
+
+    def avvia_connessione(self, connessione, uscente):
+        # Registra la connessione nel registro dei nodi e avvia i suoi task. Restituisce False se è stata rifiutata.
+        if not self.registra_nodo(connessione, uscente):
+            return False
+        connessione.task = self.loop.create_task( connessione.esegui() )
+        connessione.task_scrittura = self.loop.create_task( connessione.scrivi_coda() )
+        return True
+
+    def connect_with_node(self, host, porta, reconnect = True):
+        """Effettua una connessione con un altro nodo in esecuzione, come Nodo.connect_with_node. Se chiamato da un
+           altro thread attende l'esito; dall'event loop (es. dentro node_message) la connessione viene solo avviata."""
+        if host == self.host and porta == self.porta:
+            print("connect_with_node: impossibile connettersi con se stessi!")
+            return False
+
+        if not self.pronto.wait(self.TIMEOUT_HANDSHAKE):
+            self.debug_print("connect_with_node: il nodo non è in esecuzione")
+            return False
+
+        coroutine = self.connetti(host, porta, reconnect)
+        if self.nel_loop():
+            self.loop.create_task(coroutine)
+            return None
+
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def connetti(self, host, porta, reconnect = True):
+        # Apre la connessione con il nodo host:porta e scambia gli ID.
+        if self.terminate_flag.is_set(): # Le connessioni sono già state chiuse da principale
+            self.debug_print("connect_with_node: il nodo è in terminazione")
+            return False
+
+        node = self.registro.cerca_indirizzo(host, porta)
+        if node != None and self.registro.uscente(node):
+            print("connect_with_node: Già connesso con questo nodo (" + node.id + ").")
+            return True
+
+        try:
+            self.debug_print("connessione a %s porta %s" % (host, porta))
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, porta, limit=DIMENSIONE_BUFFER), self.TIMEOUT_HANDSHAKE)
+
+            # Scambio degli ID e scelta del framing
+            writer.write(handshake_offerta(self.id, self.framing).encode('utf-8'))
+
+            # I byte che seguono la risposta sono già messaggi della connessione
+            ricevuti, esito = b'', None
+            while esito == None:
+                chunk = await asyncio.wait_for(reader.read(4096), self.TIMEOUT_HANDSHAKE)
+                if chunk == b'':
+                    raise ConnectionError("connessione chiusa durante lo scambio degli ID")
+                ricevuti += chunk
+                esito = handshake_separa(ricevuti)
+            risposta, avanzo = esito
+            connected_node_id, framing = handshake_leggi(risposta)
+
+            node = self.registro.cerca_id(connected_node_id)
+            if node != None and node.host == host and not self.registro.uscente(node):
+                print("connect_with_node: Già connesso con questo nodo (" + node.id + ").")
+                writer.close()
+                return True
+
+            connessione = self.create_new_connection((reader, writer), connected_node_id, host, porta, framing[0])
+            connessione.aggiungi_ricevuti(avanzo)
+            if not self.avvia_connessione(connessione, True):
+                return False
+
+            if reconnect:
+                self.debug_print("connect_with_node: Riconnessione abilitata per il nodo " + host + ":" + str(porta))
+                self.riconnessioni.registra(host, porta)
+            return True
+
+        except Exception as e:
+            self.debug_print("NodoAsync.connetti: Impossibile connettersi con il nodo. (" + str(e) + ")")
+            return False
+
+    async def accetta(self, reader, writer):
+        # Gestisce una nuova connessione in entrata: scambio degli ID e avvio della lettura.
+        host, porta = writer.get_extra_info('peername')[:2]
+        try:
+            offerta = await asyncio.wait_for(reader.read(4096), self.TIMEOUT_HANDSHAKE)
+            connected_node_id, offerta = handshake_leggi(offerta.decode('utf-8'))
+            risposta, framing = handshake_risposta(self.id, offerta, self.framing)
+            writer.write(risposta.encode('utf-8'))
+
+        except Exception as e:
+            self.debug_print("NodoAsync.accetta: Scambio degli ID non riuscito (" + str(e) + ")")
+            writer.close()
+            return
+
+        self.avvia_connessione(self.create_new_connection((reader, writer), connected_node_id, host, porta, framing), False)
+        self.debug_print("Connessioni inbound totali: " + str(len(self.nodes_inbound)))
+
+    async def principale(self):
+        # Corpo dell'event loop: server in ascolto fino alla chiamata di stop().
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.fermato = asyncio.Event()
+
+        server = await asyncio.start_server(self.accetta, sock=self.sock, limit=DIMENSIONE_BUFFER)
+        self.pronto.set()
+
+        # Le riconnessioni sono gestite dal thread del pianificatore
+        if not self.terminate_flag.is_set():
+            await self.fermato.wait()
+
+        print("Terminazione nodo...")
+        server.close()
+        connessioni = self.all_nodes()
+        for t in connessioni:
+            t.stop()
+        await asyncio.gather(*[ t.task for t in connessioni if t.task != None ], return_exceptions=True)
+        await server.wait_closed()
+        # I worker possono attendere l'event loop (es. connect_with_node): si attende la loro fine fuori dal loop
+        await self.loop.run_in_executor(None, self.smistatore.ferma)
+        self.ferma_server_metriche()
+
+    def run(self):
+        """Il thread del nodo esegue l'event loop finché non viene chiamato stop()."""
+        asyncio.run(self.principale())
+        self.pronto.clear()
+        self.loop = None
+        print("Nodo terminato")
@@ -2,67 +2,429 @@ import time
 import json
 import hashlib
 import sqlite3
+import threading
 from base64 import b64decode, b64encode
+from concurrent.futures import Future
 
 from Nodo import Nodo
-from Blockchain import Blockchain
+from NodoAsync import NodoAsync
+from Simulazione import NodoSimulato
+from Arco import FRAMING_LP
+from Blockchain import Blockchain, PRECEDENTE_MANCANTE
+from Archivio import ARCHIVIO_SQLITE
+from CatenaHeader import CatenaHeader, HEADER_PRECEDENTE_MANCANTE
+from Validatore import riga_da_blocco, riga_header_da_riga
+from Codifica import riga_testo, riga_da_testo, riga_header_testo, riga_header_da_testo, codifica_messaggio, decodifica_messaggio, \
+                     MESSAGGIO_BLOCCHI, MESSAGGIO_HEADER
+from Merkle import hash_transazione
+from Mempool import Mempool
+from Download import GestoreDownload
+
+
+# Tipi dei messaggi del protocollo di sincronizzazione tra i nodi.
+SYNC_PUNTA = "sync_punta"         # {"tipo", "altezza", "hash", "leggero", "potato_fino_a"}: ultimo blocco del nodo che invia e
+                                  # ultimo blocco di cui ha tolto il contenuto (vedi Blockchain.pota)
+SYNC_RICHIESTA = "sync_richiesta" # {"tipo", "da", "a"}: richiesta dei blocchi con id tra "da" e "a"
+SYNC_BLOCCHI = "sync_blocchi"     # {"tipo", "blocchi"}: un lotto di righe della tabella blockchain
+TRANSAZIONE = "transazione"       # {"tipo", "transazione"}: nuova transazione per il mempool (diffusa con gossip)
+SYNC_HEADER_RICHIESTA = "sync_header_richiesta" # {"tipo", "da", "a"}: richiesta dei soli header (nodi leggeri)
+SYNC_HEADER = "sync_header"       # {"tipo", "header"}: un lotto di righe di header (vedi COLONNE_HEADER)
+PROVA_RICHIESTA = "prova_richiesta" # {"tipo", "blocco", "transazione"}: richiesta della prova di inclusione di una transazione
+PROVA = "prova"                   # {"tipo", "blocco", "transazione", "prova"}: la prova (None se il blocco non contiene la transazione)
+
+# Formato dei blocchi e degli header inviati durante la sincronizzazione. Il formato binario (vedi Codifica) richiede
+# il framing "lp"; con il framing "eot" o con FORMATO_JSON si inviano messaggi JSON con le righe in formato testuale.
+FORMATO_BINARIO = "binario"
+FORMATO_JSON = "json"
 
 
 class NodoBlockchain(Nodo):
-    """description of class"""
-    def __init__(self, host, porta, id = None):
+    """Nodo della rete che mantiene una copia della blockchain. I nodi si sincronizzano scambiandosi altezza e hash
+       dell'ultimo blocco: chi è indietro richiede solo i blocchi mancanti, che vengono inviati a lotti di
+       DIMENSIONE_LOTTO_SYNC righe letti dal database con un cursore. Un nodo molto indietro può invece scaricare i
+       blocchi da tutti i nodi connessi insieme con scarica_blocchi (vedi GestoreDownload).
+       Un nodo leggero (leggero=True) conserva solo gli header dei blocchi in una CatenaHeader: si sincronizza
+       richiedendo gli header e verifica le transazioni con le prove di inclusione fornite dai nodi completi."""
+
+    # Numero di blocchi inviati in un singolo messaggio di sincronizzazione.
+    DIMENSIONE_LOTTO_SYNC = 500
+
+    # Numero massimo di transazioni in un blocco costruito da mina_blocco.
+    TRANSAZIONI_PER_BLOCCO = 1000
 
-        super(NodoBlockchain, self).__init__(host, porta, id)
+    # Numero di header inviati in un singolo messaggio di sincronizzazione.
+    DIMENSIONE_LOTTO_HEADER = 2000
+
+    # Formato dei lotti di blocchi e di header inviati agli altri nodi (FORMATO_JSON per il debug).
+    FORMATO_BLOCCHI = FORMATO_BINARIO
+
+    def __init__(self, host, porta, id = None, leggero = False, percorso = None, difficolta = 5, snapshot = None, checkpoint = None,
+                 archivio = ARCHIVIO_SQLITE, potatura_blocchi = None, potatura_byte = None, max_entranti = 128, max_uscenti = 64):
+        """leggero: True per un nodo che conserva solo gli header.
+           percorso: L'archivio della blockchain o il database degli header (default: blockchain.db, blockchain.log o
+                     header.db nella directory corrente).
+           difficolta: La difficoltà della proof-of-work dei blocchi creati e di quelli ricevuti.
+           snapshot: Un file creato con Blockchain.crea_snapshot da caricare all'avvio (solo nodi completi): i nodi
+                     connessi invieranno poi solo i blocchi successivi.
+           checkpoint: (altezza, hash) di un blocco noto, fino al quale i blocchi dello snapshot non vengono verificati.
+           archivio: Dove il nodo completo salva i blocchi: ARCHIVIO_SQLITE o ARCHIVIO_LOG (vedi Archivio).
+           potatura_blocchi, potatura_byte: Limiti del contenuto dei blocchi conservato dal nodo completo (vedi
+                     Blockchain). Il nodo continua a inviare gli header di tutta la catena, ma non i blocchi potati:
+                     li annuncia in SYNC_PUNTA e i nodi che ne hanno bisogno li richiedono agli altri.
+           max_entranti, max_uscenti: Il numero massimo di nodi connessi in entrata e in uscita (vedi Nodo)."""
+
+        super(NodoBlockchain, self).__init__(host, porta, id, max_entranti = max_entranti, max_uscenti = max_uscenti)
+
+        # Un nodo leggero conserva solo gli header e non può inviare blocchi né prove agli altri nodi
+        self.leggero = leggero
+        if leggero:
+            self.blockchain = None
+            self.catena_header = CatenaHeader(difficolta, percorso or 'header.db', metriche = self.metriche)
+        else:
+            self.blockchain = Blockchain(difficolta, percorso = percorso, metriche = self.metriche, checkpoint = checkpoint,
+                                         archivio = archivio, potatura_blocchi = potatura_blocchi, potatura_byte = potatura_byte)
+            self.catena_header = None
+            if snapshot != None:
+                esito = self.blockchain.carica_snapshot(snapshot)
+                print("Snapshot %s: %d blocchi inseriti (%d verificati), altezza %d" % (snapshot, esito["inseriti"], esito["verificati"], esito["altezza"]))
 
-        self.blockchain = Blockchain()
+        # Transazioni in attesa di essere inserite in un blocco
+        self.mempool = Mempool()
+        self.metriche.misura("mempool_transazioni", "Transazioni nel mempool", lambda: len(self.mempool))
+
+        # Prove di inclusione richieste e non ancora ricevute: (id blocco, hash transazione) -> lista di Future
+        self.prove_in_attesa = {}
+        self.lock_prove = threading.Lock()
+
+        # Download in corso da più nodi (vedi scarica_blocchi), None se i blocchi si ricevono da un nodo alla volta
+        self.download = None
 
     def node_message(self, node, data): 
-    
-        c = self.blockchain.db.cursor()
-        elem = c.execute("SELECT * FROM blockchain").fetchall()
-        if (len(elem)!= 0):
-            for row in elem:
-                if (data[0] == row[0]):
-                    print("blocco già presente nel database")
-                    return None
-                else:
-                    c.execute("INSERT INTO blockchain (id, prev_hash, type, timestamp, data, nonce, hash) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                      ( data[0],
-                        data[1],
-                        data[2], 
-                        data[3],
-                        data[4],
-                        data[5],
-                        data[6] ))
+
+        if isinstance(data, dict) and "tipo" in data:
+            self.messaggio_sync(node, data)
+
+        elif isinstance(data, bytes): # Lotto di blocchi o di header in formato binario
+            self.messaggio_binario(node, data)
+
+        else: # Riga inviata singolarmente (nodi precedenti al protocollo di sincronizzazione)
+            righe = self.converti_righe(node, riga_da_testo, [data])
+            if righe != None:
+                self.ricevi_blocco(node, righe[0])
+
+    def messaggio_binario(self, node, data):
+        # Gestisce i lotti di blocchi e di header ricevuti in formato binario, come i messaggi SYNC_BLOCCHI e SYNC_HEADER.
+        try:
+            tipo, righe = decodifica_messaggio(data)
+        except ValueError as e:
+            self.debug_print("messaggio_binario: messaggio di " + node.id + " non valido: " + str(e))
+            return
+
+        download = self.download
+        if tipo == MESSAGGIO_BLOCCHI:
+            if download == None or not download.ricevi_blocchi(node, righe):
+                self.lotto_sincronizzazione(node, self.ricevi_blocchi(node, righe), righe)
+
+        elif self.leggero:
+            self.lotto_sincronizzazione(node, self.ricevi_header(node, righe), righe)
+
+        elif download != None:
+            download.ricevi_header(node, righe)
+
+    def converti_righe(self, node, conversione, righe):
+        # Converte le righe in formato testuale ricevute da "node"; restituisce None se una riga non è valida.
+        try:
+            return [ conversione(r) for r in righe ]
+        except (ValueError, TypeError, AttributeError, IndexError) as e:
+            print("node_message: riga ricevuta da " + node.id + " non valida: " + str(e))
+            return None
+
+    def formato_binario(self, node):
+        # Indica se i lotti di blocchi per "node" possono essere inviati in formato binario.
+        return self.FORMATO_BLOCCHI == FORMATO_BINARIO and getattr(node, "framing", None) == FRAMING_LP
+
+    def ricevi_blocco(self, node, data):
+        # Salva la riga "data" ricevuta da "node" se non è già presente e se è un blocco valido. Restituisce False se è stata rifiutata.
+        return self.ricevi_blocchi(node, [data])["rifiutato"] == None
+
+    def ricevi_blocchi(self, node, righe):
+        """Importa in un'unica transazione le righe ricevute da "node". I duplicati sono riconosciuti tramite gli indici
+           del database, quindi il costo di ogni blocco non dipende dalla lunghezza della catena.
+           Restituisce l'esito di Blockchain.importa_blocchi (di CatenaHeader.importa_header per i nodi leggeri)."""
+        if self.leggero: # Dei blocchi ricevuti si conservano solo gli header
+            return self.ricevi_header(node, [ riga_header_da_riga(r) for r in righe ])
+
+        esito = self.blockchain.importa_blocchi(righe)
+
+        if esito["duplicati"]:
+            print("blocco già presente nel database" if len(righe) == 1 else str(esito["duplicati"]) + " blocchi già presenti nel database")
+
+        if esito["rifiutato"] != None:
+            print("node_message: blocco " + str(esito["rifiutato"][0]) + " ricevuto da " + node.id + " non valido: " + esito["rifiutato"][1])
+
+        self.rimuovi_transazioni_confermate(esito["righe_inserite"])
+
+        return esito
+
+    def ricevi_header(self, node, righe):
+        # Importa gli header ricevuti da "node" nella catena degli header (nodi leggeri). Restituisce l'esito di CatenaHeader.importa_header.
+        esito = self.catena_header.importa_header(righe)
+
+        if esito["rifiutato"] != None:
+            print("node_message: header " + str(esito["rifiutato"][0]) + " ricevuto da " + node.id + " non valido: " + esito["rifiutato"][1])
+
+        return esito
+
+    def restituisci_punta(self):
+        # Restituisce (id, hash) dell'ultimo blocco della blockchain, o dell'ultimo header per i nodi leggeri.
+        if self.leggero:
+            return self.catena_header.restituisci_punta()
+        return self.blockchain.restituisci_punta()
+
+    def messaggio_sync(self, node, data):
+        # Gestisce i messaggi del protocollo di sincronizzazione.
+        if data["tipo"] == SYNC_PUNTA:
+            altezza, hash = self.restituisci_punta()
+
+            if data["altezza"] > altezza: # Il nodo ha blocchi che non abbiamo: richiediamo solo quelli mancanti
+                if data.get("leggero"): # Un nodo leggero non può inviare i blocchi
+                    return
+                potato_fino_a = data.get("potato_fino_a", 0)
+                download = self.download
+                if download != None: # I blocchi sono richiesti dal download, insieme a quelli degli altri nodi
+                    download.punta(node, data["altezza"], potato_fino_a)
+                    return
+                if potato_fino_a > altezza and not self.leggero: # Il nodo non ha più il contenuto dei blocchi che ci mancano
+                    self.debug_print("messaggio_sync: " + node.id + " ha potato i blocchi fino a " + str(potato_fino_a))
+                    return
+                node.set_info("sync_fino_a", data["altezza"])
+                richiesta = SYNC_HEADER_RICHIESTA if self.leggero else SYNC_RICHIESTA
+                self.send_to_node(node, {"tipo": richiesta, "da": altezza + 1, "a": data["altezza"]})
+
+            elif data["altezza"] < altezza: # Il nodo è indietro: gli comunichiamo la nostra altezza
+                self.sincronizza(node)
+
+            elif data["hash"] != hash:
+                print("messaggio_sync: la catena di " + node.id + " diverge dalla nostra all'altezza " + str(altezza))
+
+        elif data["tipo"] == TRANSAZIONE:
+            if not self.leggero: # I nodi leggeri non costruiscono blocchi: le transazioni sono solo inoltrate
+                self.mempool.aggiungi(data["transazione"])
+
+        elif data["tipo"] in (SYNC_RICHIESTA, SYNC_HEADER_RICHIESTA, PROVA_RICHIESTA) and self.leggero:
+            self.debug_print("messaggio_sync: " + data["tipo"] + " da " + node.id + " ignorato, il nodo è leggero")
+
+        elif data["tipo"] == SYNC_RICHIESTA:
+            self.invia_blocchi(node, data["da"], data["a"])
+
+        elif data["tipo"] == SYNC_HEADER_RICHIESTA:
+            self.invia_header(node, data["da"], data["a"])
+
+        elif data["tipo"] == SYNC_BLOCCHI:
+            righe = self.converti_righe(node, riga_da_testo, data["blocchi"])
+            download = self.download
+            if righe != None and (download == None or not download.ricevi_blocchi(node, righe)):
+                self.lotto_sincronizzazione(node, self.ricevi_blocchi(node, righe), righe)
+
+        elif data["tipo"] == SYNC_HEADER:
+            download = self.download
+            if self.leggero or download != None:
+                righe = self.converti_righe(node, riga_header_da_testo, data["header"])
+                if righe != None and self.leggero:
+                    self.lotto_sincronizzazione(node, self.ricevi_header(node, righe), righe)
+                elif righe != None:
+                    download.ricevi_header(node, righe)
+
+        elif data["tipo"] == PROVA_RICHIESTA:
+            prova = self.blockchain.prova_inclusione(data["blocco"], data["transazione"])
+            self.send_to_node(node, {"tipo": PROVA, "blocco": data["blocco"], "transazione": data["transazione"], "prova": prova})
+
+        elif data["tipo"] == PROVA:
+            self.ricevi_prova(data)
+
         else:
-            c.execute("INSERT INTO blockchain (id, prev_hash, type, timestamp, data, nonce, hash) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                      ( data[0],
-                        data[1],
-                        data[2], 
-                        data[3],
-                        data[4],
-                        data[5],
-                        data[6] ))
-        self.blockchain.db.commit()
-    
+            self.debug_print("messaggio_sync: tipo di messaggio sconosciuto " + str(data["tipo"]))
+
+    def lotto_sincronizzazione(self, node, esito, righe):
+        # Dopo l'importazione di un lotto di blocchi (o di header) ricevuto da "node" decide se confrontare di nuovo le altezze.
+        rifiutato = esito["rifiutato"]
+        if rifiutato != None:
+            # Manca il blocco precedente (es. blocco annunciato mentre eravamo indietro): confrontiamo le altezze
+            if rifiutato[1] in (PRECEDENTE_MANCANTE, HEADER_PRECEDENTE_MANCANTE):
+                self.sincronizza(node)
+            return
+
+        # Completato l'intervallo richiesto si confrontano di nuovo le altezze: il nodo può avere nuovi blocchi
+        if righe and righe[-1][0] >= node.info.get("sync_fino_a", 0):
+            self.sincronizza(node)
+
+    def invia_header(self, node, da, a = None):
+        # Invia a "node" (un nodo leggero) gli header dei blocchi con id tra "da" e "a" a lotti.
+        for righe in self.blockchain.leggi_header(da, a, self.DIMENSIONE_LOTTO_HEADER):
+            if self.formato_binario(node):
+                self.send_to_node(node, codifica_messaggio(MESSAGGIO_HEADER, righe))
+            else:
+                self.send_to_node(node, {"tipo": SYNC_HEADER, "header": [ riga_header_testo(r) for r in righe ]})
+
+    def invia_blocchi(self, node, da, a = None):
+        """Invia a "node" i blocchi con id tra "da" e "a" a lotti, leggendoli dal database con un cursore. I blocchi
+           potati non vengono inviati: "node" li conosce da SYNC_PUNTA (anche quelli potati durante la lettura)."""
+        da = max(da, self.blockchain.potato_fino_a + 1)
+        for righe in self.blockchain.leggi_blocchi(da, a, self.DIMENSIONE_LOTTO_SYNC):
+            righe = [ r for r in righe if r[4] != None ]
+            if not righe:
+                continue
+            if self.formato_binario(node):
+                self.send_to_node(node, codifica_messaggio(MESSAGGIO_BLOCCHI, righe))
+            else:
+                self.send_to_node(node, {"tipo": SYNC_BLOCCHI, "blocchi": [ riga_testo(r) for r in righe ]})
+
+    def richiedi_blocchi(self, node, da, a):
+        # Richiede a "node" i blocchi con id tra "da" e "a".
+        self.send_to_node(node, {"tipo": SYNC_RICHIESTA, "da": da, "a": a})
+
+    def richiedi_header(self, node, da, a):
+        # Richiede a "node" gli header dei blocchi con id tra "da" e "a".
+        self.send_to_node(node, {"tipo": SYNC_HEADER_RICHIESTA, "da": da, "a": a})
+
+    def scarica_blocchi(self, ids = None, **opzioni):
+        """Scarica i blocchi mancanti da tutti i nodi connessi (o dai nodi "ids") insieme: prima gli header, poi i blocchi
+           a intervalli richiesti in parallelo ai nodi, riassegnando gli intervalli dei nodi lenti o disconnessi (vedi
+           GestoreDownload, di cui "opzioni" sono gli argomenti). A differenza di condividi_db la velocità non è
+           limitata da quella di un solo nodo. Restituisce un Future con le statistiche del download (vedi
+           GestoreDownload.statistiche), completato quando tutti i blocchi annunciati dai nodi sono stati importati;
+           al termine i nodi si sincronizzano di nuovo come con condividi_db, per i blocchi creati nel frattempo."""
+        if self.leggero or self.download != None:
+            futuro = Future()
+            futuro.set_exception(RuntimeError("download non disponibile per un nodo leggero o già in corso"))
+            return futuro
+
+        nodi = self.all_nodes() if ids == None else [ n for n in map(self.trova_nodo, ids) if n != None ]
+        self.download = GestoreDownload(self, **opzioni)
+        return self.download.avvia(nodi)
+
+    def download_terminato(self, download):
+        # Chiamato dal GestoreDownload al termine: i lotti successivi si ricevono di nuovo da un nodo alla volta.
+        if self.download is download:
+            self.download = None
+        if not self.terminate_flag.is_set():
+            for n in self.all_nodes():
+                self.sincronizza(n)
+
+    def node_disconnected(self, node):
+        super(NodoBlockchain, self).node_disconnected(node)
+        download = self.download
+        if download != None:
+            download.nodo_perso(node)
+
+    def sincronizza(self, node):
+        # Avvia la sincronizzazione con "node" inviando altezza e hash del nostro ultimo blocco.
+        altezza, hash = self.restituisci_punta()
+        potato_fino_a = 0 if self.leggero else self.blockchain.potato_fino_a
+        self.send_to_node(node, {"tipo": SYNC_PUNTA, "altezza": altezza, "hash": hash, "leggero": self.leggero, "potato_fino_a": potato_fino_a})
+
+    def richiedi_prova(self, id, id_blocco, transazione):
+        """Richiede al nodo completo "id" la prova che la transazione è contenuta nel blocco "id_blocco" e restituisce un
+           Future con l'esito della verifica (True o False), fatta sulla radice di Merkle dell'header locale. Il blocco
+           deve essere già nella catena degli header; la risposta contiene solo log2(n) hash."""
+        futuro = Future()
+        n = self.trova_nodo(id)
+        if n == None or not self.leggero:
+            self.debug_print("richiedi_prova: nodo " + str(id) + " non connesso o nodo non leggero")
+            futuro.set_result(False)
+            return futuro
+
+        hash = hash_transazione(transazione)
+        with self.lock_prove:
+            self.prove_in_attesa.setdefault( (id_blocco, hash), [] ).append(futuro)
+
+        self.send_to_node(n, {"tipo": PROVA_RICHIESTA, "blocco": id_blocco, "transazione": hash})
+        return futuro
+
+    def ricevi_prova(self, data):
+        # Verifica la prova ricevuta e completa le richieste in attesa per la stessa transazione.
+        with self.lock_prove:
+            futuri = self.prove_in_attesa.pop( (data["blocco"], data["transazione"]), [] )
+
+        if not futuri:
+            return
+
+        valida = data["prova"] != None and self.catena_header.verifica_inclusione(data["prova"]) \
+                 and data["prova"]["blocco"] == data["blocco"] and data["prova"]["transazione"] == data["transazione"]
+        for futuro in futuri:
+            futuro.set_result(valida)
+
+    def nuova_transazione(self, transazione):
+        """Aggiunge una transazione locale al mempool e la diffonde agli altri nodi tramite gossip.
+           Restituisce l'hash della transazione, oppure None se era già presente o se il mempool è pieno."""
+        if self.leggero: # Il nodo leggero non ha un mempool da cui costruire blocchi: la transazione è solo diffusa
+            self.gossip({"tipo": TRANSAZIONE, "transazione": transazione})
+            return hash_transazione(transazione)
+
+        hash = self.mempool.aggiungi(transazione)
+        if hash != None:
+            self.gossip({"tipo": TRANSAZIONE, "transazione": transazione})
+        return hash
+
+    def mina_blocco(self, max_transazioni = None, max_byte = None, difficolta = None, workers = None):
+        """Costruisce un blocco con le transazioni più vecchie del mempool (al massimo max_transazioni, default
+           TRANSAZIONI_PER_BLOCCO, e max_byte di JSON), esegue la proof-of-work, lo aggiunge alla blockchain e lo
+           annuncia agli altri nodi. Restituisce il blocco, oppure None se il mempool è vuoto o il blocco è stato rifiutato.
+           difficolta e workers sono passati a Blockchain.crea_blocco (ValueError se la difficoltà è troppo bassa)."""
+        if self.leggero:
+            return None
+
+        selezionate = self.mempool.estrai(max_transazioni or self.TRANSAZIONI_PER_BLOCCO, max_byte)
+        if not selezionate:
+            return None
+
+        blocco = self.blockchain.crea_blocco_transazioni([ t for _, t in selezionate ], difficolta, workers)
+        if not self.blockchain.aggiungi_blocco(blocco):
+            return None
+
+        self.mempool.rimuovi([ h for h, _ in selezionate ])
+        self.annuncia_blocco(blocco)
+        return blocco
+
+    def rimuovi_transazioni_confermate(self, righe):
+        # Rimuove dal mempool le transazioni contenute nei blocchi (righe) appena inseriti nella blockchain.
+        for riga in righe:
+            self.mempool.rimuovi( self.blockchain.hash_transazioni_blocco(self.blockchain.restituisci_record_blockchain(riga)) )
+
+    def annuncia_blocco(self, blocco):
+        # Diffonde nella rete, tramite gossip, un blocco appena aggiunto alla nostra blockchain. La busta di gossip è JSON,
+        # quindi il blocco viaggia in formato testuale.
+        return self.gossip({"tipo": SYNC_BLOCCHI, "blocchi": [ riga_testo(riga_da_blocco(blocco)) ]})
+
+    def trova_nodo(self, id):
+        # Restituisce la connessione con il nodo "id", oppure None se non siamo connessi con quel nodo.
+        return self.registro.cerca_id(id)
+
     def condividi_db(self, id):
+        """Sincronizza la blockchain con il nodo "id". Invece di inviare l'intera tabella, i due nodi confrontano
+           l'ultimo blocco e viene trasferito solo l'intervallo di blocchi mancante a chi è indietro."""
+        n = self.trova_nodo(id)
+        if n != None:
+            self.sincronizza(n)
+        else:
+            self.debug_print("condividi_db: nodo " + str(id) + " non connesso")
 
-        c = self.blockchain.db.cursor()
-        data = c.execute("SELECT * FROM blockchain").fetchall()
-        for n in self.nodes_inbound:
-            if n.id == id:
-                for row in data:
-                    self.send_to_node(n, json.dumps(row))
-        for n in self.nodes_outbound:
-            if n.id == id:
-                for row in data:
-                    self.send_to_node(n, json.dumps(row))
 
-                   
-        
-       
+class NodoBlockchainAsync(NodoBlockchain, NodoAsync):
+    """NodoBlockchain eseguito sul runtime asyncio di NodoAsync: la logica della blockchain è quella di NodoBlockchain,
+       le connessioni sono gestite da un unico event loop invece che da un thread per ogni nodo connesso."""
 
+    def __init__(self, host, porta, id = None, max_entranti = 10000, max_uscenti = 1000, **opzioni):
+        # Limiti di nodi connessi di NodoAsync; opzioni: gli altri argomenti di NodoBlockchain.
+        super(NodoBlockchainAsync, self).__init__(host, porta, id, max_entranti = max_entranti, max_uscenti = max_uscenti, **opzioni)
 
-    
 
+class NodoBlockchainSimulato(NodoBlockchain, NodoSimulato):
+    """NodoBlockchain eseguito su una ReteSimulata (vedi Simulazione): la logica della blockchain è quella di
+       NodoBlockchain, i messaggi viaggiano nella rete simulata. Ogni nodo ha comunque il proprio database, quindi
+       "percorso" deve essere diverso per ogni nodo."""
 
+    def __init__(self, host, porta, id = None, rete = None, **opzioni):
+        # opzioni: gli argomenti di NodoBlockchain (leggero, percorso, difficolta, max_entranti, max_uscenti...).
+        self.rete = rete
+        super(NodoBlockchainSimulato, self).__init__(host, porta, id, **opzioni)
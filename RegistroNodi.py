@@ -0,0 +1,108 @@
+import time
+import threading
+
+
+class RegistroNodi:
+    """Registro dei nodi connessi, indicizzato per connessione, per id e per (host, porta): inserimento, rimozione e
+       ricerca sono O(1). Le connessioni in entrata e in uscita hanno limiti separati; quando un limite è raggiunto la
+       nuova connessione sostituisce il nodo inattivo da più tempo, se lo è da almeno min_inattivita secondi, altrimenti
+       viene rifiutata. Gli elenchi restituiti da tutti(), entranti() e uscenti() sono tuple ricostruite solo quando il
+       registro cambia: scorrerli (es. per ogni messaggio inviato a tutti i nodi) non richiede copie né lock."""
+
+    def __init__(self, max_entranti = 128, max_uscenti = 64, min_inattivita = 60.0):
+        """max_entranti, max_uscenti: Il numero massimo di connessioni in entrata e in uscita (None: nessun limite).
+           min_inattivita: I secondi senza messaggi ricevuti dopo i quali un nodo può essere sostituito."""
+        self.max_entranti = max_entranti
+        self.max_uscenti = max_uscenti
+        self.min_inattivita = min_inattivita
+
+        self.lock = threading.Lock()
+        self.direzione = {}   # connessione -> True se in uscita
+        self.attivita = {}    # connessione -> istante dell'ultimo messaggio ricevuto
+        self.per_id = {}
+        self.per_indirizzo = {}
+
+        self._entranti = ()
+        self._uscenti = ()
+        self._tutti = ()
+
+    def _aggiorna_elenchi(self):
+        # Ricostruisce gli elenchi; eseguito con il lock, solo quando una connessione viene aggiunta o rimossa.
+        self._entranti = tuple( n for n, uscente in self.direzione.items() if not uscente )
+        self._uscenti = tuple( n for n, uscente in self.direzione.items() if uscente )
+        self._tutti = self._entranti + self._uscenti
+
+    def aggiungi(self, connessione, uscente):
+        """Registra la connessione. Restituisce (accettata, espulse): se il limite della sua direzione è raggiunto
+           "espulse" contiene il nodo inattivo che è stato rimosso per farle posto, che il chiamante deve fermare.
+           Se nessun nodo è sostituibile la connessione non viene registrata e "accettata" è False."""
+        adesso = time.monotonic()
+        espulse = []
+        with self.lock:
+            limite = self.max_uscenti if uscente else self.max_entranti
+            candidati = self._uscenti if uscente else self._entranti
+            if limite != None and len(candidati) >= limite:
+                inattivo = min(candidati, key=lambda n: self.attivita[n], default=None)
+                if inattivo == None or adesso - self.attivita[inattivo] < self.min_inattivita:
+                    return False, espulse
+
+                self._rimuovi(inattivo)
+                espulse.append(inattivo)
+
+            self.direzione[connessione] = uscente
+            self.attivita[connessione] = adesso
+            self.per_id[connessione.id] = connessione
+            self.per_indirizzo[(connessione.host, connessione.porta)] = connessione
+            self._aggiorna_elenchi()
+
+        return True, espulse
+
+    def _rimuovi(self, connessione):
+        del self.direzione[connessione]
+        del self.attivita[connessione]
+        if self.per_id.get(connessione.id) is connessione:
+            del self.per_id[connessione.id]
+        if self.per_indirizzo.get((connessione.host, connessione.porta)) is connessione:
+            del self.per_indirizzo[(connessione.host, connessione.porta)]
+
+    def rimuovi(self, connessione):
+        # Rimuove la connessione. Restituisce False se non era registrata.
+        with self.lock:
+            if connessione not in self.direzione:
+                return False
+            self._rimuovi(connessione)
+            self._aggiorna_elenchi()
+        return True
+
+    def registra_attivita(self, connessione):
+        # Registra che dalla connessione è appena arrivato un messaggio.
+        with self.lock:
+            if connessione in self.attivita:
+                self.attivita[connessione] = time.monotonic()
+
+    def cerca_id(self, id):
+        # Restituisce la connessione con il nodo "id", oppure None.
+        return self.per_id.get(id)
+
+    def cerca_indirizzo(self, host, porta):
+        # Restituisce la connessione con il nodo host:porta, oppure None.
+        return self.per_indirizzo.get((host, porta))
+
+    def uscente(self, connessione):
+        # Indica se la connessione è in uscita (None se non è registrata).
+        return self.direzione.get(connessione)
+
+    def tutti(self):
+        return self._tutti
+
+    def entranti(self):
+        return self._entranti
+
+    def uscenti(self):
+        return self._uscenti
+
+    def __contains__(self, connessione):
+        return connessione in self.direzione
+
+    def __len__(self):
+        return len(self.direzione)
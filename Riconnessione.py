@@ -0,0 +1,129 @@
+import time
+import heapq
+import random
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PianificatoreRiconnessioni(threading.Thread):
+    """Thread che riconnette il nodo ai nodi persi per cui è stata richiesta la riconnessione. I tentativi sono in uno
+       heap ordinato per istante: dopo ogni fallimento l'attesa raddoppia (da ritardo_iniziale fino a ritardo_massimo)
+       con una variazione casuale, così molti nodi persi insieme non vengono ricontattati tutti nello stesso momento.
+       Le connessioni sono aperte in parallelo da un pool di thread, quindi né il ciclo che accetta le connessioni né
+       gli altri tentativi attendono i nodi che non rispondono."""
+
+    def __init__(self, nodo, ritardo_iniziale = 1.0, ritardo_massimo = 60.0, max_tentativi = 10, variazione = 0.5, workers = 8):
+        """nodo: Il Nodo da riconnettere (usa connect_with_node e node_reconnection_error).
+           ritardo_iniziale, ritardo_massimo: L'attesa prima del primo tentativo e il limite dell'attesa tra i tentativi.
+           max_tentativi: Dopo quanti tentativi falliti consecutivi il nodo viene dimenticato (None: nessun limite).
+           variazione: La frazione dell'attesa scelta a caso (0.5: tra il 50% e il 100% dell'attesa).
+           workers: Il numero massimo di connessioni aperte contemporaneamente."""
+        super(PianificatoreRiconnessioni, self).__init__(daemon=True)
+
+        self.nodo = nodo
+        self.ritardo_iniziale = ritardo_iniziale
+        self.ritardo_massimo = ritardo_massimo
+        self.max_tentativi = max_tentativi
+        self.variazione = variazione
+        self.workers = workers
+
+        # Nodi da riconnettere: (host, porta) -> {"host", "porta", "tentativi", "pianificato"}
+        self.voci = {}
+        self.heap = []
+        self.sequenza = itertools.count()
+        self.condizione = threading.Condition()
+        self.fermato = False
+        self.esecutore = None
+
+    def registra(self, host, porta):
+        # Abilita la riconnessione al nodo host:porta (appena connesso).
+        with self.condizione:
+            voce = self.voci.setdefault( (host, porta), {"host": host, "porta": porta, "tentativi": 0, "pianificato": False} )
+            voce["tentativi"] = 0
+
+    def rimuovi(self, host, porta):
+        # Disabilita la riconnessione al nodo host:porta; un tentativo già pianificato viene ignorato.
+        with self.condizione:
+            self.voci.pop( (host, porta), None )
+
+    def ritardo(self, tentativi):
+        # Attesa prima del tentativo successivo dopo "tentativi" tentativi falliti.
+        ritardo = min(self.ritardo_massimo, self.ritardo_iniziale * 2**tentativi)
+        return ritardo * random.uniform(1 - self.variazione, 1)
+
+    def pianifica(self, host, porta):
+        """Pianifica un tentativo di riconnessione al nodo host:porta, se la riconnessione è abilitata e non c'è già
+           un tentativo in attesa. Restituisce True se il tentativo è stato pianificato."""
+        with self.condizione:
+            voce = self.voci.get( (host, porta) )
+            if voce == None or voce["pianificato"]:
+                return False
+
+            voce["pianificato"] = True
+            istante = time.monotonic() + self.ritardo(voce["tentativi"])
+            heapq.heappush(self.heap, (istante, next(self.sequenza), voce))
+            self.condizione.notify()
+            return True
+
+    def ferma(self):
+        with self.condizione:
+            self.fermato = True
+            self.condizione.notify()
+
+    def run(self):
+        self.esecutore = ThreadPoolExecutor(self.workers, thread_name_prefix="riconnessione")
+        while True:
+            with self.condizione:
+                while not self.fermato and (not self.heap or self.heap[0][0] > time.monotonic()):
+                    self.condizione.wait( self.heap[0][0] - time.monotonic() if self.heap else None )
+
+                if self.fermato:
+                    break
+
+                _, _, voce = heapq.heappop(self.heap)
+
+            if self.avvia_tentativo(voce):
+                self.esecutore.submit(self.tenta, voce)
+
+        self.esecutore.shutdown(wait=False)
+
+    def avvia_tentativo(self, voce):
+        """Invocato quando scade l'attesa del tentativo "voce". Restituisce True se il tentativo va eseguito: la
+           riconnessione è ancora abilitata, i tentativi non sono esauriti e node_reconnection_error lo consente."""
+        with self.condizione:
+            if self.voci.get( (voce["host"], voce["porta"]) ) is not voce:
+                return False # Riconnessione disabilitata nel frattempo
+
+            voce["pianificato"] = False
+            voce["tentativi"] += 1
+            if self.max_tentativi != None and voce["tentativi"] > self.max_tentativi:
+                del self.voci[ (voce["host"], voce["porta"]) ]
+                self.nodo.debug_print("riconnessione: superati i tentativi per il nodo " + voce["host"] + ":" + str(voce["porta"]))
+                return False
+
+        if not self.nodo.node_reconnection_error(voce["host"], voce["porta"], voce["tentativi"]):
+            self.nodo.debug_print("riconnessione: rimuovo il nodo (" + voce["host"] + ":" + str(voce["porta"]) + ") dalla lista di riconnessione")
+            self.rimuovi(voce["host"], voce["porta"])
+            return False
+
+        return True
+
+    def tenta(self, voce):
+        # Eseguito nel pool: apre la connessione e, se non riesce, pianifica il tentativo successivo.
+        try:
+            connesso = self.nodo.connect_with_node(voce["host"], voce["porta"], reconnect = False)
+        except Exception as e:
+            self.nodo.debug_print("riconnessione: errore nella connessione (" + str(e) + ")")
+            connesso = False
+
+        if connesso:
+            with self.condizione:
+                voce["tentativi"] = 0
+        else:
+            self.pianifica(voce["host"], voce["porta"])
+
+    def elenco(self):
+        # Restituisce i nodi da riconnettere con il numero di tentativi falliti.
+        with self.condizione:
+            return [ {"host": v["host"], "porta": v["porta"], "tentativi": v["tentativi"]} for v in self.voci.values() ]
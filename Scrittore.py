@@ -0,0 +1,188 @@
+import time
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+from Metriche import BUCKET_DIMENSIONE
+
+
+# Pragmas applicati a tutte le connessioni al database della blockchain. Con il journal WAL i lettori non attendono
+# lo scrittore; synchronous=NORMAL esegue l'fsync solo ai checkpoint del WAL e non a ogni commit.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000"
+)
+
+
+def apri_connessione(percorso, **argomenti):
+    # Apre una connessione al database applicando i PRAGMAS.
+    db = sqlite3.connect(percorso, **argomenti)
+    for pragma in PRAGMAS:
+        db.execute(pragma)
+    return db
+
+
+class Lavoro:
+    # Un'operazione in attesa dello scrittore: funzione(contesto, *argomenti), peso (es. numero di blocchi) e Future del risultato.
+
+    def __init__(self, funzione, argomenti, peso):
+        self.funzione = funzione
+        self.argomenti = argomenti
+        self.peso = peso
+        self.futuro = Future()
+        self.accodato = time.perf_counter()
+
+
+class Scrittore(threading.Thread):
+    """Thread che esegue tutte le scritture su un archivio dei blocchi. Le operazioni vengono accodate da qualsiasi
+       thread con esegui() e raggruppate in una sola transazione (group commit) finché il peso totale non raggiunge
+       max_peso o non scade la finestra di attesa; segue un unico commit per tutto il gruppo. Ogni operazione è
+       eseguita in un punto di ripristino: se fallisce vengono annullate solo le sue modifiche.
+       Le sottoclassi implementano la transazione: inizia() restituisce il contesto passato alle operazioni,
+       punto(), rilascia() e ripristina() gestiscono il punto di ripristino di ogni operazione, conferma() e annulla()
+       chiudono il gruppo, termina() è invocato all'uscita dal thread."""
+
+    def __init__(self, max_peso = 5000, finestra = 0.0, metriche = None):
+        """max_peso: Il peso (es. numero di blocchi) oltre il quale il gruppo viene chiuso e confermato.
+           finestra: Quanti secondi attendere altre operazioni dopo la prima di un gruppo. Con 0 il gruppo comprende
+                     le operazioni accodate mentre era in corso il commit precedente, senza aggiungere latenza.
+           metriche: Il RegistroMetriche (vedi Metriche) in cui registrare le latenze dell'archivio; None per non registrarle."""
+        super(Scrittore, self).__init__(daemon=True)
+
+        self.max_peso = max_peso
+        self.finestra = finestra
+        self.coda = queue.Queue()
+
+        # Statistiche: commit eseguiti e operazioni confermate
+        self.commit = 0
+        self.operazioni = 0
+
+        self.metriche = metriche
+        if metriche != None:
+            self.istogramma_operazione = metriche.istogramma("db_operazione_secondi", "Secondi di esecuzione di un'operazione sul database (es. inserimento di un lotto di blocchi)")
+            self.istogramma_commit = metriche.istogramma("db_commit_secondi", "Secondi del COMMIT di un gruppo di operazioni")
+            self.istogramma_attesa = metriche.istogramma("db_attesa_secondi", "Secondi tra l'accodamento di un'operazione e il commit che la conferma")
+            self.istogramma_gruppo = metriche.istogramma("db_gruppo_operazioni", "Operazioni confermate da ogni commit", BUCKET_DIMENSIONE)
+            metriche.misura("db_in_coda", "Operazioni in attesa dello scrittore del database", self.coda.qsize)
+
+    def esegui(self, funzione, *argomenti, peso = 1):
+        """Accoda l'operazione funzione(contesto, *argomenti) e restituisce un Future con il suo risultato, disponibile
+           dopo il commit del gruppo di cui fa parte."""
+        lavoro = Lavoro(funzione, argomenti, peso)
+        self.coda.put(lavoro)
+        return lavoro.futuro
+
+    def chiudi(self):
+        # Conferma le operazioni già accodate e termina il thread.
+        self.coda.put(None)
+        self.join()
+
+    def raccogli(self, primo):
+        # Raccoglie le operazioni da confermare insieme alla prima. Restituisce (gruppo, fine) dove fine indica la richiesta di chiusura.
+        gruppo = [primo]
+        peso = primo.peso
+        scadenza = time.monotonic() + self.finestra
+
+        while peso < self.max_peso:
+            try:
+                lavoro = self.coda.get_nowait() if self.finestra <= 0 else self.coda.get(timeout=max(0, scadenza - time.monotonic()))
+            except queue.Empty:
+                break
+
+            if lavoro == None:
+                return gruppo, True
+
+            gruppo.append(lavoro)
+            peso += lavoro.peso
+
+        return gruppo, False
+
+    def run(self):
+        fine = False
+        while not fine:
+            primo = self.coda.get()
+            if primo == None:
+                break
+
+            gruppo, fine = self.raccogli(primo)
+
+            contesto = self.inizia()
+            risultati = []
+            durate = []
+            for lavoro in gruppo:
+                inizio = time.perf_counter()
+                self.punto(contesto)
+                try:
+                    risultati.append( (lavoro, lavoro.funzione(contesto, *lavoro.argomenti), None) )
+                    self.rilascia(contesto)
+                except Exception as e:
+                    self.ripristina(contesto)
+                    risultati.append( (lavoro, None, e) )
+                durate.append(time.perf_counter() - inizio)
+
+            inizio = time.perf_counter()
+            try:
+                self.conferma(contesto)
+                self.commit += 1
+                self.operazioni += len(gruppo)
+            except Exception as e:
+                self.annulla(contesto)
+                risultati = [ (lavoro, None, e) for lavoro, _, _ in risultati ]
+
+            if self.metriche != None:
+                confermato = time.perf_counter()
+                self.istogramma_operazione.osserva_valori(durate)
+                self.istogramma_commit.osserva(confermato - inizio)
+                self.istogramma_attesa.osserva_valori([ confermato - lavoro.accodato for lavoro in gruppo ])
+                self.istogramma_gruppo.osserva(len(gruppo))
+
+            # I risultati sono visibili solo dopo il commit
+            for lavoro, risultato, errore in risultati:
+                if errore != None:
+                    lavoro.futuro.set_exception(errore)
+                else:
+                    lavoro.futuro.set_result(risultato)
+
+        self.termina()
+
+
+class ScrittoreDB(Scrittore):
+    """Scrittore di un database SQLite, con un'unica connessione: il contesto delle operazioni è un cursore nella
+       transazione del gruppo (BEGIN/COMMIT) e ogni operazione è eseguita in un SAVEPOINT."""
+
+    def __init__(self, percorso, max_peso = 5000, finestra = 0.0, metriche = None):
+        # percorso: Il file del database. Gli altri parametri sono quelli di Scrittore.
+        super(ScrittoreDB, self).__init__(max_peso, finestra, metriche)
+        self.percorso = percorso
+
+        # La transazione è gestita esplicitamente (BEGIN/COMMIT), quindi la connessione è in autocommit
+        self.db = apri_connessione(percorso, check_same_thread = False, isolation_level = None)
+
+    def inizia(self):
+        c = self.db.cursor()
+        c.execute("BEGIN")
+        return c
+
+    def punto(self, c):
+        c.execute("SAVEPOINT lavoro")
+
+    def rilascia(self, c):
+        c.execute("RELEASE lavoro")
+
+    def ripristina(self, c):
+        c.execute("ROLLBACK TO lavoro")
+        c.execute("RELEASE lavoro")
+
+    def conferma(self, c):
+        c.execute("COMMIT")
+
+    def annulla(self, c):
+        c.execute("ROLLBACK")
+
+    def termina(self):
+        self.db.close()
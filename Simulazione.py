@@ -0,0 +1,386 @@
+import heapq
+import random
+import itertools
+import threading
+
+from Nodo import Nodo
+from Riconnessione import PianificatoreRiconnessioni
+from Arco import (FRAMING_LP, HEADER_LP, codifica_frame, decodifica_frame, decodifica_pacchetto,
+                  handshake_offerta, handshake_leggi, handshake_risposta)
+
+
+# Trasporto simulato in memoria per gli esperimenti su reti di migliaia di nodi in un solo processo. Invece dei socket
+# e dei thread, i nodi simulati (NodoSimulato) si scambiano i messaggi tramite una ReteSimulata che ne calcola
+# l'istante di arrivo (latenza, banda in uscita di ogni nodo, perdita) e li consegna come eventi di un Simulatore
+# a eventi discreti: il tempo simulato avanza da un evento al successivo, quindi la simulazione procede più veloce
+# del tempo reale. Tutti i callback (node_message, node_disconnected, ...) vengono eseguiti nel thread che chiama
+# Simulatore.esegui, uno alla volta.
+
+# Le connessioni in entrata hanno, come nel TCP, una porta diversa da quella su cui il nodo remoto è in ascolto;
+# nella rete simulata sono numerate da questo valore, fuori dall'intervallo delle porte reali.
+PRIMA_PORTA_EFFIMERA = 65536
+
+
+class Simulatore:
+    """Orologio a eventi discreti: gli eventi sono funzioni da eseguire a un istante simulato (in secondi), tenute in uno
+       heap. esegui() estrae gli eventi in ordine di istante (a parità di istante in ordine di inserimento), porta
+       l'orologio all'istante dell'evento ed esegue la funzione, che può pianificare altri eventi."""
+
+    def __init__(self):
+        self.adesso = 0.0
+        self.eventi = []
+        self.sequenza = itertools.count()
+        self.eseguiti = 0
+
+    def pianifica(self, ritardo, funzione, *argomenti):
+        # Esegue funzione(*argomenti) tra "ritardo" secondi simulati.
+        self.pianifica_a(self.adesso + max(0.0, ritardo), funzione, *argomenti)
+
+    def pianifica_a(self, istante, funzione, *argomenti):
+        # Esegue funzione(*argomenti) all'istante simulato dato (non prima dell'istante attuale).
+        heapq.heappush(self.eventi, (max(istante, self.adesso), next(self.sequenza), funzione, argomenti))
+
+    def esegui(self, fino_a = None, max_eventi = None, condizione = None):
+        """Esegue gli eventi finché non ce ne sono più, oppure fino all'istante "fino_a" (l'orologio viene portato a
+           quell'istante), dopo max_eventi eventi o quando condizione() diventa vera. Restituisce gli eventi eseguiti."""
+        eseguiti = 0
+        while self.eventi:
+            if fino_a != None and self.eventi[0][0] > fino_a:
+                break
+            if max_eventi != None and eseguiti >= max_eventi:
+                return eseguiti
+
+            istante, _, funzione, argomenti = heapq.heappop(self.eventi)
+            self.adesso = istante
+            funzione(*argomenti)
+            eseguiti += 1
+            self.eseguiti += 1
+
+            if condizione != None and condizione():
+                return eseguiti
+
+        if fino_a != None:
+            self.adesso = max(self.adesso, fino_a)
+        return eseguiti
+
+    def __len__(self):
+        return len(self.eventi)
+
+
+class ReteSimulata:
+    """Rete in memoria che collega i nodi simulati. Un messaggio inviato da un nodo occupa la sua banda in uscita per
+       dimensione/banda secondi (i messaggi dello stesso nodo sono trasmessi uno dopo l'altro) e arriva dopo la latenza
+       del collegamento più una variazione casuale; i messaggi di una connessione arrivano nell'ordine di invio, come
+       nel TCP. Con probabilità "perdita" un messaggio viene perso: il protocollo deve recuperare con la sincronizzazione."""
+
+    def __init__(self, simulatore = None, latenza = 0.05, variazione = 0.0, banda = None, perdita = 0.0, seme = None):
+        """simulatore: Il Simulatore che esegue le consegne (default: un nuovo Simulatore).
+           latenza: I secondi di latenza di ogni collegamento, oppure una funzione latenza(mittente, destinatario) dei due nodi.
+           variazione: I secondi massimi aggiunti a caso alla latenza di ogni messaggio.
+           banda: I byte al secondo in uscita da ogni nodo (None: nessun limite).
+           perdita: La probabilità che un messaggio vada perso.
+           seme: Il seme del generatore casuale usato per variazione e perdita."""
+        self.simulatore = simulatore if simulatore != None else Simulatore()
+        self.latenza = latenza
+        self.variazione = variazione
+        self.banda = banda
+        self.perdita = perdita
+        self.casuale = random.Random(seme)
+
+        self.nodi = {}            # (host, porta) -> NodoSimulato
+        self.libero_da = {}       # nodo -> istante in cui la sua banda in uscita si libera
+        self.porte_effimere = itertools.count(PRIMA_PORTA_EFFIMERA)
+
+        # Statistiche: messaggi e byte inviati, messaggi persi e consegnati, connessioni aperte
+        self.messaggi = 0
+        self.byte = 0
+        self.persi = 0
+        self.consegnati = 0
+        self.connessioni = 0
+        self.ultima_consegna = 0.0
+
+    def registra(self, nodo):
+        # Riserva l'indirizzo del nodo. Solleva ValueError se è già usato da un altro nodo.
+        indirizzo = (nodo.host, nodo.porta)
+        if indirizzo in self.nodi:
+            raise ValueError("indirizzo già in uso nella rete simulata: %s:%s" % indirizzo)
+        self.nodi[indirizzo] = nodo
+
+    def nodo_in_ascolto(self, host, porta):
+        # Restituisce il nodo avviato e non fermato all'indirizzo host:porta, oppure None.
+        nodo = self.nodi.get( (host, porta) )
+        if nodo == None or not nodo.in_ascolto or nodo.terminate_flag.is_set():
+            return None
+        return nodo
+
+    def latenza_collegamento(self, mittente, destinatario):
+        latenza = self.latenza(mittente, destinatario) if callable(self.latenza) else self.latenza
+        if self.variazione:
+            latenza += self.casuale.uniform(0, self.variazione)
+        return latenza
+
+    def connetti(self, nodo, remoto):
+        """Crea le due estremità della connessione da "nodo" a "remoto" scambiando gli ID come Nodo.connect_with_node
+           (compresa la scelta del framing). Restituisce (uscente, entrante): la connessione vista da "nodo" e da "remoto"."""
+        id, offerta = handshake_leggi(handshake_offerta(nodo.id, nodo.framing))
+        risposta, framing = handshake_risposta(remoto.id, offerta, remoto.framing)
+        id_remoto, _ = handshake_leggi(risposta)
+
+        uscente = ConnessioneSimulata(nodo, self, id_remoto, remoto.host, remoto.porta, framing)
+        entrante = ConnessioneSimulata(remoto, self, id, nodo.host, next(self.porte_effimere), framing)
+        uscente.remota, entrante.remota = entrante, uscente
+        self.connessioni += 1
+        return uscente, entrante
+
+    def trasmetti(self, connessione, frame):
+        """Pianifica la consegna del frame all'altra estremità della connessione. Con frame=None viene pianificata la
+           chiusura, che arriva dopo i messaggi già inviati."""
+        mittente = connessione.main_node
+        destinazione = connessione.remota
+        adesso = self.simulatore.adesso
+
+        if frame != None:
+            self.messaggi += 1
+            self.byte += len(frame)
+
+            # Trasmissione sulla banda in uscita del nodo, occupata dai messaggi inviati in precedenza
+            partenza = max(adesso, self.libero_da.get(mittente, adesso))
+            if self.banda:
+                partenza += len(frame) / self.banda
+            self.libero_da[mittente] = partenza
+
+            if self.perdita and self.casuale.random() < self.perdita:
+                self.persi += 1
+                return
+        else:
+            partenza = adesso
+
+        arrivo = max(partenza + self.latenza_collegamento(mittente, destinazione.main_node), connessione.ultimo_arrivo)
+        connessione.ultimo_arrivo = arrivo
+        connessione.in_volo += 1
+        self.simulatore.pianifica_a(arrivo, destinazione.consegna, frame)
+
+    def statistiche(self):
+        # Restituisce messaggi e byte inviati, messaggi persi e consegnati, connessioni aperte ed eventi eseguiti.
+        return {
+            "nodi": len(self.nodi),
+            "messaggi": self.messaggi,
+            "byte": self.byte,
+            "persi": self.persi,
+            "consegnati": self.consegnati,
+            "connessioni": self.connessioni,
+            "ultima_consegna": self.ultima_consegna,
+            "eventi": self.simulatore.eseguiti,
+            "tempo_simulato": self.simulatore.adesso
+        }
+
+
+class ConnessioneSimulata:
+    """Un'estremità di una connessione della rete simulata. Espone la stessa interfaccia di Connessione (id, host, porta,
+       send, stop, chiudi, set_info, get_info), quindi Nodo e le sue sottoclassi la usano senza modifiche. I messaggi
+       sono codificati con il framing concordato, così dimensioni e decodifica sono quelle della rete reale."""
+
+    def __init__(self, main_node, rete, id, host, porta, framing = FRAMING_LP):
+        self.main_node = main_node
+        self.rete = rete
+        self.id = str(id)
+        self.host = host
+        self.porta = porta
+        self.framing = framing
+        self.terminate_flag = threading.Event()
+        self.info = {}
+
+        self.remota = None        # L'altra estremità della connessione
+        self.ultimo_arrivo = 0.0  # Istante di arrivo dell'ultimo messaggio inviato (i messaggi non si sorpassano)
+        self.in_volo = 0          # Messaggi inviati da questa estremità e non ancora consegnati all'altra
+
+    def send(self, data, encoding_type='utf-8'):
+        # Invia i dati al nodo connesso: il messaggio arriverà all'altra estremità dopo il ritardo calcolato dalla rete.
+        try:
+            frame = codifica_frame(data, self.framing, encoding_type)
+
+        except TypeError as type_error:
+            self.main_node.debug_print('Dict non valido')
+            self.main_node.debug_print(str(type_error))
+            return
+
+        if frame == None:
+            self.main_node.debug_print('datatype non valido, usare str, dict (sarà inviato come json) o bytes')
+            return
+
+        if self.terminate_flag.is_set():
+            return
+
+        self.main_node.conta_messaggio_inviato(self)
+        self.main_node.conta_byte_inviati(self, len(frame))
+        self.rete.trasmetti(self, frame)
+
+    def consegna(self, frame):
+        # Evento del simulatore: arrivo di un messaggio (o della chiusura, frame=None) inviato dall'altra estremità.
+        self.remota.in_volo -= 1
+        if self.terminate_flag.is_set():
+            return
+
+        if frame == None:
+            self.termina()
+            return
+
+        if self.framing == FRAMING_LP:
+            lunghezza, tipo = HEADER_LP.unpack_from(frame)
+            data = decodifica_frame(tipo, frame[HEADER_LP.size:])
+        else:
+            data = decodifica_pacchetto(frame[:-1])
+
+        self.rete.consegnati += 1
+        self.rete.ultima_consegna = self.rete.simulatore.adesso
+        self.main_node.conta_messaggio_ricevuto(self, len(frame))
+        self.main_node.messaggio_ricevuto(self, data)
+
+    def termina(self):
+        self.terminate_flag.set()
+        self.main_node.node_disconnected(self)
+        self.main_node.debug_print("ConnessioneSimulata: Interrotta")
+
+    def stop(self):
+        # Termina la connessione: l'altra estremità viene chiusa dopo aver ricevuto i messaggi già inviati.
+        if self.terminate_flag.is_set():
+            return
+        self.terminate_flag.set()
+        self.rete.trasmetti(self, None)
+        self.rete.simulatore.pianifica(0, self.main_node.node_disconnected, self)
+
+    def chiudi(self):
+        # Chiude una connessione mai avviata (es. rifiutata per il limite di connessioni) e la sua altra estremità.
+        self.terminate_flag.set()
+        if self.remota != None and not self.remota.terminate_flag.is_set():
+            self.rete.trasmetti(self, None)
+
+    def stato_coda(self):
+        # Nella rete simulata non c'è una coda di invio: i messaggi in viaggio sono attribuiti alla rete.
+        return {"messaggi": self.in_volo, "byte": 0, "scartati": 0}
+
+    def set_info(self, key, value):
+        self.info[key] = value
+
+    def get_info(self, key):
+        return self.info[key]
+
+    def __str__(self):
+        return 'ConnessioneSimulata: {}:{} <-> {}:{} ({})'.format(self.main_node.host, self.main_node.porta, self.host, self.porta, self.id)
+
+    def __repr__(self):
+        return '<ConnessioneSimulata: Nodo {}:{} <-> Connessione {}:{}>'.format(self.main_node.host, self.main_node.porta, self.host, self.porta)
+
+
+class RiconnessioniSimulate(PianificatoreRiconnessioni):
+    """PianificatoreRiconnessioni sull'orologio del simulatore: attese, variazione casuale e limite di tentativi sono gli
+       stessi, ma ogni tentativo è un evento simulato eseguito nel thread della simulazione, senza thread né pool."""
+
+    def __init__(self, nodo, simulatore):
+        super(RiconnessioniSimulate, self).__init__(nodo)
+        self.simulatore = simulatore
+
+    def pianifica(self, host, porta):
+        with self.condizione:
+            voce = self.voci.get( (host, porta) )
+            if voce == None or voce["pianificato"] or self.fermato:
+                return False
+            voce["pianificato"] = True
+            ritardo = self.ritardo(voce["tentativi"])
+
+        self.simulatore.pianifica(ritardo, self.scaduto, voce)
+        return True
+
+    def scaduto(self, voce):
+        if not self.fermato and self.avvia_tentativo(voce):
+            self.tenta(voce)
+
+    def start(self):
+        pass
+
+    def ferma(self):
+        self.fermato = True
+
+
+class NodoSimulato(Nodo):
+    """Versione simulata della classe "Nodo": nessun socket e nessun thread, le connessioni sono ConnessioneSimulata di
+       una ReteSimulata e le riconnessioni sono pianificate sull'orologio del simulatore. I metodi pubblici e i callback
+       sono quelli di Nodo, quindi una sottoclasse di Nodo può essere simulata ereditando anche da NodoSimulato
+       (vedi NodoBlockchainSimulato). I messaggi ricevuti sono gestiti subito, senza i worker dello Smistatore."""
+
+    # La rete dei nodi creati senza indicare "rete".
+    rete = None
+
+    def __init__(self, host, porta, id = None, rete = None, max_entranti = 128, max_uscenti = 64):
+        if rete != None:
+            self.rete = rete
+        if self.rete == None:
+            raise ValueError("NodoSimulato richiede una ReteSimulata")
+        self.in_ascolto = False
+
+        super(NodoSimulato, self).__init__(host, porta, id, max_entranti, max_uscenti)
+
+        self.riconnessioni = RiconnessioniSimulate(self, self.rete.simulatore)
+        self.smistatore.workers = 0
+
+    def adesso(self):
+        return self.rete.simulatore.adesso
+
+    def pianifica(self, ritardo, funzione, *argomenti):
+        # Esegue funzione(*argomenti) tra "ritardo" secondi simulati, come evento del simulatore.
+        self.rete.simulatore.pianifica(ritardo, funzione, *argomenti)
+
+    def init_server(self):
+        # Riserva l'indirizzo nella rete simulata; il nodo accetta connessioni dopo start().
+        self.rete.registra(self)
+
+    def start(self):
+        # Il nodo non ha un thread: da questo momento gli altri nodi simulati possono connettersi.
+        self.in_ascolto = True
+
+    def stop(self):
+        # Arresta il nodo e chiude tutte le connessioni; l'indirizzo resta riservato.
+        self.terminate_flag.set()
+        self.in_ascolto = False
+        self.riconnessioni.ferma()
+        self.ferma_server_metriche()
+        for n in self.all_nodes():
+            n.stop()
+
+    def connect_with_node(self, host, porta, reconnect = True):
+        """Connette il nodo al nodo simulato host:porta, come Nodo.connect_with_node. La connessione è stabilita
+           subito, all'istante simulato attuale. Restituisce False se il nodo non è in ascolto o ha rifiutato la connessione."""
+        if host == self.host and porta == self.porta:
+            print("connect_with_node: impossibile connettersi con se stessi!")
+            return False
+
+        node = self.registro.cerca_indirizzo(host, porta)
+        if node != None and self.registro.uscente(node):
+            print("connect_with_node: Già connesso con questo nodo (" + node.id + ").")
+            return True
+
+        remoto = self.rete.nodo_in_ascolto(host, porta)
+        if remoto == None or self.terminate_flag.is_set():
+            self.debug_print("NodoSimulato.connect_with_node: Impossibile connettersi con il nodo " + host + ":" + str(porta))
+            return False
+
+        node = self.registro.cerca_id(remoto.id)
+        if node != None and node.host == host and not self.registro.uscente(node):
+            print("connect_with_node: Già connesso con questo nodo (" + node.id + ").")
+            return True
+
+        uscente, entrante = self.rete.connetti(self, remoto)
+        if not remoto.registra_nodo(entrante, False):
+            uscente.terminate_flag.set()
+            return False
+
+        if not self.registra_nodo(uscente, True):
+            return False
+
+        if reconnect:
+            self.debug_print("connect_with_node: Riconnessione abilitata per il nodo " + host + ":" + str(porta))
+            self.riconnessioni.registra(host, porta)
+        return True
+
+    def run(self):
+        pass
@@ -0,0 +1,175 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class Smistatore:
+    """Stadio tra la ricezione dei messaggi e la loro gestione: i messaggi ricevuti vengono accodati e gestiti da un
+       pool di thread, così la lettura dal socket non attende i gestori (es. scritture sul database). I messaggi dello
+       stesso nodo vanno sempre allo stesso worker e sono quindi gestiti nell'ordine di arrivo. Le code dei worker sono
+       limitate: quando sono piene chi riceve attende e smette di leggere dal socket, quindi è il nodo che invia a
+       rallentare (la sua coda di invio si riempie) invece di accumulare messaggi in memoria."""
+
+    def __init__(self, gestore, workers = 4, capacita = 1024, metriche = None):
+        """gestore: La funzione gestore(node, data) invocata per ogni messaggio.
+           workers: Il numero di thread che gestiscono i messaggi (0: gestione nel thread che riceve, senza code).
+           capacita: Il numero massimo di messaggi in attesa nella coda di ogni worker.
+           metriche: Il RegistroMetriche (vedi Metriche) in cui registrare attese e durate; None per non registrarle."""
+        self.gestore = gestore
+        self.workers = workers
+        self.capacita = capacita
+        self.code = []
+        self.thread = []
+        self.fermato = threading.Event()
+
+        # Per ogni worker, i Future di chi attende spazio nella sua coda (vedi attendi_spazio)
+        self.attese = []
+
+        # Statistiche: messaggi gestiti, tempo di attesa in coda e durata del gestore, attese di chi riceve a coda piena
+        self.lock = threading.Lock()
+        self.gestiti = 0
+        self.errori = 0
+        self.attesa_totale = 0.0
+        self.durata_totale = 0.0
+        self.durata_massima = 0.0
+        self.attese_coda_piena = 0
+
+        self.istogramma_attesa = None
+        self.istogramma_durata = None
+        if metriche != None:
+            self.istogramma_attesa = metriche.istogramma("smistamento_attesa_secondi", "Secondi tra la ricezione di un messaggio e l'inizio della sua gestione")
+            self.istogramma_durata = metriche.istogramma("gestore_durata_secondi", "Secondi di esecuzione del gestore dei messaggi")
+            metriche.misura("smistamento_in_coda", "Messaggi ricevuti in attesa di gestione", lambda: sum( c.qsize() for c in self.code ))
+
+    def avvia(self):
+        for i in range(self.workers):
+            coda = queue.Queue(self.capacita)
+            attese = []
+            thread = threading.Thread(target=self.esegui, args=(coda, attese), name="smistatore-%d" % i, daemon=True)
+            self.code.append(coda)
+            self.attese.append(attese)
+            self.thread.append(thread)
+            thread.start()
+
+    def ferma(self):
+        # Ferma i worker dopo la gestione dei messaggi già accodati.
+        self.fermato.set()
+        for attese in self.attese:
+            self.risveglia(attese)
+        for coda in self.code:
+            coda.put(None)
+        for thread in self.thread:
+            if thread is not threading.current_thread():
+                thread.join()
+
+    def coda_nodo(self, node):
+        # La coda del worker assegnato al nodo.
+        return self.code[hash(node) % len(self.code)]
+
+    def ha_spazio(self, node):
+        # Indica se un messaggio del nodo può essere accodato senza attendere.
+        return not self.code or not self.coda_nodo(node).full()
+
+    def attendi_spazio(self, node):
+        """Restituisce un Future (concurrent.futures) completato quando la coda del worker assegnato al nodo ha spazio
+           o quando lo smistatore viene fermato. Serve a chi non può bloccare il proprio thread in inserisci (es.
+           l'event loop di NodoAsync, che lo attende con asyncio.wrap_future)."""
+        futuro = Future()
+        if not self.code:
+            futuro.set_result(None)
+            return futuro
+
+        indice = hash(node) % len(self.code)
+        with self.lock:
+            if not self.code[indice].full() or self.fermato.is_set():
+                futuro.set_result(None)
+            else:
+                self.attese[indice].append(futuro)
+        return futuro
+
+    def risveglia(self, attese):
+        # Completa i Future di chi attende spazio nella coda di un worker.
+        with self.lock:
+            futuri = list(attese)
+            attese.clear()
+        for futuro in futuri:
+            if not futuro.done():
+                futuro.set_result(None)
+
+    def inserisci(self, node, data):
+        """Accoda il messaggio ricevuto da "node". Se la coda è piena attende che si liberi spazio, finché la connessione
+           o lo smistatore non vengono fermati. Senza worker il messaggio viene gestito subito. Restituisce False se il
+           messaggio è stato scartato."""
+        if not self.code:
+            self.gestisci(node, data, time.perf_counter())
+            return True
+
+        coda = self.coda_nodo(node)
+        elemento = (node, data, time.perf_counter())
+        try:
+            coda.put_nowait(elemento)
+            return True
+        except queue.Full:
+            pass
+
+        with self.lock:
+            self.attese_coda_piena += 1
+
+        terminato = getattr(node, "terminate_flag", None)
+        while not self.fermato.is_set() and (terminato == None or not terminato.is_set()):
+            try:
+                coda.put(elemento, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def esegui(self, coda, attese):
+        # Ciclo di un worker: ogni estrazione libera un posto nella coda, quindi risveglia chi lo attende.
+        while True:
+            elemento = coda.get()
+            if attese:
+                self.risveglia(attese)
+            if elemento == None:
+                return
+            self.gestisci(*elemento)
+
+    def gestisci(self, node, data, accodato):
+        inizio = time.perf_counter()
+        errore = False
+        try:
+            self.gestore(node, data)
+        except Exception as e:
+            errore = True
+            print("Smistatore: errore nella gestione del messaggio di " + str(getattr(node, "id", node)) + ": " + str(e))
+        fine = time.perf_counter()
+
+        with self.lock:
+            self.gestiti += 1
+            self.errori += errore
+            self.attesa_totale += inizio - accodato
+            self.durata_totale += fine - inizio
+            self.durata_massima = max(self.durata_massima, fine - inizio)
+
+        if self.istogramma_attesa != None:
+            self.istogramma_attesa.osserva(inizio - accodato)
+            self.istogramma_durata.osserva(fine - inizio)
+
+    def statistiche(self):
+        """Restituisce messaggi in coda (totale e per worker), capacità, messaggi gestiti ed errori, attesa media in
+           coda e durata media e massima del gestore (secondi), numero di volte in cui chi riceve ha atteso a coda piena."""
+        with self.lock:
+            gestiti = self.gestiti
+            return {
+                "workers": len(self.code),
+                "in_coda": sum( c.qsize() for c in self.code ),
+                "in_coda_worker": [ c.qsize() for c in self.code ],
+                "capacita": self.capacita,
+                "gestiti": gestiti,
+                "errori": self.errori,
+                "attesa_media": self.attesa_totale / gestiti if gestiti else 0.0,
+                "durata_media": self.durata_totale / gestiti if gestiti else 0.0,
+                "durata_massima": self.durata_massima,
+                "attese_coda_piena": self.attese_coda_piena
+            }
@@ -0,0 +1,142 @@
+import os
+import mmap
+import struct
+import hashlib
+
+from Codifica import codifica_riga, decodifica_riga
+from Validatore import PREV_HASH_GENESI
+
+
+# Snapshot della blockchain: i blocchi da 1 a "altezza" salvati in un unico file sequenziale, per avviare un nuovo nodo
+# senza ricevere tutta la catena dagli altri nodi. Il file è composto da:
+#   - un'intestazione a dimensione fissa (INTESTAZIONE_SNAPSHOT): MAGIA, versione, altezza e hash dell'ultimo blocco,
+#     SHA-512 e lunghezza del contenuto;
+#   - il contenuto: i blocchi in ordine di id, codificati come nei messaggi tra i nodi (vedi Codifica.codifica_riga).
+# L'hash dell'ultimo blocco ancora lo snapshot alla catena: se coincide con un checkpoint noto e ogni blocco è
+# collegato al precedente tramite prev_hash, i blocchi fino al checkpoint sono quelli della catena attesa.
+MAGIA = b"BCSNAPSH"
+VERSIONE_SNAPSHOT = 1
+INTESTAZIONE_SNAPSHOT = struct.Struct('!8sHQ64s64sQ')
+
+# Numero di blocchi restituiti in ogni lotto durante la lettura.
+DIMENSIONE_LOTTO_SNAPSHOT = 5000
+
+
+class SnapshotNonValido(ValueError):
+    # Il file non è uno snapshot, è danneggiato o i suoi blocchi non sono collegati fino all'hash dichiarato.
+    pass
+
+
+def scrivi_snapshot(percorso, lotti):
+    """Scrive in "percorso" lo snapshot dei blocchi contenuti in "lotti" (liste di righe binarie nell'ordine di COLONNE,
+       consecutive a partire dal blocco 1, es. Blockchain.leggi_blocchi). Il file viene scritto accanto a quello finale
+       e rinominato solo al termine, quindi uno snapshot interrotto non sostituisce quello precedente.
+       Restituisce (altezza, hash) dell'ultimo blocco salvato."""
+    temporaneo = percorso + ".tmp"
+    digest = hashlib.sha512()
+    altezza, hash, lunghezza = 0, None, 0
+
+    with open(temporaneo, "wb") as f:
+        f.write(bytes(INTESTAZIONE_SNAPSHOT.size)) # Scritta alla fine, quando sono noti altezza e digest
+        for righe in lotti:
+            if not righe:
+                continue
+            dati = b"".join( codifica_riga(r) for r in righe )
+            f.write(dati)
+            digest.update(dati)
+            lunghezza += len(dati)
+            altezza, hash = righe[-1][0], righe[-1][6]
+
+        if altezza == 0:
+            f.close()
+            os.remove(temporaneo)
+            raise SnapshotNonValido("nessun blocco da salvare nello snapshot")
+
+        f.seek(0)
+        f.write(INTESTAZIONE_SNAPSHOT.pack(MAGIA, VERSIONE_SNAPSHOT, altezza, hash, digest.digest(), lunghezza))
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(temporaneo, percorso)
+    return altezza, hash.hex()
+
+
+class Snapshot:
+    """Uno snapshot aperto in lettura. Il file è mappato in memoria: il digest è calcolato direttamente sulla mappa e
+       i blocchi sono decodificati senza leggere il file in buffer intermedi. Si usa con "with" oppure chiudendolo
+       con chiudi()."""
+
+    def __init__(self, percorso):
+        self.percorso = percorso
+        self.file = open(percorso, "rb")
+        try:
+            if os.fstat(self.file.fileno()).st_size < INTESTAZIONE_SNAPSHOT.size:
+                raise SnapshotNonValido(percorso + ": file troppo corto per uno snapshot")
+            self.mappa = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self.file.close()
+            raise
+
+        magia, versione, self.altezza, hash, self.digest, self.lunghezza = INTESTAZIONE_SNAPSHOT.unpack_from(self.mappa, 0)
+        self.hash = hash.hex()
+
+        if magia != MAGIA:
+            self.chiudi()
+            raise SnapshotNonValido(percorso + ": il file non è uno snapshot")
+        if versione != VERSIONE_SNAPSHOT:
+            self.chiudi()
+            raise SnapshotNonValido(percorso + ": versione dello snapshot non supportata: %d" % versione)
+        if INTESTAZIONE_SNAPSHOT.size + self.lunghezza != len(self.mappa):
+            self.chiudi()
+            raise SnapshotNonValido(percorso + ": snapshot troncato")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *eccezione):
+        self.chiudi()
+        return False
+
+    def chiudi(self):
+        self.mappa.close()
+        self.file.close()
+
+    def verifica_integrita(self):
+        # Controlla che il contenuto corrisponda al digest dell'intestazione (file danneggiato o incompleto).
+        vista = memoryview(self.mappa)[INTESTAZIONE_SNAPSHOT.size:]
+        try:
+            return hashlib.sha512(vista).digest() == self.digest
+        finally:
+            vista.release()
+
+    def lotti(self, dimensione_lotto = DIMENSIONE_LOTTO_SNAPSHOT):
+        """Restituisce i blocchi dello snapshot a lotti di righe binarie (ordine di COLONNE). Controlla che i blocchi
+           siano consecutivi a partire dal blocco 1, che ognuno sia collegato al precedente tramite prev_hash e che
+           l'ultimo abbia altezza e hash dell'intestazione; altrimenti solleva SnapshotNonValido, anche dopo aver già
+           restituito dei lotti (chi importa deve poter annullare l'importazione)."""
+        posizione = INTESTAZIONE_SNAPSHOT.size
+        id_precedente, hash_precedente = 0, bytes.fromhex(PREV_HASH_GENESI)
+        lotto = []
+
+        while posizione < len(self.mappa):
+            try:
+                riga, posizione = decodifica_riga(self.mappa, posizione)
+            except ValueError as e:
+                raise SnapshotNonValido("blocco %d: %s" % (id_precedente + 1, e))
+
+            if len(riga) != 8:
+                raise SnapshotNonValido("blocco %d senza contenuto (solo header)" % riga[0])
+            if riga[0] != id_precedente + 1 or riga[1] != hash_precedente:
+                raise SnapshotNonValido("blocco %d non collegato al blocco %d" % (riga[0], id_precedente))
+            id_precedente, hash_precedente = riga[0], riga[6]
+
+            lotto.append(riga)
+            if len(lotto) == dimensione_lotto:
+                yield lotto
+                lotto = []
+
+        if lotto:
+            yield lotto
+
+        if id_precedente != self.altezza or hash_precedente.hex() != self.hash:
+            raise SnapshotNonValido("l'ultimo blocco (%d) non corrisponde all'intestazione dello snapshot" % id_precedente)
@@ -0,0 +1,233 @@
+import json
+import time
+import sqlite3
+import hashlib
+import collections
+import multiprocessing
+
+from Minatore import serializza_blocco
+from Merkle import radice_merkle_blocco
+from Codifica import timestamp_binario, timestamp_testo, digest_binario, digest_testo
+
+
+# Colonne lette dalla tabella blockchain, nell'ordine atteso da blocco_da_riga.
+COLONNE = "id, prev_hash, type, timestamp, data, nonce, hash, merkle_root"
+
+# Colonne dell'header di un blocco (tutti i campi tranne "data"), salvate dai nodi leggeri e inviate a lotti.
+COLONNE_HEADER = "id, prev_hash, type, timestamp, merkle_root, nonce, hash"
+
+# prev_hash del primo blocco della catena.
+PREV_HASH_GENESI = "0"*128
+
+
+def blocco_da_riga(riga):
+    """Converte una riga della tabella blockchain (o la lista equivalente ricevuta da un peer) nel blocco
+       originale su cui è stata calcolata la proof-of-work: gli hash sono salvati in binario (64 byte), il timestamp
+       come intero (vedi Codifica) e "data" come JSON ("data" è None nei blocchi potati, vedi Blockchain.pota)."""
+    id, prev_hash, type, timestamp, data, nonce, hash, merkle_root = riga
+    return {
+        "id"         : int(id),
+        "prev_hash"  : digest_testo(prev_hash),
+        "type"       : type,
+        "timestamp"  : timestamp_testo(timestamp),
+        "data"       : json.loads(data) if data != None else None,
+        "nonce"      : int(nonce),
+        "hash"       : digest_testo(hash),
+        "merkle_root": digest_testo(merkle_root)
+    }
+
+
+def riga_da_blocco(blocco):
+    # Converte un blocco nella riga (lista nell'ordine di COLONNE) salvata nella tabella e inviata agli altri nodi.
+    return [ blocco["id"],
+             digest_binario(blocco["prev_hash"]),
+             blocco["type"],
+             timestamp_binario(blocco["timestamp"]),
+             json.dumps(blocco["data"], sort_keys=True),
+             int(blocco["nonce"]),
+             digest_binario(blocco["hash"]),
+             digest_binario(blocco["merkle_root"]) ]
+
+
+def header_da_riga(riga):
+    # Converte una riga di header (lista nell'ordine di COLONNE_HEADER) nel dizionario su cui è calcolata la proof-of-work.
+    id, prev_hash, type, timestamp, merkle_root, nonce, hash = riga
+    return {
+        "id"         : int(id),
+        "prev_hash"  : digest_testo(prev_hash),
+        "type"       : type,
+        "timestamp"  : timestamp_testo(timestamp),
+        "merkle_root": digest_testo(merkle_root),
+        "nonce"      : int(nonce),
+        "hash"       : digest_testo(hash)
+    }
+
+
+def riga_header_da_riga(riga):
+    # Estrae da una riga della tabella blockchain (ordine di COLONNE) la riga del suo header (ordine di COLONNE_HEADER).
+    id, prev_hash, type, timestamp, data, nonce, hash, merkle_root = riga
+    return [id, prev_hash, type, timestamp, merkle_root, nonce, hash]
+
+
+def controlla_blocco(blocco, difficolta):
+    # Controlla radice di Merkle, hash e proof-of-work del blocco. Restituisce None se il blocco è valido, altrimenti il motivo.
+    if blocco["data"] == None:
+        return "blocco senza contenuto"
+
+    try:
+        if radice_merkle_blocco(blocco["type"], blocco["data"]) != blocco["merkle_root"]:
+            return "merkle_root non corrispondente alle transazioni del blocco"
+    except ValueError as e:
+        return str(e)
+
+    return controlla_header(blocco, difficolta)
+
+
+def controlla_header(blocco, difficolta):
+    """Controlla hash e proof-of-work dell'header, senza il contenuto del blocco (es. nei nodi leggeri, che conoscono
+       solo la radice di Merkle). Restituisce None se l'header è valido, altrimenti il motivo."""
+    if hashlib.sha512( serializza_blocco(blocco) ).hexdigest() != blocco["hash"]:
+        return "hash non corrispondente all'header del blocco"
+
+    if not blocco["hash"].startswith("0"*difficolta):
+        return "proof-of-work non soddisfatta (difficoltà %d)" % difficolta
+
+    return None
+
+
+def controlla_collegamento(blocco, precedente):
+    # Controlla che il blocco segua il precedente (None per il primo blocco). Restituisce None oppure il motivo.
+    if precedente == None:
+        if blocco["id"] != 1 or blocco["prev_hash"] != PREV_HASH_GENESI:
+            return "blocco iniziale non valido"
+
+    elif blocco["id"] != precedente["id"] + 1:
+        return "id %d non consecutivo al blocco %d" % (blocco["id"], precedente["id"])
+
+    elif blocco["prev_hash"] != precedente["hash"]:
+        return "prev_hash diverso dall'hash del blocco %d" % precedente["id"]
+
+    return None
+
+
+def _verifica_lotto(righe, difficolta):
+    """Verifica hash e proof-of-work di un lotto di righe. Viene eseguita nei processi del pool e restituisce
+       solo quanto serve per controllare il collegamento tra i blocchi: (id, prev_hash, hash, errore).
+       Dei blocchi potati, senza contenuto, si controlla solo l'header."""
+    esito = []
+    for riga in righe:
+        try:
+            blocco = blocco_da_riga(riga)
+            errore = controlla_blocco(blocco, difficolta) if blocco["data"] != None else controlla_header(blocco, difficolta)
+        except (ValueError, TypeError, AttributeError) as e:
+            prev_hash, hash = [ v.hex() if isinstance(v, bytes) else v for v in (riga[1], riga[6]) ]
+            blocco = {"id": riga[0], "prev_hash": prev_hash, "hash": hash}
+            errore = "riga non decodificabile: " + str(e)
+        esito.append( (blocco["id"], blocco["prev_hash"], blocco["hash"], errore) )
+    return esito
+
+
+class Validatore:
+    """La classe "Validatore" controlla i blocchi della blockchain: il collegamento tramite prev_hash, la radice di
+       Merkle delle transazioni, il ricalcolo dell'hash e il raggiungimento della difficoltà della proof-of-work. Oltre al controllo del singolo blocco
+       permette di verificare un intero database (o un intervallo di id) leggendo le righe a lotti e calcolando
+       gli hash in un pool di processi."""
+
+    def __init__(self, difficolta = 5, workers = None, dimensione_lotto = 2048):
+        """difficolta: Il numero di zeri esadecimali richiesti all'hash dei blocchi.
+           workers: Il numero di processi usati dalla verifica completa (default: il numero di core).
+           dimensione_lotto: Il numero di righe lette dal database e inviate a un processo per volta."""
+        self.difficolta = difficolta
+        self.workers = workers if workers != None else (multiprocessing.cpu_count() or 1)
+        self.dimensione_lotto = dimensione_lotto
+
+        # Il motivo dell'ultimo rifiuto di verifica_blocco.
+        self.errore = None
+
+    def verifica_blocco(self, blocco, precedente):
+        """Verifica un singolo blocco rispetto al blocco che lo precede nella catena (None se è il primo).
+           Restituisce True se il blocco è valido, altrimenti False e il motivo è salvato in self.errore."""
+        try:
+            self.errore = controlla_collegamento(blocco, precedente) or controlla_blocco(blocco, self.difficolta)
+        except (KeyError, TypeError) as e:
+            self.errore = "blocco incompleto: " + str(e)
+
+        return self.errore == None
+
+    def _leggi_lotti(self, cursore):
+        # Legge le righe selezionate a lotti, senza caricare l'intera tabella in memoria.
+        while True:
+            righe = cursore.fetchmany(self.dimensione_lotto)
+            if not righe:
+                return
+            yield righe
+
+    def verifica_catena(self, percorso = 'blockchain.db', da = None, a = None):
+        """Verifica tutti i blocchi del database "percorso" con id compreso tra "da" e "a" (estremi inclusi, None per
+           non limitare l'intervallo). Restituisce un dizionario con il numero di blocchi verificati, l'elenco degli
+           errori come coppie (id, motivo), l'esito complessivo e il tempo impiegato."""
+        db = sqlite3.connect(percorso)
+        c = db.cursor()
+
+        da = 1 if da == None else max(1, da)
+        a = -1 if a == None else a
+
+        riga_precedente = c.execute("SELECT " + COLONNE + " FROM blockchain WHERE id=?", (da - 1,)).fetchone() if da > 1 else None
+        c.execute("SELECT " + COLONNE + " FROM blockchain WHERE id >= ? AND (? < 0 OR id <= ?) ORDER BY id", (da, a, a))
+        esito = self.verifica_lotti(self._leggi_lotti(c), da, riga_precedente)
+
+        db.close()
+        return esito
+
+    def verifica_lotti(self, lotti, da = 1, riga_precedente = None):
+        """Verifica i blocchi contenuti in "lotti" (liste di righe nell'ordine di COLONNE, consecutive a partire
+           dall'id "da"), letti da qualsiasi archivio. riga_precedente è la riga del blocco "da" - 1, con cui viene
+           controllato il collegamento del primo blocco. Restituisce il risultato descritto in verifica_catena."""
+        inizio = time.perf_counter()
+
+        # Il collegamento del primo blocco dell'intervallo è verificato con il blocco precedente
+        precedente = None
+        if riga_precedente != None:
+            precedente = {"id": riga_precedente[0], "hash": digest_testo(riga_precedente[6])}
+
+        errori = []
+        blocchi = 0
+        for esito in self._verifica_lotti(lotti):
+            for id, prev_hash, hash, errore in esito:
+                blocco = {"id": id, "prev_hash": prev_hash, "hash": hash}
+
+                if precedente != None or da == 1:
+                    collegamento = controlla_collegamento(blocco, precedente)
+                    if collegamento != None:
+                        errori.append( (id, collegamento) )
+
+                if errore != None:
+                    errori.append( (id, errore) )
+
+                precedente = blocco
+                blocchi += 1
+
+        return {
+            "valida": len(errori) == 0,
+            "blocchi": blocchi,
+            "errori": errori,
+            "secondi": time.perf_counter() - inizio
+        }
+
+    def _verifica_lotti(self, lotti):
+        """Distribuisce i lotti tra i processi del pool e restituisce i risultati nell'ordine di lettura.
+           Al massimo 2 lotti per worker sono in attesa, così la memoria usata non dipende dalla lunghezza della catena."""
+        if self.workers <= 1:
+            for righe in lotti:
+                yield _verifica_lotto(righe, self.difficolta)
+            return
+
+        with multiprocessing.Pool(self.workers) as pool:
+            in_corso = collections.deque()
+            for righe in lotti:
+                in_corso.append( pool.apply_async(_verifica_lotto, (righe, self.difficolta)) )
+                if len(in_corso) >= 2*self.workers:
+                    yield in_corso.popleft().get()
+
+            while in_corso:
+                yield in_corso.popleft().get()
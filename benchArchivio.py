@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+from Archivio import apri_archivio, ARCHIVI
+from Minatore import calcola_hash
+from Validatore import PREV_HASH_GENESI, riga_da_blocco
+from Merkle import radice_merkle_blocco
+from Codifica import timestamp_intero
+
+
+# Benchmark degli archivi dei blocchi (vedi Archivio): velocità di inserimento, latenza delle letture casuali per id e
+# per hash, lettura sequenziale di tutta la catena, ricerca dei blocchi di un tipo in un'ora (con gli indici e
+# filtrando la lettura sequenziale) e spazio occupato su disco. I blocchi sono generati con difficoltà 0, uno al
+# secondo e di TIPI tipi diversi.
+# Uso: python benchArchivio.py [blocchi] [letture]
+
+BLOCCHI = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+LETTURE = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+LOTTO = 500
+TIPI = 4
+INIZIO = datetime(2022, 3, 16)
+
+
+def genera_righe(n):
+    # Genera n righe valide e collegate, nel formato della tabella blockchain.
+    prev_hash = PREV_HASH_GENESI
+    for i in range(1, n + 1):
+        blocco = {"id": i, "prev_hash": prev_hash, "type": "transazione%d" % (i % TIPI), "timestamp": (INIZIO + timedelta(seconds=i)).isoformat(),
+                  "data": {"i": i}, "nonce": 0}
+        blocco["merkle_root"] = radice_merkle_blocco(blocco["type"], blocco["data"])
+        blocco["hash"] = calcola_hash(blocco)
+        prev_hash = blocco["hash"]
+        yield riga_da_blocco(blocco)
+
+
+def inserisci(transazione, righe):
+    transazione.inserisci_righe(righe)
+
+
+def percentile(valori, p):
+    return valori[min(len(valori) - 1, int(len(valori) * p))]
+
+
+def latenze(funzione, chiavi):
+    # Restituisce le latenze ordinate (in microsecondi) di funzione(chiave) per ogni chiave.
+    tempi = []
+    for chiave in chiavi:
+        inizio = time.perf_counter()
+        assert funzione(chiave) != None
+        tempi.append((time.perf_counter() - inizio) * 1e6)
+    tempi.sort()
+    return tempi
+
+
+def misura(tipo, directory, righe):
+    archivio = apri_archivio(tipo, os.path.join(directory, tipo))
+    try:
+        inizio = time.perf_counter()
+        futuri = [ archivio.esegui(inserisci, righe[i:i + LOTTO], peso = LOTTO) for i in range(0, len(righe), LOTTO) ]
+        for futuro in futuri:
+            futuro.result()
+        inserimento = time.perf_counter() - inizio
+
+        casuali = random.Random(1)
+        ids = [ casuali.randint(1, len(righe)) for _ in range(LETTURE) ]
+        per_id = latenze(archivio.leggi, ids)
+        per_hash = latenze(archivio.leggi_da_hash, [ righe[i - 1][6] for i in ids ])
+
+        inizio = time.perf_counter()
+        letti = sum( len(lotto) for lotto in archivio.leggi_blocchi(1) )
+        sequenziale = time.perf_counter() - inizio
+        assert letti == len(righe)
+
+        # I blocchi "transazione1" dell'ultima ora della catena, a pagine di LOTTO
+        da, a = timestamp_intero(INIZIO + timedelta(seconds=len(righe) - 3600)), timestamp_intero(INIZIO + timedelta(seconds=len(righe)))
+        inizio = time.perf_counter()
+        trovati, dopo = 0, None
+        while True:
+            pagina = archivio.cerca("transazione1", da, a, dopo, LOTTO)
+            trovati += len(pagina)
+            if len(pagina) < LOTTO:
+                break
+            dopo = (pagina[-1][3], pagina[-1][0])
+        ricerca = time.perf_counter() - inizio
+
+        inizio = time.perf_counter()
+        filtrati = sum( 1 for lotto in archivio.leggi_blocchi(1) for r in lotto if r[2] == "transazione1" and da <= r[3] <= a )
+        filtro = time.perf_counter() - inizio
+        assert trovati == filtrati
+
+        return {"blocchi/s": len(righe) / inserimento,
+                "id p50 us": percentile(per_id, 0.5), "id p99 us": percentile(per_id, 0.99),
+                "hash p50 us": percentile(per_hash, 0.5), "hash p99 us": percentile(per_hash, 0.99),
+                "scansione s": sequenziale, "ricerca ms": ricerca * 1e3, "filtro ms": filtro * 1e3,
+                "byte/blocco": archivio.dimensione() / len(righe)}
+    finally:
+        archivio.chiudi()
+
+
+directory = tempfile.mkdtemp()
+try:
+    righe = list(genera_righe(BLOCCHI))
+    risultati = { tipo: misura(tipo, directory, righe) for tipo in ARCHIVI }
+
+    print("%-16s" % ("%d blocchi" % BLOCCHI) + "".join( "%12s" % tipo for tipo in ARCHIVI ))
+    for voce in risultati[ARCHIVI[0]]:
+        print("%-16s" % voce + "".join( "%12.2f" % risultati[tipo][voce] for tipo in ARCHIVI ))
+
+finally:
+    shutil.rmtree(directory, ignore_errors=True)
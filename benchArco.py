@@ -0,0 +1,69 @@
+import sys
+import time
+import threading
+
+from Nodo import Nodo
+
+
+# Benchmark di una connessione tra due nodi su loopback: latenza per hop (metà del tempo di andata e ritorno
+# di un messaggio) e messaggi al secondo sostenuti. Uso: python benchArco.py [round_trip] [messaggi]
+
+ROUND_TRIP = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+MESSAGGI = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+
+class NodoBench(Nodo):
+
+    def __init__(self, host, porta, id = None):
+        super(NodoBench, self).__init__(host, porta, id)
+        self.ricevuti = 0
+        self.attesi = 0
+        self.completato = threading.Event()
+
+    def node_message(self, node, data):
+        if isinstance(data, dict) and "ping" in data: # Risponde subito al ping
+            node.send({"pong": data["ping"]})
+            return
+
+        self.ricevuti += 1
+        if self.ricevuti >= self.attesi or (isinstance(data, dict) and "pong" in data):
+            self.completato.set()
+
+
+a = NodoBench("127.0.0.1", 50101, "A")
+b = NodoBench("127.0.0.1", 50102, "B")
+a.start()
+b.start()
+a.connect_with_node("127.0.0.1", 50102)
+
+while len(a.nodes_outbound) == 0 or len(b.nodes_inbound) == 0:
+    time.sleep(0.01)
+
+connessione = a.nodes_outbound[0]
+
+# Latenza per hop
+latenze = []
+for i in range(ROUND_TRIP):
+    a.completato.clear()
+    a.attesi = a.ricevuti + 1
+    inizio = time.perf_counter()
+    connessione.send({"ping": i})
+    a.completato.wait(30)
+    latenze.append( (time.perf_counter() - inizio) / 2 )
+
+latenze.sort()
+print("Latenza per hop su %d round trip: media %.3f ms, p50 %.3f ms, p99 %.3f ms" % (ROUND_TRIP,
+      1000*sum(latenze)/len(latenze), 1000*latenze[len(latenze)//2], 1000*latenze[int(len(latenze)*0.99)]))
+
+# Messaggi al secondo
+b.completato.clear()
+b.attesi = b.ricevuti + MESSAGGI
+inizio = time.perf_counter()
+for i in range(MESSAGGI):
+    connessione.send("messaggio %d" % i)
+b.completato.wait(600)
+secondi = time.perf_counter() - inizio
+print("Throughput: %d messaggi in %.2f s (%.0f messaggi/s)" % (MESSAGGI, secondi, MESSAGGI / secondi))
+
+a.stop()
+b.stop()
@@ -0,0 +1,398 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+from Nodo import Nodo
+from NodoBlockchain import NodoBlockchain
+
+
+# Benchmark di un cluster di nodi su loopback. Ogni nodo è un processo separato (con la propria porta su 127.0.0.1 e,
+# per il carico "blocchi", il proprio database in una directory temporanea), così CPU e memoria sono misurate per nodo.
+# I nodi vengono collegati secondo la topologia scelta (linea, stella, maglia casuale) e a ogni round un nodo scelto a
+# caso origina un messaggio: con il carico "blocchi" mina un blocco con alcune transazioni e lo annuncia, con il carico
+# "gossip" diffonde un messaggio di prova. Il round successivo inizia quando tutti i nodi hanno ricevuto il messaggio.
+#
+# I risultati (latenza di propagazione, messaggi al secondo, byte inviati, CPU e RSS di ogni nodo) sono scritti in JSON,
+# su stdout o nel file indicato con --output; con --confronta si confrontano con quelli di un'esecuzione precedente.
+# Uso: python benchCluster.py [--nodi 8] [--topologia maglia] [--carico blocchi] [--round 50] [--output risultati.json]
+
+HOST = "127.0.0.1"
+TOPOLOGIE = ("linea", "stella", "maglia")
+CARICHI = ("blocchi", "gossip")
+
+
+class NodoBlockchainBench(NodoBlockchain):
+    # NodoBlockchain che comunica al processo principale l'istante in cui riceve o annuncia ogni blocco.
+
+    def __init__(self, host, porta, id, percorso, difficolta, notifiche):
+        super(NodoBlockchainBench, self).__init__(host, porta, id, percorso = percorso, difficolta = difficolta)
+        self.notifiche = notifiche
+
+    def origina(self, numero, transazioni):
+        # Mina e annuncia un blocco con "transazioni" transazioni nuove. Restituisce l'id del blocco, oppure None.
+        for i in range(transazioni):
+            self.mempool.aggiungi({"da": self.id, "a": "nodo%d" % i, "importo": i, "round": numero})
+        blocco = self.mina_blocco(workers = 1)
+        return blocco["id"] if blocco != None else None
+
+    def annuncia_blocco(self, blocco):
+        self.notifiche.put( (self.id, blocco["id"], time.monotonic(), True) )
+        return super(NodoBlockchainBench, self).annuncia_blocco(blocco)
+
+    def ricevi_blocchi(self, node, righe):
+        esito = super(NodoBlockchainBench, self).ricevi_blocchi(node, righe)
+        adesso = time.monotonic()
+        for riga in esito["righe_inserite"]:
+            self.notifiche.put( (self.id, riga[0], adesso, False) )
+        return esito
+
+
+class NodoGossipBench(Nodo):
+    # Nodo che diffonde messaggi di prova con gossip e comunica al processo principale l'istante in cui li riceve.
+
+    def __init__(self, host, porta, id, dimensione, notifiche):
+        super(NodoGossipBench, self).__init__(host, porta, id)
+        self.carico = "x" * dimensione
+        self.notifiche = notifiche
+
+    def origina(self, numero, transazioni):
+        self.notifiche.put( (self.id, numero, time.monotonic(), True) )
+        self.gossip({"sonda": numero, "carico": self.carico})
+        return numero
+
+    def node_message(self, node, data):
+        if isinstance(data, dict) and "sonda" in data:
+            self.notifiche.put( (self.id, data["sonda"], time.monotonic(), False) )
+
+
+def statistiche_processo():
+    # CPU (utente + sistema, secondi) e memoria del processo: RSS attuale da /proc (se disponibile) e RSS massimo.
+    uso = resource.getrusage(resource.RUSAGE_SELF)
+    rss = None
+    try:
+        with open("/proc/self/statm") as statm:
+            rss = int(statm.read().split()[1]) * resource.getpagesize() // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return {"cpu_s": uso.ru_utime + uso.ru_stime, "rss_kb": rss, "rss_max_kb": uso.ru_maxrss}
+
+def statistiche_nodo(nodo):
+    statistiche = statistiche_processo()
+    statistiche.update({
+        "messaggi_inviati": nodo.message_count_inviati,
+        "messaggi_ricevuti": nodo.message_count_ricevuti,
+        "byte_inviati": nodo.byte_inviati,
+        "connessioni": len(nodo.all_nodes()),
+        "gossip": nodo.statistiche_gossip()
+    })
+    return statistiche
+
+
+def esegui_nodo(indice, opzioni, canale, notifiche):
+    """Processo di un nodo: crea e avvia il nodo, poi esegue i comandi ricevuti dal processo principale sul canale e
+       risponde a ognuno. Le stampe dei nodi sono scartate per non mescolarle ai risultati."""
+    sys.stdout = open(os.devnull, "w")
+
+    id = "nodo%d" % indice
+    porta = opzioni["porta_base"] + indice
+    if opzioni["carico"] == "blocchi":
+        nodo = NodoBlockchainBench(HOST, porta, id, os.path.join(opzioni["directory"], id + ".db"), opzioni["difficolta"], notifiche)
+    else:
+        nodo = NodoGossipBench(HOST, porta, id, opzioni["dimensione"], notifiche)
+    nodo.start()
+    canale.send(True)
+
+    while True:
+        comando, argomento = canale.recv()
+
+        if comando == "connetti":
+            canale.send([ nodo.connect_with_node(HOST, opzioni["porta_base"] + j, reconnect = False) for j in argomento ])
+
+        elif comando == "connessioni":
+            canale.send(len(nodo.all_nodes()))
+
+        elif comando == "origina":
+            canale.send(nodo.origina(argomento, opzioni["transazioni"]))
+
+        elif comando == "statistiche":
+            canale.send(statistiche_nodo(nodo))
+
+        elif comando == "ferma":
+            nodo.stop()
+            canale.send(True)
+            nodo.join()
+            return
+
+
+def archi_topologia(topologia, n, grado, generatore):
+    """Restituisce gli archi (i, j) della topologia: il nodo i apre la connessione verso j. La maglia casuale parte da
+       un albero casuale (quindi è connessa) e aggiunge archi a caso finché il grado medio non raggiunge "grado"."""
+    if topologia == "linea":
+        return [ (i, i + 1) for i in range(n - 1) ]
+
+    if topologia == "stella":
+        return [ (i, 0) for i in range(1, n) ]
+
+    archi = set( (i, generatore.randrange(i)) for i in range(1, n) )
+    possibili = n * (n - 1) // 2
+    while len(archi) < min(possibili, n * grado // 2):
+        i, j = generatore.sample(range(n), 2)
+        if (j, i) not in archi:
+            archi.add( (i, j) )
+    return sorted(archi)
+
+
+def percentili(valori):
+    # Media, percentili (nearest rank) e massimo dei valori, in millisecondi.
+    if not valori:
+        return None
+    valori = sorted(valori)
+    percentile = lambda p: valori[min(len(valori) - 1, int(len(valori) * p / 100))]
+    return {"n": len(valori), "media_ms": 1000 * sum(valori) / len(valori), "p50_ms": 1000 * percentile(50),
+            "p90_ms": 1000 * percentile(90), "p99_ms": 1000 * percentile(99), "max_ms": 1000 * valori[-1]}
+
+
+def attendi(condizione, timeout, intervallo = 0.01):
+    # Attende al massimo "timeout" secondi che condizione() sia vera. Restituisce l'ultimo valore di condizione().
+    scadenza = time.monotonic() + timeout
+    while not condizione() and time.monotonic() < scadenza:
+        time.sleep(intervallo)
+    return condizione()
+
+
+class Cluster:
+    # I processi dei nodi e i canali con cui il processo principale invia loro i comandi.
+
+    def __init__(self, opzioni):
+        self.opzioni = opzioni
+        self.contesto = multiprocessing.get_context("spawn")
+        self.notifiche = self.contesto.Queue()
+        self.canali = []
+        self.processi = []
+
+    def avvia(self):
+        for i in range(self.opzioni["nodi"]):
+            canale, canale_nodo = self.contesto.Pipe()
+            processo = self.contesto.Process(target=esegui_nodo, args=(i, self.opzioni, canale_nodo, self.notifiche), daemon=True)
+            processo.start()
+            self.canali.append(canale)
+            self.processi.append(processo)
+
+        for canale in self.canali:
+            canale.recv()
+
+    def comando(self, i, comando, argomento = None):
+        self.canali[i].send( (comando, argomento) )
+        return self.canali[i].recv()
+
+    def tutti(self, comando, argomento = None):
+        # Invia il comando a tutti i nodi insieme e restituisce le risposte in ordine.
+        for canale in self.canali:
+            canale.send( (comando, argomento) )
+        return [ canale.recv() for canale in self.canali ]
+
+    def collega(self, archi):
+        """Apre le connessioni degli archi, un nodo alla volta, e attende che entrambi i lati le abbiano registrate.
+           Restituisce False se qualche connessione non è stata stabilita."""
+        uscenti = {}
+        attese = [0] * len(self.canali)
+        for i, j in archi:
+            uscenti.setdefault(i, []).append(j)
+            attese[i] += 1
+            attese[j] += 1
+
+        for i, destinazioni in sorted(uscenti.items()):
+            if not all(self.comando(i, "connetti", destinazioni)):
+                return False
+
+        return attendi(lambda: self.tutti("connessioni") == attese, self.opzioni["timeout"], 0.05)
+
+    def ferma(self):
+        for canale in self.canali:
+            canale.send( ("ferma", None) )
+        for canale in self.canali:
+            canale.recv()
+        for processo in self.processi:
+            processo.join(15)
+            if processo.is_alive():
+                processo.terminate()
+
+
+def esegui_carico(cluster, opzioni, generatore):
+    """Esegue i round del carico e restituisce, per ogni round, gli istanti di origine e di arrivo del messaggio a ogni
+       nodo (monotonic, comuni a tutti i processi della macchina)."""
+    n = opzioni["nodi"]
+    esiti = []
+    for r in range(opzioni["round"]):
+        origine = generatore.randrange(n)
+        messaggio = cluster.comando(origine, "origina", r)
+        if messaggio == None:
+            print("round %d: il nodo %d non ha originato il messaggio" % (r, origine), file=sys.stderr)
+            continue
+
+        # Le notifiche arrivano da tutti i nodi: si attende quella di ogni nodo per questo messaggio
+        istanti = {}
+        partenza = None
+        scadenza = time.monotonic() + opzioni["timeout"]
+        while len(istanti) < n - 1 or partenza == None:
+            try:
+                id, numero, istante, originato = cluster.notifiche.get(timeout = max(0, scadenza - time.monotonic()))
+            except Exception:
+                break
+            if numero != messaggio:
+                continue
+            if originato:
+                partenza = istante
+            else:
+                istanti.setdefault(id, istante)
+
+        esiti.append({"origine": origine, "messaggio": messaggio, "partenza": partenza, "arrivi": istanti})
+        if opzioni["intervallo"]:
+            time.sleep(opzioni["intervallo"])
+
+    return esiti
+
+
+def differenza(contatori_fine, contatori_inizio):
+    # Differenza tra due statistiche dello stesso nodo per i valori che crescono durante il carico.
+    return { k: contatori_fine[k] - contatori_inizio[k] for k in ("cpu_s", "messaggi_inviati", "messaggi_ricevuti", "byte_inviati") }
+
+
+def benchmark(opzioni):
+    generatore = random.Random(opzioni["seme"])
+    archi = archi_topologia(opzioni["topologia"], opzioni["nodi"], opzioni["grado"], generatore)
+
+    opzioni["directory"] = tempfile.mkdtemp(prefix="benchCluster")
+    cluster = Cluster(opzioni)
+    try:
+        cluster.avvia()
+        if not cluster.collega(archi):
+            raise RuntimeError("impossibile collegare i nodi secondo la topologia " + opzioni["topologia"])
+
+        inizio_statistiche = cluster.tutti("statistiche")
+        inizio = time.monotonic()
+        esiti = esegui_carico(cluster, opzioni, generatore)
+        durata = time.monotonic() - inizio
+        fine_statistiche = cluster.tutti("statistiche")
+
+    finally:
+        cluster.ferma()
+        shutil.rmtree(opzioni["directory"], ignore_errors=True)
+        del opzioni["directory"]
+
+    latenze = []
+    completamenti = []
+    mancanti = 0
+    for r in esiti:
+        if r["partenza"] == None:
+            mancanti += opzioni["nodi"] - 1
+            continue
+        latenze.extend( t - r["partenza"] for t in r["arrivi"].values() )
+        mancanti += opzioni["nodi"] - 1 - len(r["arrivi"])
+        if len(r["arrivi"]) == opzioni["nodi"] - 1:
+            completamenti.append( max(r["arrivi"].values(), default=r["partenza"]) - r["partenza"] )
+
+    nodi = []
+    for i, (s_inizio, s_fine) in enumerate(zip(inizio_statistiche, fine_statistiche)):
+        nodo = {"indice": i, "rss_kb": s_fine["rss_kb"], "rss_max_kb": s_fine["rss_max_kb"], "connessioni": s_fine["connessioni"],
+                "gossip": s_fine["gossip"]}
+        nodo.update(differenza(s_fine, s_inizio))
+        nodi.append(nodo)
+
+    messaggi = sum( n["messaggi_ricevuti"] for n in nodi )
+    return {
+        "configurazione": dict(opzioni, archi=len(archi), python=sys.version.split()[0], cpu=os.cpu_count()),
+        "risultati": {
+            "durata_s": durata,
+            "round": len(esiti),
+            "latenza_propagazione": percentili(latenze),
+            "completamento_round": percentili(completamenti),
+            "arrivi_mancanti": mancanti,
+            "messaggi_ricevuti": messaggi,
+            "messaggi_al_secondo": messaggi / durata if durata else 0.0,
+            "byte_inviati": sum( n["byte_inviati"] for n in nodi ),
+            "cpu_s": sum( n["cpu_s"] for n in nodi ),
+            "rss_max_kb": max( n["rss_max_kb"] for n in nodi )
+        },
+        "nodi": nodi
+    }
+
+
+# Metriche confrontate con --confronta: percorso nei risultati e True se un valore più alto è un miglioramento.
+METRICHE_CONFRONTO = [
+    (("latenza_propagazione", "p50_ms"), False),
+    (("latenza_propagazione", "p99_ms"), False),
+    (("completamento_round", "p50_ms"), False),
+    (("messaggi_al_secondo",), True),
+    (("byte_inviati",), False),
+    (("cpu_s",), False),
+    (("rss_max_kb",), False)
+]
+
+def confronta(precedente, attuale):
+    # Stampa su stderr le metriche principali delle due esecuzioni e la variazione percentuale.
+    if precedente["configurazione"] != attuale["configurazione"]:
+        print("attenzione: le configurazioni delle due esecuzioni sono diverse", file=sys.stderr)
+
+    print("%-32s %14s %14s %9s" % ("metrica", "precedente", "attuale", "var."), file=sys.stderr)
+    for percorso, piu_alto_meglio in METRICHE_CONFRONTO:
+        valori = []
+        for risultati in (precedente["risultati"], attuale["risultati"]):
+            for chiave in percorso:
+                risultati = risultati.get(chiave) if risultati != None else None
+            valori.append(risultati)
+
+        if None in valori:
+            continue
+        variazione = 100 * (valori[1] - valori[0]) / valori[0] if valori[0] else 0.0
+        peggiorata = variazione < 0 if piu_alto_meglio else variazione > 0
+        print("%-32s %14.2f %14.2f %+8.1f%%%s" % (".".join(percorso), valori[0], valori[1], variazione, " *" if peggiorata else ""),
+              file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark di un cluster di nodi su loopback.")
+    parser.add_argument("--nodi", type=int, default=8, help="numero di nodi (default: 8)")
+    parser.add_argument("--topologia", choices=TOPOLOGIE, default="maglia", help="topologia (default: maglia)")
+    parser.add_argument("--grado", type=int, default=3, help="grado medio della maglia casuale (default: 3)")
+    parser.add_argument("--carico", choices=CARICHI, default="blocchi", help="messaggi originati a ogni round (default: blocchi)")
+    parser.add_argument("--round", type=int, default=50, help="numero di messaggi originati (default: 50)")
+    parser.add_argument("--transazioni", type=int, default=10, help="transazioni per blocco (default: 10)")
+    parser.add_argument("--dimensione", type=int, default=256, help="byte del messaggio di gossip (default: 256)")
+    parser.add_argument("--difficolta", type=int, default=1, help="difficoltà della proof-of-work (default: 1)")
+    parser.add_argument("--intervallo", type=float, default=0.0, help="pausa in secondi tra i round (default: 0)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="attesa massima in secondi per ogni round (default: 30)")
+    parser.add_argument("--porta-base", dest="porta_base", type=int, default=51000, help="porta del primo nodo (default: 51000)")
+    parser.add_argument("--seme", type=int, default=1, help="seme per topologia e scelta dei nodi (default: 1)")
+    parser.add_argument("--output", help="file JSON in cui scrivere i risultati (default: stdout)")
+    parser.add_argument("--confronta", help="file JSON di un'esecuzione precedente da confrontare con questa")
+    opzioni = vars(parser.parse_args())
+
+    output = opzioni.pop("output")
+    precedente = opzioni.pop("confronta")
+    if opzioni["nodi"] < 2:
+        parser.error("servono almeno 2 nodi")
+
+    risultati = benchmark(opzioni)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(risultati, f, indent=2)
+    else:
+        json.dump(risultati, sys.stdout, indent=2)
+        print()
+
+    if precedente:
+        with open(precedente) as f:
+            confronta(json.load(f), risultati)
+
+
+if __name__ == "__main__":
+    main()
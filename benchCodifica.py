@@ -0,0 +1,87 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import tempfile
+
+from Blockchain import Blockchain, INTESTAZIONE
+from Minatore import calcola_hash
+from Merkle import TIPO_TRANSAZIONI, radice_merkle_blocco
+from Validatore import PREV_HASH_GENESI, COLONNE, riga_da_blocco
+from Codifica import riga_testo, riga_da_testo, codifica_messaggio, decodifica_messaggio, MESSAGGIO_BLOCCHI
+
+
+# Benchmark del formato binario dei blocchi rispetto al formato testuale JSON: velocità di codifica e decodifica di
+# un lotto di sincronizzazione, byte per blocco trasmessi e byte per blocco nel database.
+# Uso: python benchCodifica.py [blocchi] [transazioni per blocco] [lotto]
+
+BLOCCHI = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+TRANSAZIONI = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+LOTTO = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+
+
+def genera_righe(n):
+    # Genera n righe binarie valide e collegate (difficoltà 0).
+    prev_hash = PREV_HASH_GENESI
+    for i in range(1, n + 1):
+        data = [ {"da": "utente%d" % (i % 97), "a": "utente%d" % (j % 89), "importo": i * j} for j in range(TRANSAZIONI) ]
+        blocco = {"id": i, "prev_hash": prev_hash, "type": TIPO_TRANSAZIONI, "timestamp": "2022-03-16T00:00:%02d.%06d" % (i % 60, i),
+                  "data": data, "nonce": i}
+        blocco["merkle_root"] = radice_merkle_blocco(blocco["type"], blocco["data"])
+        blocco["hash"] = calcola_hash(blocco)
+        prev_hash = blocco["hash"]
+        yield riga_da_blocco(blocco)
+
+
+def misura(funzione, ripetizioni):
+    inizio = time.perf_counter()
+    for _ in range(ripetizioni):
+        risultato = funzione()
+    return (time.perf_counter() - inizio) / ripetizioni, risultato
+
+
+def dimensione_database(percorso):
+    db = sqlite3.connect(percorso)
+    db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db.execute("VACUUM")
+    pagine = db.execute("PRAGMA page_count").fetchone()[0] * db.execute("PRAGMA page_size").fetchone()[0]
+    db.close()
+    return pagine
+
+
+righe = list(genera_righe(BLOCCHI))
+lotto = righe[:LOTTO]
+ripetizioni = max(1, 20000 // LOTTO)
+print("%d blocchi, %d transazioni per blocco, lotti di %d blocchi" % (BLOCCHI, TRANSAZIONI, LOTTO))
+
+# Codifica e decodifica di un lotto di sincronizzazione (come in invia_blocchi e node_message)
+binario = lambda: codifica_messaggio(MESSAGGIO_BLOCCHI, lotto)
+testo = lambda: json.dumps({"tipo": "sync_blocchi", "blocchi": [ riga_testo(r) for r in lotto ]}).encode("utf-8")
+t_cod_bin, messaggio_bin = misura(binario, ripetizioni)
+t_cod_json, messaggio_json = misura(testo, ripetizioni)
+t_dec_bin, _ = misura(lambda: decodifica_messaggio(messaggio_bin), ripetizioni)
+t_dec_json, _ = misura(lambda: [ riga_da_testo(r) for r in json.loads(messaggio_json)["blocchi"] ], ripetizioni)
+
+print("%10s %16s %16s %16s" % ("formato", "codifica us/bl", "decodifica us/bl", "byte/blocco rete"))
+print("%10s %16.2f %16.2f %16.1f" % ("binario", 1e6 * t_cod_bin / LOTTO, 1e6 * t_dec_bin / LOTTO, len(messaggio_bin) / LOTTO))
+print("%10s %16.2f %16.2f %16.1f" % ("json", 1e6 * t_cod_json / LOTTO, 1e6 * t_dec_json / LOTTO, len(messaggio_json) / LOTTO))
+
+# Occupazione su disco: tabella binaria di Blockchain e stessa tabella con le colonne testuali
+directory = tempfile.mkdtemp()
+bc = Blockchain(difficolta = 0, workers = 1, percorso = os.path.join(directory, 'binario.db'))
+for i in range(0, BLOCCHI, LOTTO):
+    assert bc.importa_blocchi(righe[i:i + LOTTO])["rifiutato"] == None
+bc.chiudi()
+
+db = sqlite3.connect(os.path.join(directory, 'testo.db'))
+db.execute("""CREATE TABLE blockchain(id INTEGER PRIMARY KEY AUTOINCREMENT, prev_hash TEXT, type TEXT, timestamp TEXT,
+              data TEXT, nonce TEXT, hash TEXT, merkle_root TEXT)""")
+db.execute("CREATE UNIQUE INDEX blockchain_hash ON blockchain(hash)")
+db.executemany("INSERT INTO blockchain (" + COLONNE + ") VALUES (" + ", ".join("?"*len(INTESTAZIONE)) + ")", [ riga_testo(r) for r in righe ])
+db.commit()
+db.close()
+
+print("%10s %16s" % ("formato", "byte/blocco disco"))
+print("%10s %16.1f" % ("binario", dimensione_database(os.path.join(directory, 'binario.db')) / BLOCCHI))
+print("%10s %16.1f" % ("json", dimensione_database(os.path.join(directory, 'testo.db')) / BLOCCHI))
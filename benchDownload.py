@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from Blockchain import Blockchain
+from Simulazione import ReteSimulata
+from NodoBlockchain import NodoBlockchainSimulato
+from Minatore import calcola_hash
+from Validatore import PREV_HASH_GENESI, riga_da_blocco
+from Merkle import radice_merkle_blocco
+
+
+# Benchmark della sincronizzazione iniziale di un nodo nuovo sulla rete simulata (vedi Simulazione), con la banda in
+# uscita di ogni nodo limitata: condividi_db (tutti i blocchi da un solo nodo) e scarica_blocchi (header dal nodo più
+# avanti, poi i blocchi a intervalli richiesti in parallelo, vedi GestoreDownload) con un numero crescente di nodi che
+# hanno già la catena. Ogni blocco contiene DIMENSIONE byte di dati, oltre all'header di circa 250 byte. I secondi sono
+# quelli simulati, limitati dalla banda; l'importazione dei blocchi non li consuma.
+# Uso: python benchDownload.py [blocchi] [banda in MB/s] [byte di dati per blocco]
+
+BLOCCHI = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+BANDA = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+DIMENSIONE = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+SORGENTI = (1, 2, 4, 8)
+LATENZA = 0.02
+HOST = "10.0.0.1"
+
+
+def genera_righe(n):
+    # Genera n righe valide e collegate, nel formato della tabella blockchain.
+    prev_hash = PREV_HASH_GENESI
+    carico = "x" * DIMENSIONE
+    for i in range(1, n + 1):
+        blocco = {"id": i, "prev_hash": prev_hash, "type": "transazione", "timestamp": "2022-03-16T00:00:00",
+                  "data": {"i": i, "carico": carico}, "nonce": 0}
+        blocco["merkle_root"] = radice_merkle_blocco(blocco["type"], blocco["data"])
+        blocco["hash"] = calcola_hash(blocco)
+        prev_hash = blocco["hash"]
+        yield riga_da_blocco(blocco)
+
+
+def sincronizza(directory, sorgenti, parallelo):
+    # Avvia un nodo vuoto collegato a "sorgenti" nodi con la catena completa. Restituisce (secondi simulati, secondi reali).
+    rete = ReteSimulata(latenza = LATENZA, banda = BANDA * 1e6)
+    nodi = []
+    for i in range(sorgenti):
+        percorso = os.path.join(directory, "s%d-%d-%d.db" % (sorgenti, parallelo, i))
+        for suffisso in ("", "-wal"): # Le ultime scritture possono essere ancora nel WAL
+            if os.path.exists(os.path.join(directory, "catena.db" + suffisso)):
+                shutil.copy(os.path.join(directory, "catena.db" + suffisso), percorso + suffisso)
+        nodi.append(NodoBlockchainSimulato(HOST, 1000 + i, "s%d" % i, rete, percorso = percorso, difficolta = 0))
+    nuovo = NodoBlockchainSimulato(HOST, 999, "nuovo", rete, percorso = os.path.join(directory, "n%d-%d.db" % (sorgenti, parallelo)), difficolta = 0)
+    for nodo in nodi + [nuovo]:
+        nodo.start()
+    for nodo in nodi:
+        nuovo.connect_with_node(HOST, nodo.porta)
+
+    inizio, reale = rete.simulatore.adesso, time.perf_counter()
+    if parallelo:
+        futuro = nuovo.scarica_blocchi()
+        rete.simulatore.esegui(condizione = futuro.done)
+        assert futuro.result()["completo"], futuro.result()
+    else:
+        nuovo.condividi_db("s0")
+        rete.simulatore.esegui(condizione = lambda: nuovo.blockchain.restituisci_punta()[0] == BLOCCHI)
+    durata, reale = rete.simulatore.adesso - inizio, time.perf_counter() - reale
+    assert nuovo.blockchain.restituisci_punta()[0] == BLOCCHI, nuovo.blockchain.restituisci_punta()
+
+    for nodo in nodi + [nuovo]:
+        nodo.stop()
+        nodo.blockchain.chiudi()
+    return durata, reale
+
+
+if __name__ == "__main__":
+    directory = tempfile.mkdtemp()
+    try:
+        sorgente = Blockchain(difficolta = 0, workers = 1, percorso = os.path.join(directory, "catena.db"))
+        righe = list(genera_righe(BLOCCHI))
+        for i in range(0, len(righe), 500):
+            assert sorgente.importa_blocchi(righe[i:i + 500])["rifiutato"] == None
+        sorgente.chiudi()
+
+        print("%d blocchi da %d byte di dati, banda %.1f MB/s per nodo" % (BLOCCHI, DIMENSIONE, BANDA))
+        print("%-28s %12s %12s %12s" % ("", "s simulati", "blocchi/s", "s reali"))
+        durata, reale = sincronizza(directory, 1, False)
+        print("%-28s %12.2f %12.0f %12.2f" % ("condividi_db, 1 nodo", durata, BLOCCHI / durata, reale))
+        for sorgenti in SORGENTI:
+            durata, reale = sincronizza(directory, sorgenti, True)
+            print("%-28s %12.2f %12.0f %12.2f" % ("scarica_blocchi, %d nodi" % sorgenti, durata, BLOCCHI / durata, reale))
+
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+import json
+import tempfile
+
+from Blockchain import Blockchain
+from Minatore import calcola_hash
+from Validatore import PREV_HASH_GENESI, riga_da_blocco
+from Merkle import radice_merkle_blocco
+
+
+# Benchmark dell'importazione dei blocchi ricevuti dai nodi: costo per blocco man mano che la catena cresce.
+# I blocchi sono generati con difficoltà 0 per misurare solo l'importazione. Uso: python benchIngest.py [blocchi] [lotto]
+
+BLOCCHI = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+LOTTO = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+FINESTRA = max(1, BLOCCHI // 10)
+
+
+def genera_righe(n):
+    # Genera n righe valide e collegate, nel formato della tabella blockchain.
+    prev_hash = PREV_HASH_GENESI
+    for i in range(1, n + 1):
+        blocco = {"id": i, "prev_hash": prev_hash, "type": "transazione", "timestamp": "2022-03-16T00:00:00", "data": {"i": i}, "nonce": 0}
+        blocco["merkle_root"] = radice_merkle_blocco(blocco["type"], blocco["data"])
+        blocco["hash"] = calcola_hash(blocco)
+        prev_hash = blocco["hash"]
+        yield riga_da_blocco(blocco)
+
+
+directory = tempfile.mkdtemp()
+bc = Blockchain(difficolta = 0, workers = 1, percorso = os.path.join(directory, 'blockchain.db'))
+
+righe = list(genera_righe(BLOCCHI))
+
+print("Importazione di %d blocchi a lotti di %d" % (BLOCCHI, LOTTO))
+print("%12s %16s" % ("blocchi", "us/blocco"))
+inizio_finestra = time.perf_counter()
+inizio = inizio_finestra
+for i in range(0, BLOCCHI, LOTTO):
+    esito = bc.importa_blocchi(righe[i:i + LOTTO])
+    assert esito["rifiutato"] == None, esito
+
+    if (i + LOTTO) % FINESTRA == 0 or i + LOTTO >= BLOCCHI:
+        fine = time.perf_counter()
+        print("%12d %16.1f" % (min(i + LOTTO, BLOCCHI), 1e6 * (fine - inizio_finestra) / FINESTRA))
+        inizio_finestra = fine
+
+print("Totale: %.2f s (%.0f blocchi/s)" % (time.perf_counter() - inizio, BLOCCHI / (time.perf_counter() - inizio)))
+
+# Reimportazione: tutti i blocchi sono duplicati
+inizio = time.perf_counter()
+for i in range(0, BLOCCHI, LOTTO):
+    bc.importa_blocchi(righe[i:i + LOTTO])
+print("Duplicati: %.1f us/blocco" % (1e6 * (time.perf_counter() - inizio) / BLOCCHI))
@@ -0,0 +1,43 @@
+import os
+import sys
+import time
+import tempfile
+
+from Blockchain import Blockchain
+from Mempool import Mempool
+
+
+# Benchmark del throughput in transazioni al secondo al variare del numero di transazioni per blocco.
+# Ogni blocco richiede una proof-of-work sull'header, indipendente dal numero di transazioni che contiene.
+# Uso: python benchMempool.py [difficoltà] [blocchi per misura] [workers]
+
+DIFFICOLTA = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+BLOCCHI = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+WORKERS = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+DIMENSIONI = (1, 10, 100, 1000, 5000)
+
+
+print("Difficoltà %d, %d blocchi per misura, %d workers" % (DIFFICOLTA, BLOCCHI, WORKERS))
+print("%14s %14s %14s" % ("tx/blocco", "s/blocco", "tx/s"))
+
+for dimensione in DIMENSIONI:
+    bc = Blockchain(DIFFICOLTA, WORKERS, percorso = os.path.join(tempfile.mkdtemp(), 'blockchain.db'))
+    mempool = Mempool()
+    for i in range(dimensione * BLOCCHI):
+        mempool.aggiungi({"da": "utente%d" % (i % 97), "a": "utente%d" % (i % 89), "importo": i})
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w') # crea_blocco stampa l'ultimo blocco e le statistiche della PoW
+    inizio = time.perf_counter()
+    confermate = 0
+    while len(mempool) > 0:
+        selezionate = mempool.estrai(dimensione)
+        blocco = bc.crea_blocco_transazioni([ t for _, t in selezionate ])
+        assert bc.aggiungi_blocco(blocco)
+        mempool.rimuovi([ h for h, _ in selezionate ])
+        confermate += len(selezionate)
+    secondi = time.perf_counter() - inizio
+    sys.stdout = stdout
+
+    print("%14d %14.3f %14.0f" % (dimensione, secondi / BLOCCHI, confermate / secondi))
+    bc.chiudi()
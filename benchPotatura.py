@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from Blockchain import Blockchain
+from Minatore import calcola_hash
+from Validatore import PREV_HASH_GENESI, riga_da_blocco
+from Merkle import radice_merkle_blocco
+
+
+# Benchmark della potatura (vedi Blockchain.pota): un nodo riceve BLOCCHI blocchi con DIMENSIONE byte di dati ciascuno,
+# a lotti di LOTTO, senza potatura e conservando il contenuto solo degli ultimi CONSERVATI blocchi. Per ogni lotto
+# si misura lo spazio occupato dal database: con la potatura resta limitato mentre la catena cresce, perché le pagine
+# liberate tornano al file system durante l'importazione. Alla fine si confrontano la velocità di importazione e la
+# durata della verifica della catena (solo gli header dei blocchi potati).
+# Uso: python benchPotatura.py [blocchi] [blocchi conservati] [byte di dati per blocco]
+
+BLOCCHI = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+CONSERVATI = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+DIMENSIONE = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+LOTTO = 500
+PUNTI = 5
+
+
+def genera_righe(n):
+    # Genera n righe valide e collegate, nel formato della tabella blockchain.
+    prev_hash = PREV_HASH_GENESI
+    carico = "x" * DIMENSIONE
+    for i in range(1, n + 1):
+        blocco = {"id": i, "prev_hash": prev_hash, "type": "transazione", "timestamp": "2022-03-16T00:00:00",
+                  "data": {"i": i, "carico": carico}, "nonce": 0}
+        blocco["merkle_root"] = radice_merkle_blocco(blocco["type"], blocco["data"])
+        blocco["hash"] = calcola_hash(blocco)
+        prev_hash = blocco["hash"]
+        yield riga_da_blocco(blocco)
+
+
+def misura(percorso, righe, potatura_blocchi):
+    # Importa le righe e restituisce (MB occupati dopo alcuni lotti, blocchi/s, secondi della verifica).
+    blockchain = Blockchain(difficolta = 0, workers = 1, percorso = percorso, potatura_blocchi = potatura_blocchi)
+    try:
+        occupati = []
+        ogni = max(1, len(righe) // LOTTO // PUNTI)
+        inizio = time.perf_counter()
+        for n, i in enumerate(range(0, len(righe), LOTTO)):
+            assert blockchain.importa_blocchi(righe[i:i + LOTTO])["rifiutato"] == None
+            if (n + 1) % ogni == 0:
+                occupati.append(blockchain.archivio.dimensione() / 1e6)
+        while blockchain.potatura_in_corso:
+            time.sleep(0.01)
+        importazione = time.perf_counter() - inizio
+
+        inizio = time.perf_counter()
+        assert blockchain.verifica_catena()["valida"]
+        return occupati, len(righe) / importazione, time.perf_counter() - inizio
+    finally:
+        blockchain.chiudi()
+
+
+if __name__ == "__main__":
+    directory = tempfile.mkdtemp()
+    try:
+        righe = list(genera_righe(BLOCCHI))
+        print("%d blocchi da %d byte di dati, potatura oltre gli ultimi %d" % (BLOCCHI, DIMENSIONE, CONSERVATI))
+        for nome, potatura_blocchi in (("senza potatura", None), ("con potatura", CONSERVATI)):
+            occupati, velocita, verifica = misura(os.path.join(directory, "%s.db" % potatura_blocchi), righe, potatura_blocchi)
+            print("%-16s MB: %s" % (nome, " ".join( "%7.1f" % mb for mb in occupati )))
+            print("%-16s %.0f blocchi/s, verifica %.2f s" % ("", velocita, verifica))
+
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import contextlib
+
+from Simulazione import Simulatore, ReteSimulata, NodoSimulato
+from NodoBlockchain import NodoBlockchainSimulato
+from benchCluster import archi_topologia, percentili, TOPOLOGIE, CARICHI
+
+
+# Esperimenti di scala sulla rete simulata (vedi Simulazione): migliaia di nodi in un solo processo, collegati secondo
+# la topologia scelta, con latenza, banda e perdita configurabili. A ogni round un nodo scelto a caso origina un
+# messaggio di gossip o un blocco e la simulazione prosegue finché la rete non è di nuovo ferma (o fino al timeout
+# simulato del round). Con --disconnessioni, prima di ogni round vengono chiuse alcune connessioni a caso, che i nodi
+# ripristinano con le riconnessioni pianificate sull'orologio simulato.
+#
+# I risultati sono in JSON: tempi di propagazione simulati, copertura, traffico ridondante (consegne per nodo raggiunto),
+# convergenza della catena (carico "blocchi") e rapporto tra tempo simulato (fino all'ultima consegna di ogni round) e tempo reale.
+# Uso: python benchSimulazione.py [--nodi 1000] [--topologia maglia] [--grado 8] [--carico gossip] [--output risultati.json]
+
+HOST = "10.0.0.1"
+PRIMA_PORTA = 1000
+
+
+class NodoSonda(NodoSimulato):
+    # Nodo simulato che registra l'istante simulato di arrivo dei messaggi di prova diffusi con gossip.
+
+    def __init__(self, host, porta, id, rete, dimensione):
+        super(NodoSonda, self).__init__(host, porta, id, rete)
+        self.carico = "x" * dimensione
+        self.arrivi = {}
+
+    def origina(self, numero):
+        self.arrivi[numero] = self.rete.simulatore.adesso
+        self.gossip({"sonda": numero, "carico": self.carico})
+        return numero
+
+    def node_message(self, node, data):
+        if isinstance(data, dict) and "sonda" in data:
+            self.arrivi.setdefault(data["sonda"], self.rete.simulatore.adesso)
+
+
+class NodoBlockchainSonda(NodoBlockchainSimulato):
+    # NodoBlockchain simulato che registra l'istante simulato in cui ogni blocco entra nella sua catena.
+
+    def __init__(self, host, porta, id, rete, percorso, difficolta, transazioni):
+        super(NodoBlockchainSonda, self).__init__(host, porta, id, rete, percorso = percorso, difficolta = difficolta)
+        self.transazioni = transazioni
+        self.arrivi = {}
+
+    def origina(self, numero):
+        for i in range(self.transazioni):
+            self.mempool.aggiungi({"da": self.id, "a": "nodo%d" % i, "importo": i, "round": numero})
+        blocco = self.mina_blocco(workers = 1)
+        if blocco == None:
+            return None
+        self.arrivi[blocco["id"]] = self.rete.simulatore.adesso
+        return blocco["id"]
+
+    def ricevi_blocchi(self, node, righe):
+        esito = super(NodoBlockchainSonda, self).ricevi_blocchi(node, righe)
+        for riga in esito["righe_inserite"]:
+            self.arrivi.setdefault(riga[0], self.rete.simulatore.adesso)
+        return esito
+
+
+def crea_nodi(opzioni, rete):
+    nodi = []
+    for i in range(opzioni["nodi"]):
+        id = "nodo%d" % i
+        if opzioni["carico"] == "blocchi":
+            nodo = NodoBlockchainSonda(HOST, PRIMA_PORTA + i, id, rete, os.path.join(opzioni["directory"], id + ".db"),
+                                       opzioni["difficolta"], opzioni["transazioni"])
+        else:
+            nodo = NodoSonda(HOST, PRIMA_PORTA + i, id, rete, opzioni["dimensione"])
+        nodo.gossip_fanout = opzioni["fanout"]
+        nodo.start()
+        nodi.append(nodo)
+    return nodi
+
+
+def disconnetti(nodi, quante, generatore):
+    # Chiude "quante" connessioni scelte a caso. Restituisce il numero di connessioni chiuse.
+    chiuse = 0
+    for _ in range(quante):
+        connessioni = generatore.choice(nodi).all_nodes()
+        if connessioni:
+            generatore.choice(connessioni).stop()
+            chiuse += 1
+    return chiuse
+
+
+def esegui_round(opzioni, rete, nodi, generatore):
+    """Esegue i round del carico. Per ogni round restituisce l'istante di origine, gli istanti di arrivo negli altri
+       nodi, i messaggi consegnati dalla rete durante il round e il tempo simulato fino all'ultima consegna."""
+    simulatore = rete.simulatore
+    esiti = []
+    for r in range(opzioni["round"]):
+        disconnetti(nodi, opzioni["disconnessioni"], generatore)
+        simulatore.esegui(fino_a = simulatore.adesso + opzioni["pausa"])
+
+        origine = generatore.choice(nodi)
+        consegnati = rete.consegnati
+        messaggio = origine.origina(r)
+        if messaggio == None:
+            continue
+
+        partenza = simulatore.adesso
+        simulatore.esegui(fino_a = partenza + opzioni["timeout"])
+        arrivi = [ n.arrivi[messaggio] - partenza for n in nodi if n is not origine and messaggio in n.arrivi ]
+        esiti.append({"partenza": partenza, "arrivi": sorted(arrivi), "consegnati": rete.consegnati - consegnati,
+                      "attivo": max(0.0, rete.ultima_consegna - partenza)})
+
+    return esiti
+
+
+def tempo_copertura(arrivi, nodi, frazione):
+    # Il tempo dopo cui "frazione" degli altri nodi ha ricevuto il messaggio (None se non è stata raggiunta).
+    necessari = max(1, int(round(frazione * (nodi - 1))))
+    return arrivi[necessari - 1] if len(arrivi) >= necessari else None
+
+
+def convergenza(nodi):
+    # Frazione dei nodi che hanno la stessa punta della catena più diffusa.
+    punte = {}
+    for n in nodi:
+        punta = n.restituisci_punta()
+        punte[punta] = punte.get(punta, 0) + 1
+    return max(punte.values()) / len(nodi)
+
+
+def benchmark(opzioni):
+    generatore = random.Random(opzioni["seme"])
+    random.seed(opzioni["seme"]) # Scelte casuali dei nodi (gossip, riconnessioni)
+
+    simulatore = Simulatore()
+    rete = ReteSimulata(simulatore, opzioni["latenza"], opzioni["variazione"], opzioni["banda"], opzioni["perdita"], opzioni["seme"])
+
+    opzioni["directory"] = tempfile.mkdtemp(prefix="benchSimulazione")
+    inizio = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            nodi = crea_nodi(opzioni, rete)
+            archi = archi_topologia(opzioni["topologia"], opzioni["nodi"], opzioni["grado"], generatore)
+            for i, j in archi:
+                nodi[i].connect_with_node(HOST, PRIMA_PORTA + j)
+            simulatore.esegui()
+            creazione = time.perf_counter() - inizio
+
+            inizio = time.perf_counter()
+            esiti = esegui_round(opzioni, rete, nodi, generatore)
+            durata = time.perf_counter() - inizio
+
+            catena = convergenza(nodi) if opzioni["carico"] == "blocchi" else None
+            gossip = [ n.statistiche_gossip() for n in nodi ]
+            for n in nodi:
+                n.stop()
+                if opzioni["carico"] == "blocchi":
+                    n.blockchain.chiudi()
+
+    finally:
+        shutil.rmtree(opzioni["directory"], ignore_errors=True)
+        del opzioni["directory"]
+
+    n = opzioni["nodi"]
+    raggiunti = sum( len(e["arrivi"]) for e in esiti )
+    return {
+        "configurazione": dict(opzioni, archi=len(archi), python=sys.version.split()[0]),
+        "risultati": {
+            "tempo_creazione_s": creazione,
+            "tempo_reale_s": durata,
+            "tempo_simulato_attivo_s": sum( e["attivo"] for e in esiti ),
+            "accelerazione": sum( e["attivo"] for e in esiti ) / durata if durata else None,
+            "round": len(esiti),
+            "latenza_propagazione": percentili([ t for e in esiti for t in e["arrivi"] ]),
+            "copertura_media": raggiunti / (len(esiti) * (n - 1)) if esiti else 0.0,
+            "copertura_50": percentili([ t for t in (tempo_copertura(e["arrivi"], n, 0.5) for e in esiti) if t != None ]),
+            "copertura_90": percentili([ t for t in (tempo_copertura(e["arrivi"], n, 0.9) for e in esiti) if t != None ]),
+            "copertura_completa": percentili([ e["arrivi"][-1] for e in esiti if len(e["arrivi"]) == n - 1 ]),
+            "consegne_per_nodo_raggiunto": sum( e["consegnati"] for e in esiti ) / raggiunti if raggiunti else None,
+            "duplicati_gossip": sum( g["duplicati"] for g in gossip ),
+            "convergenza_catena": catena,
+            "rete": rete.statistiche()
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Esperimenti di scala sulla rete simulata.")
+    parser.add_argument("--nodi", type=int, default=1000, help="numero di nodi (default: 1000)")
+    parser.add_argument("--topologia", choices=TOPOLOGIE, default="maglia", help="topologia (default: maglia)")
+    parser.add_argument("--grado", type=int, default=8, help="grado medio della maglia casuale (default: 8)")
+    parser.add_argument("--fanout", type=int, default=8, help="gossip_fanout dei nodi (default: 8)")
+    parser.add_argument("--carico", choices=CARICHI, default="gossip", help="messaggi originati a ogni round (default: gossip)")
+    parser.add_argument("--round", type=int, default=20, help="numero di messaggi originati (default: 20)")
+    parser.add_argument("--transazioni", type=int, default=10, help="transazioni per blocco (default: 10)")
+    parser.add_argument("--dimensione", type=int, default=256, help="byte del messaggio di gossip (default: 256)")
+    parser.add_argument("--difficolta", type=int, default=1, help="difficoltà della proof-of-work (default: 1)")
+    parser.add_argument("--latenza", type=float, default=0.05, help="latenza dei collegamenti in secondi (default: 0.05)")
+    parser.add_argument("--variazione", type=float, default=0.02, help="variazione massima della latenza in secondi (default: 0.02)")
+    parser.add_argument("--banda", type=float, default=1e6, help="byte al secondo in uscita da ogni nodo, 0 senza limite (default: 1e6)")
+    parser.add_argument("--perdita", type=float, default=0.0, help="probabilità di perdita di un messaggio (default: 0)")
+    parser.add_argument("--disconnessioni", type=int, default=0, help="connessioni chiuse a caso prima di ogni round (default: 0)")
+    parser.add_argument("--pausa", type=float, default=1.0, help="secondi simulati tra le disconnessioni e il round (default: 1)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="secondi simulati massimi per ogni round (default: 60)")
+    parser.add_argument("--seme", type=int, default=1, help="seme per topologia, rete e scelte dei nodi (default: 1)")
+    parser.add_argument("--output", help="file JSON in cui scrivere i risultati (default: stdout)")
+    opzioni = vars(parser.parse_args())
+
+    output = opzioni.pop("output")
+    if opzioni["nodi"] < 2:
+        parser.error("servono almeno 2 nodi")
+
+    risultati = benchmark(opzioni)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(risultati, f, indent=2)
+    else:
+        json.dump(risultati, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
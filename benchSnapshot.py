@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from Blockchain import Blockchain
+from Minatore import calcola_hash
+from Validatore import PREV_HASH_GENESI, riga_da_blocco
+from Merkle import radice_merkle_blocco
+
+
+# Benchmark dell'avvio di un nodo nuovo: importazione di tutta la catena come durante la sincronizzazione, oppure
+# caricamento di uno snapshot (con e senza checkpoint) e importazione dei soli blocchi successivi ("coda").
+# I blocchi sono generati con difficoltà 0. Uso: python benchSnapshot.py [blocchi] [coda]
+
+BLOCCHI = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+CODA = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+LOTTO = 500
+
+
+def genera_righe(n):
+    # Genera n righe valide e collegate, nel formato della tabella blockchain.
+    prev_hash = PREV_HASH_GENESI
+    for i in range(1, n + 1):
+        blocco = {"id": i, "prev_hash": prev_hash, "type": "transazione", "timestamp": "2022-03-16T00:00:00", "data": {"i": i}, "nonce": 0}
+        blocco["merkle_root"] = radice_merkle_blocco(blocco["type"], blocco["data"])
+        blocco["hash"] = calcola_hash(blocco)
+        prev_hash = blocco["hash"]
+        yield riga_da_blocco(blocco)
+
+
+def importa(bc, righe):
+    for i in range(0, len(righe), LOTTO):
+        esito = bc.importa_blocchi(righe[i:i + LOTTO])
+        assert esito["rifiutato"] == None, esito
+
+
+def avvio(nome, directory, snapshot = None, checkpoint = None, coda = ()):
+    # Crea una blockchain vuota, carica lo snapshot e importa la coda. Restituisce i secondi impiegati.
+    percorso = os.path.join(directory, nome + ".db")
+    inizio = time.perf_counter()
+    bc = Blockchain(difficolta = 0, workers = 1, percorso = percorso, checkpoint = checkpoint)
+    if snapshot != None:
+        bc.carica_snapshot(snapshot)
+    importa(bc, coda)
+    durata = time.perf_counter() - inizio
+    assert bc.restituisci_punta()[0] == BLOCCHI, bc.restituisci_punta()
+    bc.chiudi()
+    return durata
+
+
+directory = tempfile.mkdtemp()
+try:
+    righe = list(genera_righe(BLOCCHI))
+    sorgente = Blockchain(difficolta = 0, workers = 1, percorso = os.path.join(directory, "sorgente.db"))
+    importa(sorgente, righe)
+
+    percorso_snapshot = os.path.join(directory, "snapshot.bin")
+    inizio = time.perf_counter()
+    checkpoint = sorgente.crea_snapshot(percorso_snapshot, BLOCCHI - CODA)
+    print("Snapshot di %d blocchi: %.2f s, %.1f MB" % (BLOCCHI - CODA, time.perf_counter() - inizio, os.path.getsize(percorso_snapshot) / 1e6))
+    sorgente.chiudi()
+
+    print("%-40s %10s" % ("avvio con %d blocchi" % BLOCCHI, "secondi"))
+    print("%-40s %10.2f" % ("sincronizzazione completa", avvio("completa", directory, coda = righe)))
+    print("%-40s %10.2f" % ("snapshot senza checkpoint + coda", avvio("senza_checkpoint", directory, percorso_snapshot, None, righe[-CODA:] if CODA else [])))
+    print("%-40s %10.2f" % ("snapshot con checkpoint + coda", avvio("checkpoint", directory, percorso_snapshot, checkpoint, righe[-CODA:] if CODA else [])))
+
+finally:
+    shutil.rmtree(directory, ignore_errors=True)
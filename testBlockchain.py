@@ -22,9 +22,9 @@ time.sleep(1)
 blocco2 = bc.crea_blocco("Francesco Pasquale", "transazione2")
 bc.aggiungi_blocco(blocco2)
 print('stampa registro:')
-c = bc.db.cursor()
-data = c.execute("SELECT * FROM blockchain").fetchall()
-print(data)
+for blocco in bc.cerca_blocchi():
+    print(blocco)
 # nodo.condividi_db("Nodo 2")
 
 nodo.stop()
+bc.chiudi()
@@ -0,0 +1,80 @@
+import pytest
+
+from Codifica import (codifica_riga, codifica_riga_header, decodifica_riga, codifica_messaggio, decodifica_messaggio,
+                      riga_testo, riga_da_testo, timestamp_binario, timestamp_testo, MESSAGGIO_BLOCCHI, MESSAGGIO_HEADER)
+from Merkle import TIPO_TRANSAZIONI, radice_merkle_blocco
+from Minatore import calcola_hash
+from Validatore import PREV_HASH_GENESI, blocco_da_riga, riga_da_blocco, riga_header_da_riga, header_da_riga
+
+
+# Codifica binaria dei blocchi (vedi Codifica): ogni riga codificata e decodificata deve restare identica, compreso
+# il blocco ricostruito su cui è calcolata la proof-of-work. Uso: python -m pytest test_codifica.py
+
+TIMESTAMP = ("2022-03-16T10:20:30.123456", "2022-03-16T10:20:30", "1969-12-31T23:59:59.999999",
+             "2022-03-16T10:20:30+02:00", "2022-03-16 10:20:30", "non una data")
+
+
+def righe(timestamp = TIMESTAMP):
+    prev_hash = PREV_HASH_GENESI
+    for i, t in enumerate(timestamp, 1):
+        type, data = ("transazione", "testo è UTF-8") if i % 2 else (TIPO_TRANSAZIONI, [{"i": i}, {"nome": "àé"}])
+        blocco = {"id": i, "prev_hash": prev_hash, "type": type, "timestamp": t, "data": data, "nonce": i * 7919}
+        blocco["merkle_root"] = radice_merkle_blocco(type, data)
+        blocco["hash"] = calcola_hash(blocco)
+        prev_hash = blocco["hash"]
+        yield riga_da_blocco(blocco)
+
+
+@pytest.mark.parametrize("timestamp", TIMESTAMP)
+def test_timestamp(timestamp):
+    assert timestamp_testo(timestamp_binario(timestamp)) == timestamp
+
+
+def test_timestamp_interi():
+    assert isinstance(timestamp_binario("2022-03-16T10:20:30.123456"), int)
+    assert isinstance(timestamp_binario("2022-03-16T10:20:30+02:00"), str)
+
+
+def test_riga_e_ritorno():
+    for riga in righe():
+        codificata = codifica_riga(riga)
+        decodificata, fine = decodifica_riga(codificata)
+        assert decodificata == riga and fine == len(codificata)
+        blocco = blocco_da_riga(decodificata)
+        assert calcola_hash(blocco) == blocco["hash"]
+
+
+def test_header_e_ritorno():
+    for riga in righe():
+        header = riga_header_da_riga(riga)
+        decodificato, _ = decodifica_riga(codifica_riga_header(header))
+        assert decodificato == header
+        assert calcola_hash(header_da_riga(decodificato)) == blocco_da_riga(riga)["hash"]
+
+
+def test_riga_testuale_e_ritorno():
+    for riga in righe():
+        assert riga_da_testo(riga_testo(riga)) == riga
+
+
+def test_messaggio_e_ritorno():
+    tutte = list(righe())
+    assert decodifica_messaggio(codifica_messaggio(MESSAGGIO_BLOCCHI, tutte)) == (MESSAGGIO_BLOCCHI, tutte)
+
+    header = [ riga_header_da_riga(r) for r in tutte ]
+    assert decodifica_messaggio(codifica_messaggio(MESSAGGIO_HEADER, header)) == (MESSAGGIO_HEADER, header)
+    assert decodifica_messaggio(codifica_messaggio(MESSAGGIO_BLOCCHI, [])) == (MESSAGGIO_BLOCCHI, [])
+
+
+def test_messaggio_non_valido():
+    messaggio = codifica_messaggio(MESSAGGIO_BLOCCHI, list(righe()))
+    for alterato in (b"", b"\x09" + messaggio[1:], messaggio[:-1], messaggio[:40]):
+        with pytest.raises(ValueError):
+            decodifica_messaggio(alterato)
+
+
+def test_versione_non_supportata():
+    codificata = bytearray(codifica_riga(next(righe())))
+    codificata[0] = 99
+    with pytest.raises(ValueError):
+        decodifica_riga(codificata)
@@ -0,0 +1,80 @@
+import pytest
+
+from Merkle import (TIPO_TRANSAZIONI, hash_transazione, radice_merkle, radice_merkle_blocco, prova_merkle, verifica_prova,
+                    combina, SINISTRA, DESTRA)
+from Minatore import calcola_hash
+from Validatore import PREV_HASH_GENESI, controlla_blocco
+
+
+# Controlli della radice di Merkle e delle prove di inclusione (vedi Merkle). Uso: python -m pytest test_merkle.py
+
+
+def foglie(n):
+    return [ hash_transazione({"i": i}) for i in range(n) ]
+
+
+def blocco_transazioni(transazioni):
+    # Blocco iniziale di tipo TIPO_TRANSAZIONI con radice e hash corretti (difficoltà 0).
+    blocco = {"id": 1, "prev_hash": PREV_HASH_GENESI, "type": TIPO_TRANSAZIONI, "timestamp": "2022-03-16T00:00:00",
+              "data": transazioni, "nonce": 0}
+    blocco["merkle_root"] = radice_merkle_blocco(blocco["type"], blocco["data"])
+    blocco["hash"] = calcola_hash(blocco)
+    return blocco
+
+
+def test_radice_casi_base():
+    f = foglie(3)
+    assert radice_merkle(f[:1]) == f[0]
+    assert radice_merkle(f[:2]) == combina(f[0], f[1])
+    assert radice_merkle(f) == combina(combina(f[0], f[1]), combina(f[2], f[2]))
+
+
+def test_radice_dipende_da_ordine_e_contenuto():
+    f = foglie(4)
+    assert radice_merkle(f) != radice_merkle([f[1], f[0], f[2], f[3]])
+    assert radice_merkle(f) != radice_merkle(f[:3])
+
+
+def test_radice_blocco_rifiuta_transazioni_duplicate():
+    with pytest.raises(ValueError):
+        radice_merkle_blocco(TIPO_TRANSAZIONI, ['a', 'b', 'c', 'c'])
+    with pytest.raises(ValueError):
+        radice_merkle_blocco(TIPO_TRANSAZIONI, ['a', 'b', 'c', 'd', 'e', 'f', 'e', 'f'])
+
+
+def test_blocco_con_ultima_transazione_ripetuta_rifiutato():
+    # [a, b, c] e [a, b, c, c] hanno la stessa radice: il blocco alterato ha lo stesso hash ma va rifiutato.
+    blocco = blocco_transazioni(['a', 'b', 'c'])
+    assert controlla_blocco(blocco, 0) == None
+
+    alterato = dict(blocco, data=['a', 'b', 'c', 'c'])
+    assert radice_merkle([ hash_transazione(t) for t in alterato["data"] ]) == blocco["merkle_root"]
+    assert calcola_hash(alterato) == blocco["hash"]
+    assert controlla_blocco(alterato, 0) != None
+
+
+@pytest.mark.parametrize("n", range(1, 18))
+def test_prove_di_tutte_le_foglie(n):
+    f = foglie(n)
+    radice = radice_merkle(f)
+    for indice in range(n):
+        prova = prova_merkle(f, indice)
+        assert verifica_prova(f[indice], prova, radice)
+        assert len(prova) == (n - 1).bit_length()
+
+
+def test_prova_alterata_non_valida():
+    f = foglie(5)
+    radice = radice_merkle(f)
+    prova = prova_merkle(f, 2)
+
+    assert not verifica_prova(f[3], prova, radice)
+    assert not verifica_prova(f[2], prova[:-1], radice)
+    assert not verifica_prova(f[2], [[h, DESTRA if p == SINISTRA else SINISTRA] for h, p in prova], radice)
+    assert not verifica_prova(f[2], [[prova[0][0], "x"]] + prova[1:], radice)
+    assert not verifica_prova(f[2], [["zz", DESTRA]], radice)
+
+
+def test_prova_indice_fuori_intervallo():
+    with pytest.raises(IndexError):
+        prova_merkle(foglie(3), 3)
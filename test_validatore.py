@@ -0,0 +1,104 @@
+import pytest
+
+from Merkle import TIPO_TRANSAZIONI, radice_merkle_blocco
+from Minatore import Minatore, calcola_hash
+from Validatore import (PREV_HASH_GENESI, Validatore, controlla_blocco, controlla_header, controlla_collegamento,
+                        blocco_da_riga, riga_da_blocco)
+
+
+# Controlli dei blocchi (vedi Validatore): radice di Merkle, hash, proof-of-work e collegamento.
+# Uso: python -m pytest test_validatore.py
+
+DIFFICOLTA = 2
+
+
+def crea_blocco(id, prev_hash, data, type = "transazione", difficolta = DIFFICOLTA):
+    blocco = {"id": id, "prev_hash": prev_hash, "type": type, "timestamp": "2022-03-16T00:00:%02d.000001" % id,
+              "data": data, "nonce": 0}
+    blocco["merkle_root"] = radice_merkle_blocco(type, data)
+    return Minatore(difficolta, workers = 1).mina(blocco)
+
+
+def crea_catena(n):
+    catena = []
+    prev_hash = PREV_HASH_GENESI
+    for i in range(1, n + 1):
+        catena.append( crea_blocco(i, prev_hash, [{"da": "a", "a": "b", "importo": i}, {"i": i}], TIPO_TRANSAZIONI) )
+        prev_hash = catena[-1]["hash"]
+    return catena
+
+
+@pytest.fixture(scope="module")
+def catena():
+    return crea_catena(4)
+
+
+def test_blocco_valido(catena):
+    for precedente, blocco in zip([None] + catena, catena):
+        assert controlla_blocco(blocco, DIFFICOLTA) == None
+        assert controlla_collegamento(blocco, precedente) == None
+
+
+def test_dati_alterati(catena):
+    alterato = dict(catena[0], data=[{"da": "a", "a": "b", "importo": 1000}, {"i": 1}])
+    assert "merkle_root" in controlla_blocco(alterato, DIFFICOLTA)
+
+    # Ricalcolando la radice cambia l'header, che non corrisponde più all'hash del blocco
+    alterato["merkle_root"] = radice_merkle_blocco(alterato["type"], alterato["data"])
+    assert controlla_blocco(alterato, DIFFICOLTA) == "hash non corrispondente all'header del blocco"
+
+
+def test_header_alterato(catena):
+    for campo, valore in (("timestamp", "2022-03-17T00:00:00"), ("nonce", catena[0]["nonce"] + 1), ("type", "altro"),
+                          ("hash", "0" * 128), ("merkle_root", catena[1]["merkle_root"])):
+        alterato = dict(catena[0], **{campo: valore})
+        assert controlla_blocco(alterato, DIFFICOLTA) != None
+
+
+def test_proof_of_work_insufficiente():
+    # Un blocco con l'hash corretto ma senza zeri iniziali viene rifiutato
+    blocco = crea_blocco(1, PREV_HASH_GENESI, "dati", difficolta = 0)
+    while blocco["hash"].startswith("0"):
+        blocco["nonce"] += 1
+        blocco["hash"] = calcola_hash(blocco)
+
+    assert controlla_blocco(blocco, 0) == None
+    assert controlla_blocco(blocco, 1) == "proof-of-work non soddisfatta (difficoltà 1)"
+    assert controlla_header(blocco, 1) != None
+
+
+def test_blocco_senza_contenuto(catena):
+    assert controlla_blocco(dict(catena[0], data=None), DIFFICOLTA) == "blocco senza contenuto"
+    assert controlla_header(dict(catena[0], data=None), DIFFICOLTA) == None
+
+
+def test_collegamento(catena):
+    assert controlla_collegamento(catena[1], None) != None
+    assert controlla_collegamento(catena[2], catena[0]) != None
+    assert controlla_collegamento(dict(catena[1], prev_hash=catena[2]["hash"]), catena[0]) != None
+
+
+def test_riga_e_ritorno(catena):
+    for blocco in catena:
+        assert blocco_da_riga(riga_da_blocco(blocco)) == blocco
+
+
+def test_verifica_blocco(catena):
+    validatore = Validatore(DIFFICOLTA, workers = 1)
+    assert validatore.verifica_blocco(catena[1], catena[0])
+    assert not validatore.verifica_blocco(dict(catena[1], data=[]), catena[0])
+    assert "merkle_root" in validatore.errore
+    assert not validatore.verifica_blocco({"id": 2}, catena[0])
+
+
+def test_verifica_lotti(catena):
+    validatore = Validatore(DIFFICOLTA, workers = 1)
+    righe = [ riga_da_blocco(b) for b in catena ]
+    esito = validatore.verifica_lotti([righe[:2], righe[2:]])
+    assert esito["valida"] and esito["blocchi"] == len(catena)
+
+    alterata = list(righe[2])
+    alterata[4] = '[{"i": 3}]'
+    esito = validatore.verifica_lotti([righe[:2], [alterata, righe[3]]])
+    assert not esito["valida"]
+    assert [ id for id, _ in esito["errori"] ] == [3]